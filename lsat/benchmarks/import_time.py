@@ -0,0 +1,58 @@
+import argparse
+import subprocess
+import sys
+from statistics import median
+
+
+# modules that are only needed by some features, and must not be loaded by just importing the package
+HEAVY_MODULES = ['torchvision', 'torchtext', 'spacy', 'py7zr', 'h5py', 'cv2', 'pandas']
+# module imported and heavy modules that it is allowed to load
+MODULES = {
+    'lsat.typing': [],
+    'lsat.dataset.transforms': [],
+    'lsat.dataset.PyTorchDataset': [],
+    'lsat.dataset.KeypointStore': [],
+    'lsat.dataset.KeypointsH5Dataset': ['h5py'],
+    'lsat.helpers.metadata': ['pandas'],
+}
+
+def measure_import(module: str) -> tuple[float, set[str]]:
+    '''Imports module in a new interpreter, returns its cumulative import time in ms and the top level modules it loaded'''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().splitlines()[-1])
+    cumulative = 0.0
+    loaded: set[str] = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        loaded.add(name.strip().split('.')[0])
+        if name.strip() == module:
+            cumulative = int(cumulative_us) / 1000
+    return cumulative, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description='''Measures the import time of the lsat modules and checks that they do not load heavy optional dependencies.''')
+    parser.add_argument('--repeat', '-r', help='times each import is measured, the median is reported', type=int, default=5)
+    parser.add_argument('--max-ms', '-m', help='fails if the median import time of a module exceeds this value', type=float, default=None)
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<36} {'median ms':>10}  heavy modules loaded")
+    for module, allowed in MODULES.items():
+        try:
+            measures = [measure_import(module) for _ in range(args.repeat)]
+        except ImportError as e:
+            print(f"{module:<36} {'failed':>10}  {e}")
+            failed = True
+            continue
+        time_ms = median(m[0] for m in measures)
+        heavy = sorted(m for m in measures[0][1] if m in HEAVY_MODULES and m not in allowed)
+        print(f"{module:<36} {time_ms:>10.1f}  {', '.join(heavy) if heavy else '-'}")
+        if heavy or (args.max_ms is not None and time_ms > args.max_ms):
+            failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import product
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset, Subset
+
+
+# halpe body and hand keypoints, as used in the examples of the dataset
+KEYPOINTS_TO_USE = list(range(26)) + list(range(94, 136))
+HALPE_KEYPOINTS = 136
+HALPE_SHOULDERS = (5, 6)
+# clip modes benchmarked: loads clips and loads keypoints
+MODES = {
+    'keypoints': (False, True),
+    'clips': (True, False),
+    'both': (True, True),
+}
+WORDS = ["hola", "buenas", "noches", "la", "ley", "de", "el", "congreso", "aprobó", "semana", "personas", "sordas", "lengua", "señas", "argentina"]
+
+def _write_video(path: Path, frames: int, size: tuple[int, int], fps: int) -> None:
+    from torchvision.io import write_video
+    width, height = size
+    gradient = torch.linspace(0, 255, width).to(torch.uint8)[None, None, :, None].expand(frames, height, width, 3)
+    # a band moving over the frames, so frames are not all equal
+    shift = (torch.arange(frames)[:, None, None, None] * 4 + torch.arange(height)[None, :, None, None]) % 256
+    write_video(str(path), ((gradient.int() + shift) % 256).to(torch.uint8), fps)
+
+def _keypoint_frames(rng: np.random.Generator, frames: int, roi: dict[str, float]) -> list[dict[str, Any]]:
+    '''Returns KeypointData of a person moving slightly inside the roi, in halpe format'''
+    base = rng.uniform([roi['x1'], roi['y1']], [roi['x1'] + roi['width'], roi['y1'] + roi['height']], (HALPE_KEYPOINTS, 2))
+    keypoints = []
+    for i_frame in range(frames):
+        xy = base + rng.normal(0, 2, base.shape)
+        confidence = rng.uniform(0, 1, (HALPE_KEYPOINTS, 1))
+        keypoints.append({
+            'image_id': f"{i_frame}.jpg",
+            'category_id': 1,
+            'keypoints': np.round(np.concatenate([xy, confidence], axis=1), 3).flatten().tolist(),
+            'score': 1.,
+            'box': [roi['x1'], roi['y1'], roi['width'], roi['height']],
+            'idx': [0.]
+        })
+    return keypoints
+
+def build_synthetic_tree(path: Path, videos: int, clips_per_video: int, frames: int, size: tuple[int, int], fps: int = 30, seed: int = 0) -> Path:
+    '''Builds an LSA-T shaped database in path: cuts/{video}/{i}.mp4 with its cut (.json) and signer (_signer.json) files, read by PyTorchDataset from cuts,
+    and keypoints.h5, meta.csv and clips, read by KeypointsH5Dataset from path. Returns the root of the cuts'''
+    from lsat.helpers.keypoints_h5 import write_signer_keypoints
+    from lsat.helpers.keypoint_subsets import KEYPOINTS_AMOUNT, CHANNELS
+    import h5py
+    rng = np.random.default_rng(seed)
+    cuts_path = path / "cuts"
+    (path / "clips").mkdir(parents=True, exist_ok=True)
+    width, height = size
+    rows = []
+    with h5py.File(path / "keypoints.h5", 'w') as hdf5_file:
+        for i_video in range(videos):
+            video = f"video_{i_video}"
+            (cuts_path / video).mkdir(parents=True, exist_ok=True)
+            for i_clip in range(clips_per_video):
+                clip_path = cuts_path / video / f"{i_clip}.mp4"
+                _write_video(clip_path, frames, size, fps)
+                label = " ".join(rng.choice(WORDS, rng.integers(2, 8)))
+                start = i_clip * (frames / fps + 1)
+                with (cuts_path / video / f"{i_clip}.json").open('w') as data_file:
+                    json.dump({'label': label, 'start': start, 'end': start + frames / fps, 'video': video, 'playlist': f"playlist_{i_video % 2}"}, data_file)
+                roi = {'x1': float(width // 4), 'y1': float(height // 8), 'width': float(width // 2), 'height': float(height * 3 // 4)}
+                # scores and roi go before the keypoints, as read_signer_header expects
+                with (cuts_path / video / f"{i_clip}_signer.json").open('w') as signer_file:
+                    json.dump({'scores': [float(rng.uniform(.6, 1))], 'roi': roi, 'keypoints': _keypoint_frames(rng, frames, roi)}, signer_file)
+
+                clip_id = f"{video}_{i_clip}"
+                shutil.copyfile(clip_path, path / "clips" / f"{clip_id}.mp4")
+                signer = hdf5_file.create_group(clip_id).create_group("signer_0")
+                boxes = np.tile([roi['x1'], roi['y1'], roi['x1'] + roi['width'], roi['y1'] + roi['height']], (frames, 1))
+                signer.create_dataset('boxes', data=boxes.astype(np.float16))
+                write_signer_keypoints(signer, rng.uniform(0, width, (frames, KEYPOINTS_AMOUNT, len(CHANNELS))).astype(np.float16))
+                rows.append({'id': clip_id, 'video': video, 'label': label, 'infered_signer': '0', 'infered_signer_confidence': '1.0'})
+    with (path / "meta.csv").open('w', newline='') as meta_file:
+        writer = csv.DictWriter(meta_file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return cuts_path
+
+def use_whitespace_tokenizer() -> None:
+    '''Makes torchtext return a whitespace tokenizer instead of the spaCy one, so labels are tokenized offline. Done before importing the datasets,
+    as some versions import get_tokenizer when they are imported'''
+    try:
+        import torchtext.data.utils
+    except ImportError:
+        return
+    get_tokenizer = torchtext.data.utils.get_tokenizer
+    torchtext.data.utils.get_tokenizer = lambda tokenizer, language='en': str.split if tokenizer == 'spacy' else get_tokenizer(tokenizer, language)
+
+
+# each benchmarked transform is built by a function given the transforms module of the measured version, the dataset and the frames of the clips,
+# and is set to the attribute of the dataset of its TRANSFORMS entry. Keypoints are the list of KeypointData of the signer json files, or (T, K, 3) tensors
+# with the store backend for the transforms that support them
+def _frames_reduction(transforms: Any, dataset: Any, frames: int) -> Callable:
+    return transforms.get_frames_reduction_transform(16)
+
+def _roi_selector(transforms: Any, dataset: Any, frames: int) -> Callable:
+    roi = {'x1': 0., 'y1': 0., 'width': 64., 'height': 96.}
+    return transforms.get_roi_selector_transform(96, 64, [roi] * frames)
+
+def _keypoint_format(transforms: Any, dataset: Any, frames: int) -> Callable:
+    keypoint_format = transforms.get_keypoint_format_transform(KEYPOINTS_TO_USE)
+    return lambda keypoints: [keypoint_format(frame) for frame in keypoints]
+
+def _clip_keypoint_format(transforms: Any, dataset: Any, frames: int) -> Callable:
+    return transforms.get_clip_keypoint_format_transform(KEYPOINTS_TO_USE)
+
+def _norm_to_nose(transforms: Any, dataset: Any, frames: int) -> Callable:
+    keypoint_format = transforms.get_keypoint_format_transform(KEYPOINTS_TO_USE)
+    return lambda keypoints: [transforms.keypoints_norm_to_nose_transform(keypoint_format(frame)) for frame in keypoints]
+
+def _interpolate_keypoints(transforms: Any, dataset: Any, frames: int) -> Callable:
+    keypoint_format = transforms.get_keypoint_format_transform(KEYPOINTS_TO_USE)
+    return lambda keypoints: transforms.interpolate_keypoints_transform([keypoint_format(frame) for frame in keypoints])
+
+def _keypoints_tensor(transforms: Any) -> Callable:
+    '''Returns a transform of the keypoints of a clip to a (T, K, 3) tensor'''
+    clip_format = transforms.get_clip_keypoint_format_transform(KEYPOINTS_TO_USE)
+    return lambda keypoints: clip_format(keypoints).permute(0, 2, 1)
+
+def _interpolate_keypoints_batched(transforms: Any, dataset: Any, frames: int) -> Callable:
+    to_tensor = _keypoints_tensor(transforms)
+    interpolate = transforms.get_interpolate_keypoints_transform()
+    return lambda keypoints: interpolate(to_tensor(keypoints))
+
+def _keypoint_pipeline(transforms: Any, dataset: Any, frames: int) -> Callable:
+    from lsat.dataset.keypoint_transforms import KeypointPipeline, NormalizeKeypoints, RandomAffine, KeypointDropout
+    to_tensor = _keypoints_tensor(transforms)
+    shoulders = tuple(KEYPOINTS_TO_USE.index(index) for index in HALPE_SHOULDERS)
+    pipeline = KeypointPipeline([NormalizeKeypoints("shoulders", "shoulders", 0, shoulders), RandomAffine(15, (.9, 1.1)), KeypointDropout(.05)])
+    return lambda keypoints: pipeline(to_tensor(keypoints))
+
+def _label_to_tensor(transforms: Any, dataset: Any, frames: int) -> Callable:
+    return transforms.get_label_to_tensor_transform(dataset.get_token_idx('<bos>'), dataset.get_token_idx('<eos>'), dataset.tokenizer, dataset.vocab)
+
+# attribute each transform is set to, its builder and if it only takes keypoints as KeypointData
+TRANSFORMS: dict[str, tuple[str, Callable[[Any, Any, int], Callable], bool]] = {
+    'frames_reduction': ('clip_transform', _frames_reduction, False),
+    'roi_selector': ('clip_transform', _roi_selector, False),
+    'keypoint_format': ('keypoints_transform', _keypoint_format, True),
+    'clip_keypoint_format': ('keypoints_transform', _clip_keypoint_format, False),
+    'norm_to_nose': ('keypoints_transform', _norm_to_nose, True),
+    'interpolate_keypoints': ('keypoints_transform', _interpolate_keypoints, True),
+    'interpolate_keypoints_batched': ('keypoints_transform', _interpolate_keypoints_batched, False),
+    'keypoint_pipeline': ('keypoints_transform', _keypoint_pipeline, False),
+    'label_to_tensor': ('label_transform', _label_to_tensor, False),
+}
+
+def materialize_sample(sample: tuple) -> tuple:
+    '''Collate function that decodes lazily loaded clips and keeps samples as loaded otherwise. It runs in the workers, so decoding is measured there and clips
+    can be sent to the main process (lazy clips can not be pickled)'''
+    if sample[0] is not None and not isinstance(sample[0], (torch.Tensor, list)):
+        return (list(sample[0]), *sample[1:])
+    return sample
+
+def measure(dataset: Dataset, samples: int, workers: int) -> dict[str, Any]:
+    '''Loads the first samples of the dataset with a DataLoader, returns the samples per second (from the first sample, so the start of the workers is not counted)
+    and the time until the first sample'''
+    loader = DataLoader(Subset(dataset, range(min(samples, len(dataset)))), batch_size=None, num_workers=workers, collate_fn=materialize_sample)  # type: ignore
+    start = time.perf_counter()
+    first = None
+    loaded = 0
+    for _ in loader:
+        loaded += 1
+        if first is None:
+            first = time.perf_counter()
+    end = time.perf_counter()
+    return {
+        'samples': loaded,
+        'seconds': end - start,
+        'first_sample_s': (first or end) - start,
+        'samples_per_second': (loaded - 1) / (end - first) if first is not None and loaded > 1 and end > first else 0.,
+    }
+
+def _filter_kwargs(cls: type, kwargs: dict[str, Any]) -> Optional[dict[str, Any]]:
+    '''Returns the kwargs if the version of the class accepts all of them, None otherwise'''
+    import inspect
+    parameters = inspect.signature(cls.__init__).parameters
+    return kwargs if all(name in parameters for name in kwargs) else None
+
+def run(args: argparse.Namespace, root: Path) -> list[dict[str, Any]]:
+    '''Measures the datasets of the imported lsat version over the tree in root for every configuration'''
+    import lsat.dataset.transforms as transforms
+    results = []
+    configs: list[tuple[str, str, str]] = []
+    if 'pytorch' in args.datasets:
+        if not args.spacy:
+            use_whitespace_tokenizer()
+        configs += [('pytorch', backend, mode) for backend, mode in product(args.backends, args.modes)]
+    if 'h5' in args.datasets:
+        configs += [('h5', 'h5', mode) for mode in args.modes if mode != 'clips']
+    for dataset_name, backend, mode in configs:
+        load_clips, load_keypoints = MODES[mode]
+        try:
+            if dataset_name == 'pytorch':
+                from lsat.dataset.PyTorchDataset import PyTorchDataset
+                kwargs = {'load_clips': load_clips, 'load_keypoints': load_keypoints}
+                if backend != 'json':
+                    kwargs['keypoints_backend'] = backend
+                accepted = _filter_kwargs(PyTorchDataset, kwargs)
+                dataset = None if accepted is None else PyTorchDataset(str(root / "cuts"), "train", **accepted)
+            else:
+                from lsat.dataset.KeypointsH5Dataset import KeypointsH5Dataset
+                dataset = KeypointsH5Dataset(str(root), "train", load_clips=load_clips)
+        except ImportError as e:
+            print(f"{dataset_name}/{backend}/{mode}: unavailable ({e})")
+            continue
+        if dataset is None:
+            print(f"{dataset_name}/{backend}/{mode}: unsupported by this version")
+            continue
+
+        for transform_name in ['none'] + [name for name in args.transforms if name != 'none']:
+            attributes = {'clip_transform': None, 'keypoints_transform': None, 'label_transform': None}
+            if transform_name != 'none':
+                attribute, build, json_only = TRANSFORMS[transform_name]
+                if (attribute == 'clip_transform' and not load_clips) or (attribute == 'keypoints_transform' and not load_keypoints):
+                    continue
+                if json_only and backend != 'json':
+                    continue
+                # the h5 dataset has no tokenizer nor vocab, and its keypoints are already tensors
+                if dataset_name == 'h5' and attribute != 'clip_transform':
+                    continue
+                try:
+                    attributes[attribute] = build(transforms, dataset, args.frames)
+                except (AttributeError, ImportError, TypeError) as e:
+                    print(f"{dataset_name}/{backend}/{mode}/{transform_name}: unavailable ({type(e).__name__}: {e})")
+                    continue
+            for name, value in attributes.items():
+                setattr(dataset, name, value)
+            for workers in args.workers:
+                result: dict[str, Any] = {'dataset': dataset_name, 'backend': backend, 'mode': mode, 'transform': transform_name, 'workers': workers}
+                try:
+                    result.update(measure(dataset, args.samples, workers))
+                except Exception as e:
+                    # errors of workers include their traceback, only its last line is kept
+                    result['error'] = f"{type(e).__name__}: {str(e).strip().splitlines()[-1] if str(e).strip() else ''}"
+                results.append(result)
+                print(f"{config_key(result):<56} " + (
+                    f"{result['samples_per_second']:9.1f} samples/s | first sample {result['first_sample_s']:.2f} s" if 'error' not in result else result['error']))
+    return results
+
+def config_key(result: dict[str, Any]) -> str:
+    return f"{result['dataset']}/{result['backend']}/{result['mode']}/{result['transform']}/{result['workers']}"
+
+def compare(results: list[dict[str, Any]], baseline: list[dict[str, Any]]) -> None:
+    '''Prints the samples per second of each configuration in both results'''
+    previous = {config_key(result): result for result in baseline}
+    print(f"{'configuration':<56} {'old':>9} {'new':>9}  speedup")
+    for result in results:
+        old = previous.get(config_key(result))
+        if old is None or 'error' in old or 'error' in result:
+            old_text = "-" if old is None else "error" if 'error' in old else f"{old['samples_per_second']:9.1f}"
+            new_text = "error" if 'error' in result else f"{result['samples_per_second']:9.1f}"
+            print(f"{config_key(result):<56} {old_text:>9} {new_text:>9}")
+            continue
+        speedup = result['samples_per_second'] / old['samples_per_second'] if old['samples_per_second'] > 0 else float('inf')
+        print(f"{config_key(result):<56} {old['samples_per_second']:9.1f} {result['samples_per_second']:9.1f}  {speedup:.2f}x")
+
+def run_ref(args: argparse.Namespace, root: Path, ref: str, output: Path) -> list[dict[str, Any]]:
+    '''Runs this benchmark with the version of lsat in the git ref (checked out in a temporary worktree) over a copy of the tree, so files each version
+    stores next to the database (splits, indexes, caches) do not affect the other'''
+    repository = Path(__file__).resolve().parents[2]
+    with tempfile.TemporaryDirectory(prefix="lsat_bench_ref_") as temp_path:
+        worktree = Path(temp_path) / "worktree"
+        subprocess.run(['git', 'worktree', 'add', '--detach', str(worktree), ref], cwd=repository, check=True, capture_output=True)
+        try:
+            ref_root = Path(temp_path) / "data"
+            shutil.copytree(root, ref_root, ignore=shutil.ignore_patterns("splits", "metadata.parquet", "keypoints_store", "clip_cache"))
+            command = [sys.executable, str(Path(__file__).resolve()), '--root', str(ref_root), '--output', str(output),
+                '--samples', str(args.samples), '--frames', str(args.frames),
+                '--modes', *args.modes, '--backends', *args.backends, '--datasets', *args.datasets, '--transforms', *args.transforms,
+                '--workers', *map(str, args.workers)] + (['--spacy'] if args.spacy else [])
+            subprocess.run(command, env={**os.environ, 'PYTHONPATH': str(worktree)}, check=True)
+        finally:
+            subprocess.run(['git', 'worktree', 'remove', '--force', str(worktree)], cwd=repository, capture_output=True)
+    with output.open() as output_file:
+        return json.load(output_file)['results']
+
+def main():
+    parser = argparse.ArgumentParser(description='''Builds a synthetic LSA-T shaped database offline and measures the samples per second the datasets load with each mode,
+    backend, transform of lsat.dataset.transforms and amount of DataLoader workers. With --compare-ref the same is measured with the version of a git ref and both are compared.''')
+    parser.add_argument('--root', help='existing database used instead of building a synthetic one, with the layout build_synthetic_tree creates', default=None)
+    parser.add_argument('--videos', help='videos of the synthetic database', type=int, default=4)
+    parser.add_argument('--clips-per-video', help='clips of each video', type=int, default=8)
+    parser.add_argument('--frames', '-f', help='frames of each synthetic clip', type=int, default=60)
+    parser.add_argument('--size', help='width and height of the synthetic clips', type=int, nargs=2, default=[320, 240])
+    parser.add_argument('--samples', '-n', help='samples loaded in each configuration', type=int, default=24)
+    parser.add_argument('--modes', '-m', help='data loaded', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--backends', help='keypoint backends of PyTorchDataset', nargs='+', choices=['json', 'store'], default=['json', 'store'])
+    parser.add_argument('--datasets', help='datasets measured, h5 is KeypointsH5Dataset', nargs='+', choices=['pytorch', 'h5'], default=['pytorch', 'h5'])
+    parser.add_argument('--transforms', '-t', help='transforms measured, each one alone', nargs='+', choices=['none', *TRANSFORMS], default=['none', *TRANSFORMS])
+    parser.add_argument('--workers', '-w', help='DataLoader worker counts', type=int, nargs='+', default=[0, 2])
+    parser.add_argument('--spacy', help='tokenizes labels with spaCy, as the dataset does, instead of splitting by whitespace (needs the spaCy model)', action='store_true')
+    parser.add_argument('--compare-ref', '-c', help='git ref (as a commit or tag) of the version compared with the current one', default=None)
+    parser.add_argument('--output', '-o', help='JSON file the results are written to', default='loader_throughput.json')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="lsat_bench_loader_") as temp_path:
+        if args.root is not None:
+            root = Path(args.root)
+        else:
+            root = Path(temp_path) / "data"
+            print(f"Building a synthetic database of {args.videos * args.clips_per_video} clips")
+            build_synthetic_tree(root, args.videos, args.clips_per_video, args.frames, tuple(args.size))
+        results = run(args, root)
+        baseline = None
+        if args.compare_ref is not None:
+            print(f"Measuring {args.compare_ref}")
+            baseline = run_ref(args, root, args.compare_ref, Path(temp_path) / "baseline.json")
+            compare(results, baseline)
+
+    environment = {'python': platform.python_version(), 'torch': torch.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count()}
+    with open(args.output, 'w') as output_file:
+        json.dump({'environment': environment, 'args': vars(args), 'results': results, 'baseline': baseline}, output_file, indent=1)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import time
+from pathlib import Path
+from typing import Iterator
+
+from torch.utils.data import DataLoader, Subset
+
+from lsat.dataset.PyTorchDataset import PyTorchDataset
+from lsat.dataset.Profiler import Profiler
+
+
+def keep_sample(sample: tuple) -> tuple:
+    '''Collate function that keeps samples as loaded, so collating them is not measured. Lazily loaded clips are decoded, in the worker, so they can be
+    sent to the main process and their decoding is recorded'''
+    if isinstance(sample[0], Iterator):
+        return (list(sample[0]), *sample[1:])
+    return sample
+
+def main():
+    parser = argparse.ArgumentParser(description='''Loads samples of LSA-T with a profiler and prints the time and bytes read by each stage of the loading.''')
+    parser.add_argument('root', help='root of the database')
+    parser.add_argument('--mode', '-m', help='split loaded', choices=['train', 'test'], default='train')
+    parser.add_argument('--samples', '-n', help='amount of samples loaded', type=int, default=256)
+    parser.add_argument('--workers', '-w', help='DataLoader workers', type=int, default=0)
+    parser.add_argument('--no-clips', help='does not load clips', action='store_true')
+    parser.add_argument('--no-keypoints', help='does not load keypoints', action='store_true')
+    parser.add_argument('--keypoints-backend', help='backend used to read keypoints', choices=['json', 'store'], default='json')
+    parser.add_argument('--crop-clips-to-roi', help='crops clips to the roi of the signer', action='store_true')
+    parser.add_argument('--clip-size', help='height and width clips are resized to', type=int, nargs=2, default=None)
+    parser.add_argument('--clip-max-frames', help='frames sampled from each clip', type=int, default=None)
+    parser.add_argument('--output', '-o', help='directory where the records of each worker are stored, a temporary one by default', default=None)
+    args = parser.parse_args()
+
+    profiler = Profiler(Path(args.output) if args.output is not None else None)
+    dataset = PyTorchDataset(args.root, args.mode,
+        load_clips=not args.no_clips,
+        load_keypoints=not args.no_keypoints,
+        keypoints_backend=args.keypoints_backend,
+        crop_clips_to_roi=args.crop_clips_to_roi,
+        clip_size=tuple(args.clip_size) if args.clip_size is not None else None,
+        clip_max_frames=args.clip_max_frames,
+        profiler=profiler)
+    profiler.clear()
+    loader = DataLoader(Subset(dataset, range(min(args.samples, len(dataset)))), batch_size=None, num_workers=args.workers, collate_fn=keep_sample)
+    start = time.perf_counter()
+    for _ in loader:
+        pass
+    elapsed = time.perf_counter() - start
+
+    print(profiler.format_summary())
+    print(f"{len(loader)} samples loaded by the DataLoader in {elapsed:.2f} s ({len(loader) / elapsed:.2f} samples/s with {args.workers} workers)")
+    profiler.close()
+
+
+if __name__ == "__main__":
+    main()
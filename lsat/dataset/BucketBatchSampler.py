@@ -0,0 +1,83 @@
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+from torch.utils.data import Sampler
+
+
+class BucketBatchSampler(Sampler[list[int]]):
+    '''Yields batches of indices of samples with similar lengths, so padding them to the longest one of the batch wastes little.
+    Samples are shuffled and split in buckets of bucket_size batches, sorted by frames and then tokens inside each bucket and grouped
+    in batches of at most batch_size samples and/or at most max_frames padded frames (the longest clip times the amount of clips).
+    Batches are shuffled again, so lengths are not sorted along the epoch. As in DistributedSampler, call set_epoch at the start of
+    each epoch to get a different order'''
+
+    def __init__(self,
+            frame_lengths: Sequence[int],
+            token_lengths: Optional[Sequence[int]] = None,
+            batch_size: Optional[int] = None,
+            max_frames: Optional[int] = None,
+            bucket_size: int = 50,
+            shuffle: bool = True,
+            drop_last: bool = False,
+            seed: int = 0
+        ) -> None:
+        if batch_size is None and max_frames is None:
+            raise ValueError("batch_size or max_frames must be set")
+        if token_lengths is not None and len(token_lengths) != len(frame_lengths):
+            raise ValueError("frame_lengths and token_lengths must have the same length")
+        self.frame_lengths = np.asarray(frame_lengths, dtype=np.int64)
+        self.token_lengths = np.zeros_like(self.frame_lengths) if token_lengths is None else np.asarray(token_lengths, dtype=np.int64)
+        self.batch_size = batch_size
+        self.max_frames = max_frames
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self._batches: Optional[list[list[int]]] = None
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+        self._batches = None
+
+    def _fits(self, batch_len: int, batch_max_frames: int, frames: int) -> bool:
+        '''Whether a sample of the given frames fits in a batch with batch_len samples padded to batch_max_frames'''
+        return (
+            (self.batch_size is None or batch_len < self.batch_size) and
+            (self.max_frames is None or max(batch_max_frames, frames) * (batch_len + 1) <= self.max_frames)
+        )
+
+    def _get_batches(self) -> list[list[int]]:
+        if self._batches is not None:
+            return self._batches
+        rng = np.random.default_rng((self.seed, self.epoch))
+        indices = rng.permutation(len(self.frame_lengths)) if self.shuffle else np.arange(len(self.frame_lengths))
+        # with a frame budget the amount of samples per batch is estimated from the mean length
+        mean_frames = float(self.frame_lengths.mean()) if len(self.frame_lengths) != 0 else 1.
+        samples_per_batch = self.batch_size or max(1, int(self.max_frames // max(1., mean_frames)))
+        bucket_samples = self.bucket_size * samples_per_batch
+        batches: list[list[int]] = []
+        for start in range(0, len(indices), bucket_samples):
+            bucket = indices[start:start + bucket_samples]
+            bucket = bucket[np.lexsort((self.token_lengths[bucket], self.frame_lengths[bucket]))]
+            batch: list[int] = []
+            batch_max_frames = 0
+            for index, frames in zip(bucket.tolist(), self.frame_lengths[bucket].tolist()):
+                # a sample longer than max_frames is placed alone in its batch
+                if len(batch) != 0 and not self._fits(len(batch), batch_max_frames, frames):
+                    batches.append(batch)
+                    batch, batch_max_frames = [], 0
+                batch.append(index)
+                batch_max_frames = max(batch_max_frames, frames)
+            if len(batch) != 0 and not (self.drop_last and self.batch_size is not None and len(batch) < self.batch_size):
+                batches.append(batch)
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        self._batches = batches
+        return batches
+
+    def __iter__(self) -> Iterator[list[int]]:
+        return iter(self._get_batches())
+
+    def __len__(self) -> int:
+        return len(self._get_batches())
@@ -0,0 +1,149 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+from lsat.typing import SignerData
+from lsat.helpers.get_cut_paths import get_cut_paths
+from lsat.helpers.get_sample_key import get_sample_key
+
+
+def get_clip_cache_key(crop_to_roi: bool, size: tuple[int, int], max_frames: Optional[int], frame_stride: Optional[int]) -> str:
+    '''Returns the name of the cache of the clips preprocessed with the given parameters'''
+    frames = f"max_frames_{max_frames}" if max_frames is not None else f"stride_{frame_stride or 1}"
+    return f"{'roi' if crop_to_roi else 'full'}_{size[0]}x{size[1]}_{frames}"
+
+def _read_shard_index(index_path: Path) -> list[dict]:
+    '''Returns the entries of the index of a shard, ignoring a last line left incomplete by an interrupted build'''
+    if not index_path.exists():
+        return []
+    entries = []
+    with index_path.open() as index_file:
+        for line in index_file:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return entries
+
+def _build_shard(args: tuple[Path, Path, int, list[Path], bool, tuple[int, int], Optional[int], Optional[int]]) -> tuple[int, int]:
+    '''Decodes, crops, resizes and subsamples the given clips appending them to a shard, returns the amount of clips added and failed.
+    Clips that can not be loaded are recorded in the index with their error, so they are not retried when resuming'''
+    from lsat.dataset.PyTorchDataset import _load_clip_as_tensors
+    root, path, shard, samples, crop_to_roi, size, max_frames, frame_stride = args
+    data_path = path / f"shard_{shard}.bin"
+    index_path = path / f"shard_{shard}.jsonl"
+    entries = _read_shard_index(index_path)
+    # drop data and index lines written after the last complete entry
+    end = max((entry['offset'] + int(np.prod(entry['shape'])) for entry in entries if 'error' not in entry), default=0)
+    with index_path.open('w') as index_file:
+        index_file.writelines(json.dumps(entry) + '\n' for entry in entries)
+    data_path.touch()
+    with data_path.open('r+b') as data_file, index_path.open('a') as index_file:
+        data_file.truncate(end)
+        data_file.seek(end)
+        failed = 0
+        for sample in samples:
+            paths = get_cut_paths(sample)
+            try:
+                roi = None
+                if crop_to_roi:
+                    with paths['signer'].open() as signer_file:
+                        signer: SignerData = json.load(signer_file)
+                    roi = signer['roi']
+                frames = [frame.numpy() for frame in _load_clip_as_tensors(paths, roi, max_frames, frame_stride, size)]
+            except Exception as e:
+                failed += 1
+                index_file.write(json.dumps({'key': get_sample_key(root, sample), 'error': f"{type(e).__name__}: {e}"}) + '\n')
+                index_file.flush()
+                continue
+            clip = np.stack(frames) if len(frames) != 0 else np.empty((0, 3, *size), dtype=np.uint8)
+            offset = data_file.tell()
+            clip.tofile(data_file)
+            data_file.flush()
+            index_file.write(json.dumps({'key': get_sample_key(root, sample), 'offset': offset, 'shape': list(clip.shape)}) + '\n')
+            index_file.flush()
+    return len(samples) - failed, failed
+
+def _read_cache_key(path: Path) -> Optional[str]:
+    '''Returns the key of the source files the cache in path was built from, None if there is no cache'''
+    key_path = path / "key"
+    return key_path.read_text() if key_path.exists() else None
+
+def build_clip_cache(
+        root: Path,
+        samples: list[Path],
+        path: Path,
+        key: str,
+        crop_to_roi: bool,
+        size: tuple[int, int],
+        max_frames: Optional[int] = None,
+        frame_stride: Optional[int] = None,
+        workers: Optional[int] = None
+    ) -> None:
+    '''Stores the given samples, preprocessed with the given parameters, as uint8 arrays in shards in path. Runs in parallel, one shard per process, and resumes an interrupted build.
+    key identifies the source files (see get_tree_key), a cache built from other files is discarded and built again'''
+    path.mkdir(parents=True, exist_ok=True)
+    if _read_cache_key(path) != key:
+        for shard_path in [*path.glob("shard_*.bin"), *path.glob("shard_*.jsonl")]:
+            shard_path.unlink()
+        (path / "key").write_text(key)
+    done = {entry['key'] for index_path in path.glob("shard_*.jsonl") for entry in _read_shard_index(index_path)}
+    pending = [sample for sample in samples if get_sample_key(root, sample) not in done]
+    if len(pending) == 0:
+        return
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    print(f"Caching {len(pending)} clips ({len(done)} already cached) using {workers} processes")
+    with ProcessPoolExecutor(workers) as executor:
+        for added, failed in executor.map(_build_shard, [
+                    (root, path, shard, pending[shard::workers], crop_to_roi, size, max_frames, frame_stride) for shard in range(workers)
+                ]):
+            print(f"Cached {added} clips" + (f", {failed} could not be loaded" if failed != 0 else ""))
+
+
+class ClipCache:
+    '''Read only view of a cache generated by build_clip_cache. Shards are memory mapped copy-on-write.
+    Clips that failed to be cached are not in it, and their errors are kept in errors'''
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.key = _read_cache_key(path)
+        self.index: dict[str, tuple[int, int, tuple[int, ...]]] = {}
+        self.errors: dict[str, str] = {}
+        for index_path in path.glob("shard_*.jsonl"):
+            shard = int(index_path.stem.split('_')[1])
+            for entry in _read_shard_index(index_path):
+                if 'error' in entry:
+                    self.errors[entry['key']] = entry['error']
+                else:
+                    self.index[entry['key']] = (shard, entry['offset'], tuple(entry['shape']))
+        self._shards: dict[int, NDArray[np.uint8]] = {}
+
+    def __getstate__(self) -> dict:
+        # maps are not pickled, each process maps the shards again
+        return {'path': self.path}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['path'])
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def _shard(self, shard: int) -> NDArray[np.uint8]:
+        if shard not in self._shards:
+            self._shards[shard] = np.memmap(self.path / f"shard_{shard}.bin", dtype=np.uint8, mode='c')
+        return self._shards[shard]
+
+    def get_clip(self, key: str) -> NDArray[np.uint8]:
+        '''Returns a (T, 3, H, W) view with the frames of the sample'''
+        shard, offset, shape = self.index[key]
+        if shape[0] == 0:
+            return np.empty(shape, dtype=np.uint8)
+        return self._shard(shard)[offset:offset + int(np.prod(shape))].reshape(shape)
@@ -0,0 +1,111 @@
+import json
+import shutil
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+from lsat.typing import Box, SignerData
+from lsat.helpers.get_cut_paths import get_cut_paths
+from lsat.helpers.get_sample_key import get_sample_key
+
+
+STORE_DTYPE = np.float32
+
+def build_keypoint_store(root: Path, samples: Iterable[Path], path: Path, key: Optional[str] = None) -> None:
+    '''Packs the keypoints, boxes and scores of every sample, and the roi of its signer, into a contiguous store in path.
+    key identifies the signer files it was built from, to know when it has to be rebuilt'''
+    tmp_path = path.with_name(path.name + ".tmp")
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+    keys: list[str] = []
+    rois: list[list[float]] = []
+    offsets = [0]
+    keypoints_amount = 0
+    with (tmp_path / "keypoints.bin").open('wb') as keypoints_file, \
+            (tmp_path / "boxes.bin").open('wb') as boxes_file, \
+            (tmp_path / "scores.bin").open('wb') as scores_file:
+        for sample in samples:
+            with get_cut_paths(sample)['signer'].open() as signer_file:
+                signer: SignerData = json.load(signer_file)
+            frames = signer['keypoints']
+            if len(frames) != 0:
+                keypoints = np.array([frame['keypoints'] for frame in frames], dtype=STORE_DTYPE)
+                keypoints_amount = keypoints.shape[1] // 3
+                keypoints.tofile(keypoints_file)
+                np.array([frame['box'] for frame in frames], dtype=STORE_DTYPE).tofile(boxes_file)
+                np.array([frame['score'] for frame in frames], dtype=STORE_DTYPE).tofile(scores_file)
+            keys.append(get_sample_key(root, sample))
+            rois.append([signer['roi']['x1'], signer['roi']['y1'], signer['roi']['width'], signer['roi']['height']])
+            offsets.append(offsets[-1] + len(frames))
+    np.save(tmp_path / "offsets.npy", np.array(offsets, dtype=np.int64))
+    np.save(tmp_path / "rois.npy", np.array(rois, dtype=STORE_DTYPE).reshape(-1, 4))
+    with (tmp_path / "index.json").open('w') as index_file:
+        json.dump({'keys': keys, 'frames': offsets[-1], 'keypoints_amount': keypoints_amount, 'key': key}, index_file)
+    if path.exists():
+        shutil.rmtree(path)
+    tmp_path.rename(path)
+
+
+class KeypointStore:
+    '''Read only view of a store generated by build_keypoint_store. Arrays are memory mapped copy-on-write, so nothing is read nor copied until it is used'''
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with (path / "index.json").open() as index_file:
+            index = json.load(index_file)
+        self.index = {key: i for i, key in enumerate(index['keys'])}
+        self.key: Optional[str] = index.get('key')
+        self.offsets: NDArray[np.int64] = np.load(path / "offsets.npy")
+        self.rois: NDArray[np.float32] = np.load(path / "rois.npy")
+        frames: int = index['frames']
+        keypoints_amount: int = index['keypoints_amount']
+        self.keypoints = self._map("keypoints.bin", (frames, keypoints_amount, 3))
+        self.boxes = self._map("boxes.bin", (frames, 4))
+        self.scores = self._map("scores.bin", (frames,))
+
+    def __getstate__(self) -> dict:
+        # maps are not pickled, each process maps the store again
+        return {'path': self.path}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['path'])
+
+    def _map(self, name: str, shape: tuple[int, ...]) -> NDArray[np.float32]:
+        if shape[0] == 0:
+            return np.empty(shape, dtype=STORE_DTYPE)
+        return np.memmap(self.path / name, dtype=STORE_DTYPE, mode='c', shape=shape)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def _frames(self, key: str) -> slice:
+        i = self.index[key]
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def get_frames_amount(self, key: str) -> int:
+        '''Returns the amount of frames of the sample'''
+        frames = self._frames(key)
+        return frames.stop - frames.start
+
+    def get_keypoints(self, key: str) -> NDArray[np.float32]:
+        '''Returns a (T, K, 3) view with the x, y and confidence of each keypoint of each frame of the sample'''
+        return self.keypoints[self._frames(key)]
+
+    def get_boxes(self, key: str) -> NDArray[np.float32]:
+        '''Returns a (T, 4) view with the box of the signer on each frame of the sample'''
+        return self.boxes[self._frames(key)]
+
+    def get_scores(self, key: str) -> NDArray[np.float32]:
+        '''Returns a (T,) view with the score of the signer on each frame of the sample'''
+        return self.scores[self._frames(key)]
+
+    def get_roi(self, key: str) -> Box:
+        '''Returns the roi of the signer of the sample'''
+        x1, y1, width, height = self.rois[self.index[key]].tolist()
+        return {'x1': x1, 'y1': y1, 'width': width, 'height': height}
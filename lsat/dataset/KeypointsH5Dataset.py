@@ -0,0 +1,140 @@
+import csv
+import os
+from collections import OrderedDict
+from math import ceil
+from pathlib import Path
+from typing import Callable, Optional, Literal, Iterable, Iterator, Sequence
+
+import h5py
+import numpy as np
+from numpy.typing import NDArray
+import torch
+from torch import Tensor
+from torch.utils.data import Dataset
+
+from lsat.typing import (
+    Sample,
+    CLIP_HINT,
+    KEYPOINTS_HINT,
+    LABEL_HINT
+)
+from lsat.helpers.keypoint_subsets import CHANNELS, get_subset_indices
+from lsat.helpers.keypoints_h5 import read_dataset, read_signer_keypoints
+from lsat.dataset.PyTorchDataset import _load_clip_as_tensors
+
+
+# size of the chunk cache of each file handle, big enough to hold the chunks of a long clip
+CHUNK_CACHE_SIZE = 64 * 1024**2
+
+def _signer_key(infered_signer: str) -> str:
+    '''Returns the name of the signer group from the infered_signer column of meta.csv'''
+    return f"signer_{int(float(infered_signer))}" if infered_signer.replace('.', '', 1).isdigit() else infered_signer
+
+
+class KeypointsH5Dataset(Dataset):
+    '''Reads the keypoints of the infered signer of each clip straight from keypoints.h5, using meta.csv for labels and signers.
+    Only the keypoints of keypoint_subsets (all by default, see KEYPOINT_SUBSETS) and the given channels are read and returned, as (T, K, C) tensors'''
+
+    def __init__(self,
+            root: str,
+            mode: Literal["train", "test"],
+            load_clips: bool = False,
+            signer_confidence_threshold: float = .5,
+            cache_size: int = 0,
+            dtype: type = np.float32,
+            keypoint_subsets: Optional[Sequence[str]] = None,
+            keypoint_channels: Sequence[str] = CHANNELS,
+            clip_transform: Optional[Callable[[Iterable[Tensor]], CLIP_HINT]] = None,
+            keypoints_transform: Optional[Callable[[Tensor], KEYPOINTS_HINT]] = None,
+            label_transform: Optional[Callable[[str], LABEL_HINT]] = None
+        ) -> None:
+        self.root = Path(root)
+        self.mode = mode
+        self.load_clips = load_clips
+        self.signer_confidence_threshold = signer_confidence_threshold
+        self.cache_size = cache_size
+        self.dtype = dtype
+        self.keypoint_subsets = keypoint_subsets
+        self.keypoint_channels = keypoint_channels
+        self._keypoint_indices = None if keypoint_subsets is None else get_subset_indices(keypoint_subsets)
+        self.clip_transform = clip_transform
+        self.keypoints_transform = keypoints_transform
+        self.label_transform = label_transform
+        self.keypoints_path = self.root / "keypoints.h5"
+        self.clips_path = self.root / "clips"
+
+        with (self.root / "meta.csv").open() as meta_file:
+            rows = [row for row in csv.DictReader(meta_file)
+                if row['infered_signer'] != '' and float(row['infered_signer_confidence'] or 0) >= signer_confidence_threshold]
+        # same split as the video strategy of split_train_test, first 80% of the clips of each video for training and the rest for testing
+        videos: dict[str, list[dict[str, str]]] = {}
+        for row in rows:
+            videos.setdefault(row['video'], []).append(row)
+        self.samples = [row for clips in videos.values()
+            for row in (clips[:ceil(len(clips) * 0.8)] if mode == "train" else clips[ceil(len(clips) * 0.8):])]
+
+        # file handle and cache are per process, so each DataLoader worker opens its own
+        self._file: Optional[h5py.File] = None
+        self._file_pid: Optional[int] = None
+        self._cache: OrderedDict[str, tuple[NDArray, NDArray]] = OrderedDict()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_file_pid'] = None
+        state['_cache'] = OrderedDict()
+        return state
+
+    def _get_file(self) -> h5py.File:
+        if self._file is None or self._file_pid != os.getpid():
+            self._file = h5py.File(self.keypoints_path, 'r', rdcc_nbytes=CHUNK_CACHE_SIZE)
+            self._file_pid = os.getpid()
+            self._cache.clear()
+        return self._file
+
+    def _clip_group(self, clip_id: str) -> h5py.Group:
+        hdf5_file = self._get_file()
+        return hdf5_file[clip_id] if clip_id in hdf5_file else hdf5_file[f"{clip_id}.mp4"]
+
+    def _read_signer(self, row: dict[str, str]) -> tuple[NDArray, NDArray]:
+        '''Returns the (T, K, C) keypoints and (T, 4) boxes of the infered signer of the clip, using the cache if enabled'''
+        if row['id'] in self._cache:
+            self._cache.move_to_end(row['id'])
+            return self._cache[row['id']]
+        signer = self._clip_group(row['id'])[_signer_key(row['infered_signer'])]
+        signer_data = (
+            read_signer_keypoints(signer, self._keypoint_indices, self.keypoint_channels, self.dtype),
+            read_dataset(signer['boxes'], self.dtype)
+        )
+        if self.cache_size > 0:
+            self._cache[row['id']] = signer_data
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return signer_data
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def __getitem__(self, index: int) -> Sample:
+        row = self.samples[index]
+        clip = (
+            None if not self.load_clips
+            else _load_clip_as_tensors({'mp4': self.clips_path / f"{row['id']}.mp4"}) if self.clip_transform is None
+            else self.clip_transform(_load_clip_as_tensors({'mp4': self.clips_path / f"{row['id']}.mp4"}))
+        )
+        # cached arrays are shared between calls, so the tensor is a copy if the cache is enabled
+        keypoints = torch.from_numpy(self._read_signer(row)[0])
+        if self.cache_size > 0:
+            keypoints = keypoints.clone()
+        if self.keypoints_transform is not None:
+            keypoints = self.keypoints_transform(keypoints)
+        label = row['label'] if self.label_transform is None else self.label_transform(row['label'])
+        return (clip, keypoints, label)
+
+    def __iter__(self) -> Iterator[Sample]:
+        for i in range(self.__len__()):
+            yield self.__getitem__(i)
+
+    def get_boxes(self, index: int) -> Tensor:
+        '''Returns the (T, 4) boxes (x1, y1, x2, y2) of the infered signer for each frame of the sample'''
+        return torch.from_numpy(self._read_signer(self.samples[index])[1].copy())
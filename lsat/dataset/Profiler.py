@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+import time
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, IO, Iterable, Iterator, Optional, TypeVar
+
+import numpy as np
+
+
+T = TypeVar('T')
+# stage recorded once per sample by the datasets, used to count samples
+SAMPLE_STAGE = "sample"
+
+class Profiler:
+    '''Records the duration and bytes read of each stage of the loading of samples. Each process (as each DataLoader worker) appends its records to its own file in path,
+    so summary merges the records of every worker without communication between them. If no path is given records are stored in a temporary directory,
+    removed when the profiler is removed or closed in the process that created it'''
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = Path(tempfile.mkdtemp(prefix="lsat_profile_")) if path is None else path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._file: Optional[IO[str]] = None
+        self._file_pid: Optional[int] = None
+        # only the process that created the directory removes it, not the workers that get a copy of the profiler
+        self._cleanup = weakref.finalize(self, shutil.rmtree, self.path, ignore_errors=True) if path is None else None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_file_pid'] = None
+        state['_cleanup'] = None
+        return state
+
+    def close(self) -> None:
+        '''Closes the records file of this process, and removes the temporary directory if the profiler created it'''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._cleanup is not None:
+            self._cleanup()
+
+    def _get_file(self) -> IO[str]:
+        if self._file is None or self._file_pid != os.getpid():
+            # line buffered, so records of workers are written even if they are killed
+            self._file = (self.path / f"{os.getpid()}.tsv").open('a', buffering=1)
+            self._file_pid = os.getpid()
+        return self._file
+
+    def record(self, stage: str, start: float, duration: float, nbytes: int = 0) -> None:
+        self._get_file().write(f"{stage}\t{start}\t{duration}\t{nbytes}\n")
+
+    @contextmanager
+    def stage(self, name: str, nbytes: int = 0) -> Iterator[dict[str, int]]:
+        '''Records the time spent in the block as the given stage. Yields a dict whose bytes can be set in the block if they are not known before'''
+        # wall clock start, comparable between processes, and monotonic duration
+        start, start_counter = time.time(), time.perf_counter()
+        stage = {'bytes': nbytes}
+        try:
+            yield stage
+        finally:
+            self.record(name, start, time.perf_counter() - start_counter, stage['bytes'])
+
+    def iterate(self, items: Iterable[T], name: str, nbytes: int = 0) -> Iterator[T]:
+        '''Yields the items, recording the time spent producing them as the given stage once they are all consumed (or the iterator is closed).
+        Measures lazy iterables, as clips decoded frame by frame, where they are consumed without loading them beforehand'''
+        start, duration = time.time(), 0.
+        iterator = iter(items)
+        try:
+            while True:
+                start_counter = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    duration += time.perf_counter() - start_counter
+                yield item
+        finally:
+            self.record(name, start, duration, nbytes)
+
+    def wrap(self, transform: Callable[..., T], name: str) -> Callable[..., T]:
+        '''Returns the transform recording the time spent in it as the given stage, to profile each step of a composed transform'''
+        return ProfiledTransform(self, transform, name)
+
+    def clear(self) -> None:
+        '''Removes the records of every process'''
+        for records_path in self.path.glob("*.tsv"):
+            records_path.unlink()
+
+    def summary(self) -> dict[str, Any]:
+        '''Returns for each stage its amount of calls, total time, p50 and p99 latencies and bytes read, the samples loaded by each worker and the samples per second
+        (samples over the time from the first to the last record)'''
+        stages: dict[str, list[tuple[float, int]]] = {}
+        workers: dict[str, dict[str, int]] = {}
+        first, last = float('inf'), float('-inf')
+        for records_path in sorted(self.path.glob("*.tsv")):
+            worker = workers.setdefault(records_path.stem, {'samples': 0, 'bytes': 0})
+            with records_path.open() as records_file:
+                for line in records_file:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) != 4:
+                        continue
+                    stage, start, duration, nbytes = fields[0], float(fields[1]), float(fields[2]), int(fields[3])
+                    stages.setdefault(stage, []).append((duration, nbytes))
+                    worker['samples'] += stage == SAMPLE_STAGE
+                    worker['bytes'] += nbytes
+                    first, last = min(first, start), max(last, start + duration)
+        samples = sum(worker['samples'] for worker in workers.values())
+        summary_stages = {}
+        for stage, records in stages.items():
+            durations = np.array([duration for duration, _ in records])
+            summary_stages[stage] = {
+                'calls': len(records),
+                'total_s': float(durations.sum()),
+                'p50_ms': float(np.percentile(durations, 50) * 1000),
+                'p99_ms': float(np.percentile(durations, 99) * 1000),
+                'bytes': sum(nbytes for _, nbytes in records)
+            }
+        return {
+            'stages': summary_stages,
+            'workers': workers,
+            'samples': samples,
+            'samples_per_second': samples / (last - first) if samples != 0 and last > first else 0.
+        }
+
+    def format_summary(self) -> str:
+        '''Returns the summary as a table, stages sorted by total time'''
+        summary = self.summary()
+        lines = [f"{'stage':<22}{'calls':>8}{'total s':>10}{'p50 ms':>10}{'p99 ms':>10}{'MB read':>10}"]
+        for stage, data in sorted(summary['stages'].items(), key=lambda item: -item[1]['total_s']):
+            lines.append(f"{stage:<22}{data['calls']:>8}{data['total_s']:>10.2f}{data['p50_ms']:>10.2f}{data['p99_ms']:>10.2f}{data['bytes'] / 2**20:>10.1f}")
+        lines.append("")
+        for worker, data in summary['workers'].items():
+            lines.append(f"process {worker}: {data['samples']} samples, {data['bytes'] / 2**20:.1f} MB read")
+        lines.append(f"{summary['samples']} samples, {summary['samples_per_second']:.2f} samples/s")
+        return "\n".join(lines)
+
+
+class ProfiledTransform:
+    '''Transform that records the time spent in the wrapped one, a class instead of a closure so it can be sent to spawned workers'''
+
+    def __init__(self, profiler: Profiler, transform: Callable[..., Any], name: str) -> None:
+        self.profiler = profiler
+        self.transform = transform
+        self.name = name
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        with self.profiler.stage(self.name):
+            return self.transform(*args, **kwargs)
@@ -1,37 +1,102 @@
 import json
+from math import ceil, isfinite
+from itertools import islice
+from collections import OrderedDict
+from contextlib import nullcontext
 from pathlib import Path
-from urllib.request import urlretrieve
-from typing import Callable, Optional, Generator, Literal, Iterable, Iterator
+from typing import Callable, ContextManager, Optional, Literal, Iterable, Iterator, Union, TYPE_CHECKING
 
+import torch
 from torch import Tensor
 from torch.utils.data import Dataset
-from torchvision.io import VideoReader
-from torchtext.data.utils import get_tokenizer
-from torchtext.vocab import build_vocab_from_iterator
-import py7zr
 
-from lsat.typing import CutData, SignerData, KeypointData
+from lsat.typing import Box, SignerData, KeypointData
 from lsat.typing import (
     Sample,
     CLIP_HINT,
     KEYPOINTS_HINT,
     LABEL_HINT
 )
-from lsat.helpers.sample_filters import sample_above_confidence_threshold
 from lsat.helpers.get_cut_paths import get_cut_paths
-from lsat.helpers.train_test import split_train_test, load_train_test, store_samples_to_csv
+from lsat.helpers.train_test import SplitStrategy, split_train_test, get_split_name, load_split, store_split
 from lsat.helpers.ProgressBar import ProgressBar
+from lsat.helpers.get_sample_key import get_sample_key
+from lsat.helpers.downloads import download_file
+from lsat.helpers.token_cache import get_token_cache_key, load_token_cache, store_token_cache
+from lsat.dataset.KeypointStore import KeypointStore, build_keypoint_store
+from lsat.dataset.ClipCache import ClipCache, build_clip_cache, get_clip_cache_key
+from lsat.dataset.SampleCache import SampleCache, get_fingerprint
+from lsat.dataset.Profiler import Profiler, SAMPLE_STAGE
+from lsat.dataset.transforms import crop_and_resize_frames
 
+if TYPE_CHECKING:
+    from torchvision.io import VideoReader
 
-def _yield_tokens(samples: Iterable[Path], tokenizer: Callable[[str], list[str]]) -> Generator[list[str], None, None]:
-    for sample in samples:
-        with sample.open() as data_file:
-            data: CutData = json.load(data_file)
-            yield tokenizer(data['label'])
 
-def _load_clip_as_tensors(paths: dict[str, Path]) -> Iterable[Tensor]:
-    return (map(lambda frame: frame['data'], VideoReader(str(paths['mp4']), "video")))
+TOKENIZER_LANGUAGE = 'es_core_news_lg'
+DATASET_URL = "http://c1781468.ferozo.com/data/lsa-t.7z"
 
+# targets further than this (in seconds) from the last decoded frame are reached seeking instead of decoding every frame in between
+SEEK_MIN_GAP = 1.
+
+def _get_frame_indices(frames_amount: int, max_frames: Optional[int], frame_stride: Optional[int]) -> list[int]:
+    '''Returns the indices of the frames to decode, using the same criteria as get_frames_reduction_transform if max_frames is given'''
+    if frames_amount <= 0:
+        return []
+    if max_frames is not None:
+        indices = list(range(0, frames_amount, ceil(frames_amount / max_frames)))
+        return indices + indices[-1:] * (max_frames - len(indices))
+    return list(range(0, frames_amount, frame_stride or 1))
+
+def _seek_frames(reader: 'VideoReader', timestamps: list[float], fps: float) -> Iterator[Tensor]:
+    '''Yields the frames at the given timestamps, seeking when the next one is far from the last decoded frame and decoding sequentially otherwise'''
+    frame: Optional[dict] = None
+    for timestamp in timestamps:
+        try:
+            if (frame is None and timestamp > SEEK_MIN_GAP) or (frame is not None and (timestamp - frame['pts'] > SEEK_MIN_GAP or timestamp < frame['pts'])):
+                reader.seek(timestamp)
+                frame = next(reader)
+            while frame is None or frame['pts'] < timestamp - .5 / fps:
+                frame = next(reader)
+        except StopIteration:
+            if frame is None:
+                return
+        yield frame['data']
+
+def _load_clip_as_tensors(
+        paths: dict[str, Path],
+        roi: Optional[Box] = None,
+        max_frames: Optional[int] = None,
+        frame_stride: Optional[int] = None,
+        size: Optional[tuple[int, int]] = None
+    ) -> Iterable[Tensor]:
+    '''Returns the frames of the clip as (3, H, W) tensors. If max_frames or frame_stride are given only those frames are decoded, seeking through the clip.
+    Each frame is cropped to roi and/or resized to size (letterboxed if there is a roi) as soon as it's decoded'''
+    from torchvision.io import VideoReader
+    reader = VideoReader(str(paths['mp4']), "video")
+    metadata = reader.get_metadata()['video'] if max_frames is not None or frame_stride is not None else {}
+    if max_frames is None and frame_stride is None:
+        frames: Iterable[Tensor] = map(lambda frame: frame['data'], reader)
+    elif all(len(metadata.get(field, [])) != 0 and isfinite(metadata[field][0]) and metadata[field][0] > 0 for field in ('fps', 'duration')):
+        fps = metadata['fps'][0]
+        indices = _get_frame_indices(round(metadata['duration'][0] * fps), max_frames, frame_stride)
+        frames = _seek_frames(reader, [i / fps for i in indices], fps)
+    elif max_frames is None:
+        # without duration and fps frames can not be seeked, so they are decoded sequentially
+        frames = islice(map(lambda frame: frame['data'], reader), 0, None, frame_stride)
+    else:
+        # the amount of frames is only known once every frame is decoded
+        all_frames = [frame['data'] for frame in reader]
+        frames = [all_frames[i] for i in _get_frame_indices(len(all_frames), max_frames, frame_stride)]
+    if roi is None and size is None:
+        return frames
+    from torchvision.transforms.functional import crop, resize
+    # each frame is cropped (and copied) as soon as it's decoded, so full frames are not kept in memory
+    if size is None:
+        return map(lambda frame: crop(frame, int(roi['y1']), int(roi['x1']), int(roi['height']), int(roi['width'])).contiguous(), frames)
+    if roi is None:
+        return map(lambda frame: resize(frame, list(size)), frames)
+    return map(lambda frame: crop_and_resize_frames(frame.unsqueeze(0), [roi], size[0], size[1])[0], frames)
 
 class PyTorchDataset(Dataset):
 
@@ -42,79 +107,271 @@ class PyTorchDataset(Dataset):
             load_keypoints: bool = True,
             words_min_freq: int = 1,
             signer_confidence_threshold: float = .5,
+            split_strategy: SplitStrategy = "video",
+            split_train_ratio: float = .8,
+            split_seed: int = 0,
+            keypoints_backend: Literal["json", "store"] = "json",
+            check_modified_files: bool = False,
+            crop_clips_to_roi: bool = False,
+            clip_max_frames: Optional[int] = None,
+            clip_frame_stride: Optional[int] = None,
+            clip_size: Optional[tuple[int, int]] = None,
+            sample_cache_bytes: int = 0,
+            sample_cache_path: Optional[str] = None,
+            sample_cache_path_bytes: Optional[int] = None,
+            sample_cache_clips: bool = False,
+            profiler: Optional[Profiler] = None,
+            download_url: str = DATASET_URL,
+            download_sha256: Optional[str] = None,
             clip_transform: Optional[Callable[[Iterable[Tensor]], CLIP_HINT]] = None,
-            keypoints_transform: Optional[Callable[[Iterable[KeypointData]], KEYPOINTS_HINT]] = None,
+            keypoints_transform: Optional[Callable[[Union[Iterable[KeypointData], Tensor]], KEYPOINTS_HINT]] = None,
             label_transform: Optional[Callable[[str], LABEL_HINT]] = None
         ) -> None:
+        if clip_max_frames is not None and clip_max_frames < 1:
+            raise ValueError(f"clip_max_frames must be at least 1, got {clip_max_frames}")
+        if clip_frame_stride is not None and clip_frame_stride < 1:
+            raise ValueError(f"clip_frame_stride must be at least 1, got {clip_frame_stride}")
         self.root = Path(root)
         self.mode = mode
         self.load_clips = load_clips
         self.load_keypoints = load_keypoints
         self.words_min_freq = words_min_freq
         self.signer_confidence_threshold = signer_confidence_threshold
+        self.split_strategy = split_strategy
+        self.split_train_ratio = split_train_ratio
+        self.split_seed = split_seed
+        self.keypoints_backend = keypoints_backend
+        self.check_modified_files = check_modified_files
+        self.crop_clips_to_roi = crop_clips_to_roi
+        self.clip_max_frames = clip_max_frames
+        self.clip_frame_stride = clip_frame_stride
+        self.clip_size = clip_size
+        self.sample_cache_clips = sample_cache_clips
+        self.profiler = profiler
         self.clip_transform = clip_transform
         self.keypoints_transform = keypoints_transform
         self.label_transform = label_transform
 
-        if not self.root.exists() or not any(self.root.iterdir()):
+        # the archive (complete or partially downloaded) is not data, so an interrupted download is resumed by the next run
+        if not self.root.exists() or not any(path.name not in ("lsat.7z", "lsat.7z.part") for path in self.root.iterdir()):
             self.root.mkdir(exist_ok=True, parents=True)
             pb = ProgressBar()
             print("Downloading LSA-T")
-            urlretrieve("http://c1781468.ferozo.com/data/lsa-t.7z", self.root / "lsat.7z", pb)
+            # failed connections are retried, resuming from the bytes already downloaded
+            download_file(download_url, self.root / "lsat.7z", sha256=download_sha256, reporthook=pb)
             print("Extracting files, this may take a while")
+            import py7zr
             with py7zr.SevenZipFile(self.root / 'lsat.7z', mode='r') as z:
                 z.extractall(self.root)
             
         splits_path = self.root.parent / "splits" / f"confidence_threshold_{str(signer_confidence_threshold).replace('.','')}"
         splits_path.mkdir(exist_ok=True, parents=True)
-        train_path = splits_path / "train.csv"
-        test_path = splits_path / "test.csv"
-        sample_paths = map(lambda p: Path(str(p.resolve())[:-3] + "json"), self.root.glob('**/*.mp4'))
-        
-        self.tokenizer: Callable[[str], list[str]] = get_tokenizer('spacy', language='es_core_news_lg')
+        split_name = get_split_name(split_strategy, split_train_ratio, split_seed)
+        split_path = splits_path / f"{split_name}.json"
+
+        # labels, durations and signer confidences of every sample, read once instead of opening the files of each sample.
+        # Unless check_modified_files is set, only the directories of the tree are stated to know if the index and stores must be rebuilt
+        from lsat.helpers.metadata import load_metadata_index, filter_metadata, get_tree_key
+        self.files_key = get_tree_key(self.root, self.root.parent / "tree.json", ('.mp4', '.json') if check_modified_files else None)
+        metadata_path = self.root.parent / "metadata.parquet"
+        self.metadata = load_metadata_index(self.root, metadata_path, self.files_key)
+        sample_paths = [self.root / f"{key}.json" for key in self.metadata.index]
+
+        self.keypoint_store: Optional[KeypointStore] = None
+        if (self.load_keypoints or self.crop_clips_to_roi) and self.keypoints_backend == "store":
+            store_path = self.root.parent / "keypoints_store"
+            # rebuilt if files were added or removed (or modified) since it was built
+            self.keypoint_store = KeypointStore(store_path) if store_path.exists() else None
+            if self.keypoint_store is None or self.keypoint_store.key != self.files_key:
+                print("Building keypoints store, this may take a while")
+                build_keypoint_store(self.root, sample_paths, store_path, self.files_key)
+                self.keypoint_store = KeypointStore(store_path)
+
+        # clips are served from a cache if one was built with the same preprocessing parameters
+        # transformed samples are cached if a budget or path is given, clips only if sample_cache_clips is set.
+        # Samples are stored after their transforms, so random augmentations are frozen: use the cache for deterministic transforms only
+        self.sample_cache: Optional[SampleCache] = None
+        if sample_cache_bytes != 0 or sample_cache_path is not None:
+            # samples cached with other transforms or loading options are not served
+            namespace = get_fingerprint(
+                self.load_clips and self.sample_cache_clips, self.load_keypoints, self.keypoints_backend, self.crop_clips_to_roi,
+                self.clip_max_frames, self.clip_frame_stride, self.clip_size, self.clip_transform, self.keypoints_transform, self.label_transform)
+            self.sample_cache = SampleCache(sample_cache_bytes, Path(sample_cache_path) if sample_cache_path is not None else None,
+                sample_cache_path_bytes, namespace)
+
+        self.clip_cache: Optional[ClipCache] = None
+        if self.load_clips and self.clip_size is not None and self._clip_cache_path().exists():
+            clip_cache = ClipCache(self._clip_cache_path())
+            # a cache built from other files is not served until build_clip_cache builds it again
+            if clip_cache.key == self.files_key:
+                self.clip_cache = clip_cache
+            else:
+                print("The clip cache was built from other files, it's not used until build_clip_cache is called")
+
+        self._tokenizer: Optional[Callable[[str], list[str]]] = None
         
-        if train_path.exists() and test_path.exists():
+        # splits store sample keys, relative to root, so they are still valid if the database is moved.
+        # Cuts removed since a split was generated are left out of it, the rest of the samples keep their set
+        if split_path.exists():
             print("Loading existing train and test splits")
-            self.train_samples, self.test_samples = load_train_test(train_path, test_path)
+            split = load_split(split_path, self.metadata.index)
         else:
             print("Generating train and test splits")
-            self.train_samples, self.test_samples = split_train_test(self.root, lambda path:
-                (sample_above_confidence_threshold(path, self.signer_confidence_threshold) if self.signer_confidence_threshold != 0 else True))
-            store_samples_to_csv(train_path, self.train_samples)
-            store_samples_to_csv(test_path, self.test_samples)
-        self.max_label_len = max(map(len, _yield_tokens(self.train_samples + self.test_samples, self.tokenizer)))
-
-        special_symbols = ['<unk>', '<pad>', '<bos>', '<eos>']
-        self.vocab = build_vocab_from_iterator(_yield_tokens(self.train_samples, self.tokenizer),
-                                                            min_freq = words_min_freq,
-                                                            specials = special_symbols,
-                                                            special_first = True)
+            train_keys, test_keys = split_train_test(
+                filter_metadata(self.metadata, min_confidence=self.signer_confidence_threshold) if self.signer_confidence_threshold != 0 else self.metadata,
+                split_strategy, split_train_ratio, split_seed)
+            split = {'strategy': split_strategy, 'train_ratio': split_train_ratio, 'seed': split_seed, 'train': train_keys, 'test': test_keys}
+            store_split(split_path, split)
+        self.train_samples = [self.root / f"{key}.json" for key in split['train']]
+        self.test_samples = [self.root / f"{key}.json" for key in split['test']]
+
+        from torchtext.vocab import build_vocab_from_iterator, vocab as build_vocab
+
+        # tokens and vocab are cached next to the splits, and only rebuilt if the splits or labels change
+        token_cache_path = splits_path / f"tokens_{split_name}_spacy_{TOKENIZER_LANGUAGE}_min_freq_{words_min_freq}.json"
+        token_cache_key = get_token_cache_key(f"spacy_{TOKENIZER_LANGUAGE}", words_min_freq, [split_path, metadata_path])
+        token_cache = load_token_cache(token_cache_path, token_cache_key)
+        if token_cache is None:
+            print("Tokenizing labels")
+            keys = list(dict.fromkeys(split['train'] + split['test']))
+            tokens = {key: self.tokenizer(label) for key, label in self.metadata.loc[keys, 'label'].items()}
+            special_symbols = ['<unk>', '<pad>', '<bos>', '<eos>']
+            vocab = build_vocab_from_iterator((tokens[key] for key in split['train']),
+                                                                min_freq = words_min_freq,
+                                                                specials = special_symbols,
+                                                                special_first = True)
+            token_cache = {
+                'key': token_cache_key,
+                'tokens': tokens,
+                'max_label_len': max(map(len, tokens.values()), default=0),
+                'vocab': vocab.get_itos()
+            }
+            store_token_cache(token_cache_path, token_cache)
+        self.label_tokens = token_cache['tokens']
+        self.max_label_len = token_cache['max_label_len']
+        self.vocab = build_vocab(OrderedDict((token, 1) for token in token_cache['vocab']), min_freq=1)
         # by default returns <unk> index
         self.vocab.set_default_index(0)
-        
+
+    @property
+    def tokenizer(self) -> Callable[[str], list[str]]:
+        '''spaCy tokenizer, loaded on first use'''
+        if self._tokenizer is None:
+            from torchtext.data.utils import get_tokenizer
+            self._tokenizer = get_tokenizer('spacy', language=TOKENIZER_LANGUAGE)
+        return self._tokenizer
 
     def __len__(self) -> int:
         return len(self.train_samples if self.mode == "train" else self.test_samples)
 
     def __getitem__(self, index: int) -> Sample:
-        paths = get_cut_paths((self.train_samples if self.mode == "train" else self.test_samples)[index])
-        with paths['signer'].open() as signer_file:
-            signer: SignerData = json.load(signer_file)
-        with paths['json'].open() as data_file:
-            data: CutData = json.load(data_file)
-        clip = (
-            None if not self.load_clips
-            else _load_clip_as_tensors(paths) if self.clip_transform is None
-            else self.clip_transform(_load_clip_as_tensors(paths))
-        )
-        keypoints = (
-            None if not self.load_keypoints
-            else signer['keypoints'] if self.keypoints_transform is None
-            else self.keypoints_transform(signer['keypoints'])
-        )
-        label = data['label'] if self.label_transform is None else self.label_transform(data['label'])
+        with self._stage(SAMPLE_STAGE):
+            return self._get_sample(index)
+
+    def _stage(self, name: str, nbytes: int = 0) -> ContextManager[dict[str, int]]:
+        '''Records the time spent in the block as a stage of the loading of samples if a profiler is set'''
+        return nullcontext({'bytes': nbytes}) if self.profiler is None else self.profiler.stage(name, nbytes)
+
+    def _get_sample(self, index: int) -> Sample:
+        sample = (self.train_samples if self.mode == "train" else self.test_samples)[index]
+        if self.sample_cache is None:
+            return self._load_sample(sample, self.load_clips, True)
+        key = get_sample_key(self.root, sample)
+        with self._stage("sample_cache"):
+            cached = self.sample_cache.get(key)
+        if cached is None:
+            cached = self._load_sample(sample, self.load_clips and self.sample_cache_clips, True)
+            if isinstance(cached[0], Iterator):
+                cached = (list(cached[0]), cached[1], cached[2])
+            self.sample_cache.put(key, cached)
+        if self.load_clips and not self.sample_cache_clips:
+            return (self._load_sample(sample, True, False)[0], cached[1], cached[2])
+        return cached
+
+    def _load_sample(self, sample: Path, load_clip: bool, load_keypoints_and_label: bool) -> Sample:
+        '''Loads and transforms the clip and/or the keypoints and label of the sample'''
+        paths = get_cut_paths(sample)
+        load_keypoints = load_keypoints_and_label and self.load_keypoints
+        signer: Optional[SignerData] = None
+        if self.keypoint_store is None and (load_keypoints or (load_clip and self.crop_clips_to_roi)):
+            with self._stage("signer_json", paths['signer'].stat().st_size if self.profiler is not None else 0):
+                signer = self._load_signer(paths)
+        clip = None
+        if load_clip:
+            with self._stage("clip_load") as stage:
+                clip = self._load_clip(sample, paths, signer)
+                if self.profiler is not None:
+                    stage['bytes'] = clip.nbytes if isinstance(clip, Tensor) else paths['mp4'].stat().st_size
+            if self.profiler is not None and isinstance(clip, Iterator):
+                # frames are decoded lazily, so decoding is measured wherever the clip is consumed and the clip is kept lazy
+                clip = self.profiler.iterate(clip, "clip_decode")
+            if self.clip_transform is not None:
+                with self._stage("clip_transform"):
+                    clip = self.clip_transform(clip)
+        keypoints = None
+        if load_keypoints:
+            with self._stage("keypoints_load") as stage:
+                keypoints = self._load_keypoints(sample, signer)
+                if self.profiler is not None and isinstance(keypoints, Tensor):
+                    stage['bytes'] = keypoints.nbytes
+            if self.keypoints_transform is not None:
+                with self._stage("keypoints_transform"):
+                    keypoints = self.keypoints_transform(keypoints)
+        if not load_keypoints_and_label:
+            return (clip, keypoints, None)
+        label = self.metadata.at[get_sample_key(self.root, sample), 'label']
+        if self.label_transform is not None:
+            with self._stage("label_transform"):
+                label = self.label_transform(label)
         return (clip, keypoints, label)
     
+    def _load_signer(self, paths: dict[str, Path]) -> SignerData:
+        with paths['signer'].open() as signer_file:
+            return json.load(signer_file)
+
+    def _clip_cache_path(self) -> Path:
+        return self.root.parent / "clip_cache" / get_clip_cache_key(self.crop_clips_to_roi, self.clip_size, self.clip_max_frames, self.clip_frame_stride)
+
+    def build_clip_cache(self, workers: Optional[int] = None) -> None:
+        '''Decodes and preprocesses the clips of both splits with the parameters of the dataset, storing them in a cache used from then on.
+        Clips that can not be loaded are left out of the cache, so they are loaded (and fail) as usual'''
+        if self.clip_size is None:
+            raise ValueError("clip_size must be set to build a clip cache")
+        build_clip_cache(self.root, list(dict.fromkeys(self.train_samples + self.test_samples)), self._clip_cache_path(), self.files_key,
+            self.crop_clips_to_roi, self.clip_size, self.clip_max_frames, self.clip_frame_stride, workers)
+        self.clip_cache = ClipCache(self._clip_cache_path())
+
+    def _load_clip(self, sample: Path, paths: dict[str, Path], signer: Optional[SignerData]) -> Iterable[Tensor]:
+        '''Returns the frames of the clip, decoding only the frames and at the size set in the dataset, cropped to the roi of the signer if crop_clips_to_roi is set'''
+        if self.clip_cache is not None and get_sample_key(self.root, sample) in self.clip_cache:
+            return torch.from_numpy(self.clip_cache.get_clip(get_sample_key(self.root, sample)))
+        roi = (
+            None if not self.crop_clips_to_roi
+            else signer['roi'] if signer is not None
+            else self.keypoint_store.get_roi(get_sample_key(self.root, sample))
+        )
+        return _load_clip_as_tensors(paths, roi, self.clip_max_frames, self.clip_frame_stride, self.clip_size)
+
+    def _load_keypoints(self, sample: Path, signer: Optional[SignerData]) -> Union[list[KeypointData], Tensor]:
+        '''Returns the keypoints of the sample, as a (T, K, 3) tensor sharing memory with the store if it's used'''
+        if signer is not None:
+            return signer['keypoints']
+        return torch.from_numpy(self.keypoint_store.get_keypoints(get_sample_key(self.root, sample)))
+
+    def get_lengths(self, fps: float = 30.) -> tuple[list[int], list[int]]:
+        '''Returns the amount of frames and label tokens of each sample of the split, to group samples of similar lengths with a BucketBatchSampler.
+        Frames are exact if the keypoints store is used and estimated from the duration in the metadata index otherwise, and account for clip_max_frames and clip_frame_stride if clips are loaded'''
+        keys = [get_sample_key(self.root, sample) for sample in (self.train_samples if self.mode == "train" else self.test_samples)]
+        if self.keypoint_store is not None:
+            frames = [self.keypoint_store.get_frames_amount(key) for key in keys]
+        else:
+            frames = (self.metadata.loc[keys, 'duration'] * fps).fillna(0).round().astype(int).tolist()
+        if self.load_clips and self.clip_max_frames is not None:
+            frames = [self.clip_max_frames] * len(keys)
+        elif self.load_clips and self.clip_frame_stride is not None:
+            frames = [ceil(amount / self.clip_frame_stride) for amount in frames]
+        return frames, [len(self.label_tokens[key]) for key in keys]
+
     def __iter__(self) -> Iterator[Sample]:
         for i in range(self.__len__()):
             yield self.__getitem__(i)
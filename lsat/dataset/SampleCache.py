@@ -0,0 +1,195 @@
+import os
+import sys
+import pickle
+import multiprocessing
+from collections import OrderedDict
+from hashlib import sha1
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+import torch
+from torch import Tensor
+
+
+# positions of each counter in the shared statistics array
+MEMORY_HITS, PATH_HITS, MISSES, EVICTIONS, PATH_EVICTIONS, PATH_BYTES = range(6)
+# when the path exceeds its budget the least recently used samples are removed until it's under this fraction of it
+PATH_EVICTION_TARGET = .9
+
+def get_size(value: Any) -> int:
+    '''Returns an estimate of the bytes used by a sample: the data of tensors and arrays plus the size of the objects holding them'''
+    if isinstance(value, Tensor):
+        return value.element_size() * value.nelement()
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(map(get_size, value))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(map(get_size, value.values()))
+    return sys.getsizeof(value)
+
+
+def _describe(value: Any) -> bytes:
+    '''Returns bytes identifying the value: its pickle, or for what can not be pickled (as lambdas) its code, type and attributes'''
+    try:
+        return pickle.dumps(value, protocol=4)
+    except Exception:
+        pass
+    if isinstance(value, (list, tuple)):
+        return b'[' + b','.join(map(_describe, value)) + b']'
+    if isinstance(value, dict):
+        return b'{' + b','.join(_describe(key) + b':' + _describe(item) for key, item in value.items()) + b'}'
+    code = getattr(value, '__code__', None)
+    if code is not None:
+        # functions by their code and the values they close over
+        return pickle.dumps((value.__module__, value.__qualname__, code.co_code, repr(code.co_consts))) \
+            + _describe([cell.cell_contents for cell in value.__closure__ or ()]) + _describe(value.__defaults__)
+    if hasattr(value, '__dict__'):
+        return f"{type(value).__module__}.{type(value).__qualname__}".encode() + _describe(vars(value))
+    return repr(value).encode()
+
+def get_fingerprint(*values: Any) -> str:
+    '''Returns a hash of the given values, as the transforms (by their class or code and their parameters) and options that produced cached samples'''
+    digest = sha1()
+    for value in values:
+        digest.update(_describe(value))
+    return digest.hexdigest()[:16]
+
+
+class SampleCache:
+    '''Caches samples by key in an LRU of at most memory_bytes, split evenly between the DataLoader workers. If path is given samples are also written there,
+    so they are shared by every worker and kept between epochs and runs (use a directory in /dev/shm to keep them in shared memory). Samples are written under
+    path/namespace, so caches of samples produced differently (see get_fingerprint) do not mix. The path is kept under path_bytes (memory_bytes if not given)
+    by removing the least recently used samples of any namespace. Counters, and the bytes in path, are shared by the workers created after the cache.
+    Samples are cached after their transforms, so random augmentations are applied once and then served the same from the cache'''
+
+    def __init__(self, memory_bytes: int, path: Optional[Path] = None, path_bytes: Optional[int] = None, namespace: str = "default") -> None:
+        self.memory_bytes = memory_bytes
+        self.path = path
+        self.path_bytes = memory_bytes if path_bytes is None else path_bytes
+        self.namespace = namespace
+        if self.path is not None and self.path_bytes <= 0:
+            raise ValueError("a budget of path_bytes is needed to cache samples in path")
+        self._entries: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self._size = 0
+        # created in the spawn context, so they can be shared with workers started with any method
+        self._counters = multiprocessing.get_context('spawn').Array('q', 6)
+        if self.path is not None:
+            (self.path / self.namespace).mkdir(parents=True, exist_ok=True)
+            self._counters[PATH_BYTES] = sum(file.stat().st_size for file in self._path_files())
+
+    def __getstate__(self) -> dict:
+        # cached samples are not copied to workers, each one fills its own
+        state = self.__dict__.copy()
+        state['_entries'] = OrderedDict()
+        state['_size'] = 0
+        return state
+
+    def _count(self, counter: int) -> None:
+        with self._counters.get_lock():
+            self._counters[counter] += 1
+
+    def _file(self, key: str) -> Path:
+        return self.path / self.namespace / f"{sha1(key.encode()).hexdigest()}.pt"
+
+    def _path_files(self) -> list[Path]:
+        return list(self.path.glob("*/*.pt"))
+
+    def _memory_budget(self) -> int:
+        worker_info = torch.utils.data.get_worker_info()
+        return self.memory_bytes if worker_info is None else self.memory_bytes // worker_info.num_workers
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries or (self.path is not None and self._file(key).exists())
+
+    def get(self, key: str) -> Optional[Any]:
+        '''Returns the cached sample, None if it's not cached'''
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self._count(MEMORY_HITS)
+            return self._entries[key][0]
+        if self.path is not None and self._file(key).exists():
+            try:
+                sample = torch.load(self._file(key), weights_only=False)
+                # the modification time orders the files of path by their last use
+                os.utime(self._file(key))
+            except (EOFError, RuntimeError, OSError):
+                # written or evicted by another worker at the same time
+                self._count(MISSES)
+                return None
+            self._count(PATH_HITS)
+            self._store_in_memory(key, sample)
+            return sample
+        self._count(MISSES)
+        return None
+
+    def put(self, key: str, sample: Any) -> None:
+        '''Caches the sample, evicting the least recently used ones to keep memory under memory_bytes and path under path_bytes'''
+        if self.path is not None and not self._file(key).exists():
+            tmp_path = self._file(key).with_name(f"{self._file(key).name}.{os.getpid()}.tmp")
+            torch.save(sample, tmp_path)
+            size = tmp_path.stat().st_size
+            if size > self.path_bytes:
+                tmp_path.unlink()
+            else:
+                tmp_path.replace(self._file(key))
+                with self._counters.get_lock():
+                    self._counters[PATH_BYTES] += size
+                    if self._counters[PATH_BYTES] > self.path_bytes:
+                        self._evict_path()
+        self._store_in_memory(key, sample)
+
+    def _evict_path(self) -> None:
+        '''Removes the least recently used samples of path until it's under PATH_EVICTION_TARGET of its budget. Called holding the lock of the counters'''
+        files = []
+        for file in self._path_files():
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, file))
+        # the total is recounted, as other datasets may be sharing the path
+        total = sum(size for _, size, _ in files)
+        for _, size, file in sorted(files, key=lambda entry: entry[0]):
+            if total <= self.path_bytes * PATH_EVICTION_TARGET:
+                break
+            file.unlink(missing_ok=True)
+            total -= size
+            self._counters[PATH_EVICTIONS] += 1
+        self._counters[PATH_BYTES] = total
+
+    def _store_in_memory(self, key: str, sample: Any) -> None:
+        size = get_size(sample)
+        budget = self._memory_budget()
+        if size > budget:
+            return
+        if key in self._entries:
+            self._size -= self._entries.pop(key)[1]
+        while self._size + size > budget:
+            self._size -= self._entries.popitem(last=False)[1][1]
+            self._count(EVICTIONS)
+        self._entries[key] = (sample, size)
+        self._size += size
+
+    def clear(self) -> None:
+        '''Removes the samples cached in memory by this process'''
+        self._entries.clear()
+        self._size = 0
+
+    def stats(self) -> dict[str, float]:
+        '''Returns the hits (in memory and in path), misses and evictions of every process using the cache, the bytes in path and the memory used in this one'''
+        memory_hits, path_hits, misses, evictions, path_evictions, path_bytes = self._counters[:]
+        hits = memory_hits + path_hits
+        return {
+            'hits': hits,
+            'memory_hits': memory_hits,
+            'path_hits': path_hits,
+            'misses': misses,
+            'evictions': evictions,
+            'path_evictions': path_evictions,
+            'path_bytes': path_bytes,
+            'hit_rate': hits / (hits + misses) if hits + misses != 0 else 0.,
+            'memory_bytes': self._size,
+            'samples_in_memory': len(self._entries)
+        }
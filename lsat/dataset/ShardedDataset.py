@@ -0,0 +1,294 @@
+import argparse
+import io
+import json
+import tarfile
+import threading
+import warnings
+from queue import Queue, Full
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional, TYPE_CHECKING
+
+import numpy as np
+import torch
+from numpy.typing import NDArray
+from torch import Tensor
+from torch.utils.data import Dataset, IterableDataset, DataLoader, get_worker_info
+
+from lsat.typing import Sample, CLIP_HINT, KEYPOINTS_HINT, LABEL_HINT
+from lsat.helpers.get_sample_key import get_sample_key
+
+if TYPE_CHECKING:
+    from lsat.dataset.PyTorchDataset import PyTorchDataset
+
+
+SHARD_MAX_BYTES = 1 << 30
+# suffixes of the members of each sample in a shard, the name before them is the key of the sample
+CLIP_SUFFIX = ".clip.npy"
+KEYPOINTS_SUFFIX = ".keypoints.npy"
+LABEL_SUFFIX = ".json"
+
+def _to_array(value: Any, dtype: type) -> NDArray:
+    if isinstance(value, Tensor):
+        return value.numpy().astype(dtype, copy=False)
+    frames = list(value)
+    if len(frames) != 0 and isinstance(frames[0], dict):
+        # keypoints in json format
+        return np.array([frame['keypoints'] for frame in frames], dtype=dtype).reshape(len(frames), -1, 3)
+    return np.stack([frame.numpy() if isinstance(frame, Tensor) else frame for frame in frames]).astype(dtype, copy=False) if len(frames) != 0 else np.empty((0,), dtype=dtype)
+
+
+class _ShardSamples(Dataset):
+    '''Samples of a dataset as arrays, so they can be loaded in parallel by DataLoader workers'''
+
+    def __init__(self, dataset: 'PyTorchDataset') -> None:
+        self.dataset = dataset
+        self.samples = dataset.train_samples if dataset.mode == "train" else dataset.test_samples
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def __getitem__(self, index: int) -> tuple[str, Optional[NDArray], Optional[NDArray], str]:
+        clip, keypoints, label = self.dataset[index]
+        return (
+            get_sample_key(self.dataset.root, self.samples[index]),
+            None if clip is None else _to_array(clip, np.uint8),
+            None if keypoints is None else _to_array(keypoints, np.float32),
+            label
+        )
+
+def _keep_sample(sample: tuple) -> tuple:
+    '''Collate function that keeps arrays as they are instead of converting them to tensors'''
+    return sample
+
+def _add_member(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+def _array_bytes(array: NDArray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+def write_shards(dataset: 'PyTorchDataset', path: Path, shard_max_bytes: int = SHARD_MAX_BYTES, workers: int = 0) -> None:
+    '''Writes the samples of the split of the dataset, in order, to tar shards of at most shard_max_bytes in path, to be read sequentially by ShardedDataset.
+    Samples are stored as loaded by the dataset, so its transforms must not be set. Clips are stored as uint8 (T, 3, H, W) arrays, so clip_size should be set.
+    Samples are loaded in parallel by workers processes'''
+    if dataset.clip_transform is not None or dataset.keypoints_transform is not None or dataset.label_transform is not None:
+        raise ValueError("Shards are written from untransformed samples, transforms are applied when reading them")
+    if dataset.load_clips and dataset.clip_size is None:
+        raise ValueError("clip_size must be set to write clips to shards")
+    path.mkdir(parents=True, exist_ok=True)
+    shards: list[dict] = []
+    tar: Optional[tarfile.TarFile] = None
+    shard_path = path
+    loader = DataLoader(_ShardSamples(dataset), batch_size=None, num_workers=workers, collate_fn=_keep_sample)
+    for key, clip, keypoints, label in loader:
+        if tar is None or tar.offset >= shard_max_bytes:
+            if tar is not None:
+                tar.close()
+                shard_path.replace(path / shards[-1]['name'])
+            shards.append({'name': f"shard_{len(shards):05d}.tar", 'samples': 0})
+            # shards are written to a temporary file, so an interrupted write is never read
+            shard_path = path / f"{shards[-1]['name']}.tmp"
+            tar = tarfile.open(shard_path, 'w')
+        if clip is not None:
+            _add_member(tar, key + CLIP_SUFFIX, _array_bytes(clip))
+        if keypoints is not None:
+            _add_member(tar, key + KEYPOINTS_SUFFIX, _array_bytes(keypoints))
+        _add_member(tar, key + LABEL_SUFFIX, json.dumps({'label': label}, ensure_ascii=False).encode())
+        shards[-1]['samples'] += 1
+    if tar is not None:
+        tar.close()
+        shard_path.replace(path / shards[-1]['name'])
+    with (path / "index.json").open('w') as index_file:
+        json.dump({'shards': shards, 'samples': sum(shard['samples'] for shard in shards)}, index_file)
+
+def _read_shard(shard_path: Path, load_clips: bool, load_keypoints: bool) -> Iterator[tuple[str, Optional[Tensor], Optional[Tensor], str]]:
+    '''Yields the samples of a shard, reading it sequentially'''
+    key: Optional[str] = None
+    sample: dict[str, Any] = {}
+    with tarfile.open(shard_path, 'r|') as tar:
+        for member in tar:
+            suffix = next(suffix for suffix in (CLIP_SUFFIX, KEYPOINTS_SUFFIX, LABEL_SUFFIX) if member.name.endswith(suffix))
+            member_key = member.name[:-len(suffix)]
+            if member_key != key:
+                if key is not None:
+                    yield key, sample.get(CLIP_SUFFIX), sample.get(KEYPOINTS_SUFFIX), sample[LABEL_SUFFIX]
+                key, sample = member_key, {}
+            if (suffix == CLIP_SUFFIX and not load_clips) or (suffix == KEYPOINTS_SUFFIX and not load_keypoints):
+                continue
+            data = tar.extractfile(member).read()
+            sample[suffix] = json.loads(data)['label'] if suffix == LABEL_SUFFIX else torch.from_numpy(np.load(io.BytesIO(data)))
+    if key is not None:
+        yield key, sample.get(CLIP_SUFFIX), sample.get(KEYPOINTS_SUFFIX), sample[LABEL_SUFFIX]
+
+def _prefetch(iterator: Iterator, size: int) -> Iterator:
+    '''Yields the items of iterator, reading up to size of them ahead in a thread so reading overlaps with their processing.
+    If the items are not consumed to the end, the thread stops once this generator is closed and closes iterator'''
+    queue: Queue = Queue(size)
+    end = object()
+    stop = threading.Event()
+    def put(item: Any) -> bool:
+        # waits for space in the queue while the consumer is still reading it
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=.1)
+                return True
+            except Full:
+                pass
+        return False
+    def read():
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            # closes the files read by iterator, in this thread as it's the one running it
+            if hasattr(iterator, 'close'):
+                iterator.close()
+        put(end)
+    threading.Thread(target=read, daemon=True).start()
+    try:
+        while (item := queue.get()) is not end:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+class ShardedDataset(IterableDataset):
+    '''Streams the samples written by write_shards reading each shard sequentially. Shards are split between distributed ranks and DataLoader workers,
+    shuffled each epoch (call set_epoch) and their samples mixed in a shuffle buffer. Samples are read ahead in a thread while the previous ones are processed.
+    Yields (clip, keypoints, label) samples as PyTorchDataset, with clips as (T, 3, H, W) uint8 tensors and keypoints as (T, K, 3) tensors'''
+
+    def __init__(self,
+            path: str,
+            load_clips: bool = True,
+            load_keypoints: bool = True,
+            shuffle: bool = True,
+            shuffle_buffer: int = 1000,
+            prefetch: int = 64,
+            seed: int = 0,
+            clip_transform: Optional[Callable[[Tensor], CLIP_HINT]] = None,
+            keypoints_transform: Optional[Callable[[Tensor], KEYPOINTS_HINT]] = None,
+            label_transform: Optional[Callable[[str], LABEL_HINT]] = None
+        ) -> None:
+        self.path = Path(path)
+        self.load_clips = load_clips
+        self.load_keypoints = load_keypoints
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.prefetch = prefetch
+        self.seed = seed
+        self.epoch = 0
+        self.clip_transform = clip_transform
+        self.keypoints_transform = keypoints_transform
+        self.label_transform = label_transform
+        with (self.path / "index.json").open() as index_file:
+            index = json.load(index_file)
+        self.shards: list[str] = [shard['name'] for shard in index['shards']]
+        self.shard_samples: dict[str, int] = {shard['name']: shard['samples'] for shard in index['shards']}
+        self.samples_amount: int = index['samples']
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        '''Returns the amount of samples read by this rank (by all of its workers) in the current epoch, which depends on the shards assigned to it.
+        Ranks get whole shards, so they may read different amounts of samples: shards should be small enough for each rank to get many of them'''
+        rank, world_size = self._get_rank()
+        self._check_shards(world_size, 1)
+        return sum(self.shard_samples[shard] for shard in self._get_shards(rank, world_size, 0, 1))
+
+    def _get_rank(self) -> tuple[int, int]:
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            return torch.distributed.get_rank(), torch.distributed.get_world_size()
+        return 0, 1
+
+    def _check_shards(self, world_size: int, workers: int) -> None:
+        '''Fails if a rank would not read any shard, and warns if a worker would not'''
+        if len(self.shards) < world_size:
+            raise ValueError(f"{len(self.shards)} shards can not be split between {world_size} ranks, write smaller shards")
+        if len(self.shards) < world_size * workers:
+            warnings.warn(f"{len(self.shards)} shards for {world_size} ranks with {workers} workers each, some workers will not read any sample. Write smaller shards or use less workers")
+
+    def _get_shards(self, rank: int, world_size: int, worker_id: int, workers: int) -> list[str]:
+        '''Returns the shards read by the given worker of the given rank (every worker of the rank if workers is 1), the order of the shards is the same in every rank'''
+        shards = self.shards
+        if self.shuffle:
+            shards = [shards[i] for i in np.random.default_rng((self.seed, self.epoch)).permutation(len(shards))]
+        # shards are assigned to the workers of each rank in turns, so the shards of a rank are the same whatever its amount of workers
+        return shards[rank::world_size][worker_id::workers]
+
+    def _read_samples(self) -> Iterator[tuple[str, Optional[Tensor], Optional[Tensor], str]]:
+        rank, world_size = self._get_rank()
+        worker_info = get_worker_info()
+        worker_id, workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        if worker_id == 0:
+            self._check_shards(world_size, workers)
+        for shard in self._get_shards(rank, world_size, worker_id, workers):
+            yield from _read_shard(self.path / shard, self.load_clips, self.load_keypoints)
+
+    def _shuffle(self, samples: Iterator) -> Iterator:
+        '''Yields the samples in random order, choosing each one from a buffer of the next shuffle_buffer samples'''
+        worker_info = get_worker_info()
+        rng = np.random.default_rng((self.seed, self.epoch, 0 if worker_info is None else worker_info.id))
+        buffer: list = []
+        for sample in samples:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            i = int(rng.integers(len(buffer)))
+            buffer[i], sample = sample, buffer[i]
+            yield sample
+        for i in rng.permutation(len(buffer)):
+            yield buffer[i]
+
+    def __iter__(self) -> Iterator[Sample]:
+        samples = _prefetch(self._read_samples(), self.prefetch)
+        if self.shuffle:
+            samples = self._shuffle(samples)
+        try:
+            for _, clip, keypoints, label in samples:
+                yield (
+                    clip if clip is None or self.clip_transform is None else self.clip_transform(clip),
+                    keypoints if keypoints is None or self.keypoints_transform is None else self.keypoints_transform(keypoints),
+                    label if self.label_transform is None else self.label_transform(label)
+                )
+        finally:
+            # stops reading ahead if iteration ends early, as on a break or a DataLoader shutdown
+            samples.close()
+
+def main():
+    from lsat.dataset.PyTorchDataset import PyTorchDataset
+    parser = argparse.ArgumentParser(description='''Writes the samples of a split of LSA-T to shards to be streamed with ShardedDataset.''')
+    parser.add_argument('root', help='root of the database')
+    parser.add_argument('output', help='directory where shards are written')
+    parser.add_argument('--mode', '-m', help='split written', choices=['train', 'test'], default='train')
+    parser.add_argument('--no-clips', help='does not store clips', action='store_true')
+    parser.add_argument('--no-keypoints', help='does not store keypoints', action='store_true')
+    parser.add_argument('--clip-size', help='height and width of the stored clips', type=int, nargs=2, default=[224, 224])
+    parser.add_argument('--clip-max-frames', help='frames sampled from each clip', type=int, default=None)
+    parser.add_argument('--crop-clips-to-roi', help='crops clips to the roi of the signer', action='store_true')
+    parser.add_argument('--keypoints-backend', help='backend used to read keypoints', choices=['json', 'store'], default='store')
+    parser.add_argument('--signer-confidence-threshold', help='minimum confidence of the infered signer', type=float, default=.5)
+    parser.add_argument('--shard-max-bytes', help='size after which a new shard is started', type=int, default=SHARD_MAX_BYTES)
+    parser.add_argument('--workers', '-w', help='processes loading samples', type=int, default=0)
+    args = parser.parse_args()
+
+    dataset = PyTorchDataset(args.root, args.mode,
+        load_clips=not args.no_clips,
+        load_keypoints=not args.no_keypoints,
+        signer_confidence_threshold=args.signer_confidence_threshold,
+        keypoints_backend=args.keypoints_backend,
+        crop_clips_to_roi=args.crop_clips_to_roi,
+        clip_max_frames=args.clip_max_frames,
+        clip_size=tuple(args.clip_size))
+    write_shards(dataset, Path(args.output), args.shard_max_bytes, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+from typing import Callable, Optional, Sequence
+
+import torch
+from torch import Tensor
+
+from lsat.typing import Sample, PaddedBatch
+
+
+def pad_sequences(sequences: Sequence[Tensor], pad_value: float = 0) -> tuple[Tensor, Tensor]:
+    '''Pads the (T, ...) tensors along their first dimension to the longest one.
+    Returns the (B, T, ...) padded batch and a (B, T) boolean mask, True where there is data'''
+    max_len = max((len(sequence) for sequence in sequences), default=0)
+    padded = sequences[0].new_full((len(sequences), max_len, *sequences[0].shape[1:]), pad_value)
+    mask = torch.zeros((len(sequences), max_len), dtype=torch.bool)
+    for i, sequence in enumerate(sequences):
+        padded[i, :len(sequence)] = sequence
+        mask[i, :len(sequence)] = True
+    return padded, mask
+
+def _stack_frames(value: object) -> object:
+    '''Stacks an iterable of frame tensors, other values are returned as they are'''
+    if isinstance(value, (Tensor, str)):
+        return value
+    value = list(value)
+    return torch.stack(value) if len(value) != 0 and all(isinstance(frame, Tensor) for frame in value) else value
+
+def _pad_field(values: list, pad_value: float) -> tuple[Optional[object], Optional[Tensor]]:
+    if any(value is None for value in values):
+        return None, None
+    values = list(map(_stack_frames, values))
+    if not all(isinstance(value, Tensor) for value in values):
+        return values, None
+    return pad_sequences(values, pad_value)
+
+def get_padded_collate(pad_idx: int, keypoints_pad_value: float = 0, clip_pad_value: float = 0) -> Callable[[list[Sample]], PaddedBatch]:
+    '''Returns a collate function for DataLoader that pads clips, keypoints and labels to the longest of each batch along time, with masks
+    True where there is data. Labels are padded with pad_idx (the index of <pad> in the vocab). Clips given as iterables of frames are stacked first.
+    Fields that are not tensors (as keypoints in json format or untransformed labels) are returned as lists without mask'''
+    def padded_collate(samples: list[Sample]) -> PaddedBatch:
+        clips, keypoints, labels = zip(*samples)
+        clips, clips_mask = _pad_field(list(clips), clip_pad_value)
+        keypoints, keypoints_mask = _pad_field(list(keypoints), keypoints_pad_value)
+        labels, labels_mask = _pad_field(list(labels), pad_idx)
+        return {
+            'clips': clips,
+            'clips_mask': clips_mask,
+            'keypoints': keypoints,
+            'keypoints_mask': keypoints_mask,
+            'labels': labels,
+            'labels_mask': labels_mask
+        }
+    return padded_collate
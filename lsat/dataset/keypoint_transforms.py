@@ -0,0 +1,232 @@
+import math
+from abc import ABC, abstractmethod
+from typing import Literal, Optional, Sequence
+
+import torch
+from torch import Tensor
+
+
+# indices of the nose and shoulders in the pose keypoints of MediaPipe (first ones of keypoints.h5). In halpe format they are 0, 5 and 6
+NOSE_INDEX = 0
+SHOULDER_INDICES = (11, 12)
+
+def apply_affine(keypoints: Tensor, matrix: Tensor) -> Tensor:
+    '''Applies the (B, 3, 3) affine matrix of each clip to the x and y (first two channels) of the (B, T, K, C) keypoints, the other channels are kept'''
+    xy = torch.einsum('bij,btkj->btki', matrix[:, :2, :2], keypoints[..., :2]) + matrix[:, None, None, :2, 2]
+    return torch.cat([xy, keypoints[..., 2:]], dim=-1)
+
+def _apply_to_points(matrix: Tensor, points: Tensor) -> Tensor:
+    '''Applies the (B, 3, 3) matrices to (B, N, 2) points'''
+    return torch.einsum('bij,bnj->bni', matrix[:, :2, :2], points) + matrix[:, None, :2, 2]
+
+def _apply_to_boxes(matrix: Tensor, boxes: Tensor) -> Tensor:
+    '''Returns the (B, T, 4) boxes containing the (B, T, 4) boxes transformed by the (B, 3, 3) matrices'''
+    x1, y1, x2, y2 = boxes.unbind(-1)
+    corners = torch.stack([torch.stack(corner, dim=-1) for corner in ((x1, y1), (x2, y1), (x1, y2), (x2, y2))], dim=-2)
+    corners = _apply_to_points(matrix, corners.flatten(1, 2)).unflatten(1, corners.shape[1:3])
+    return torch.cat([corners.amin(dim=-2), corners.amax(dim=-2)], dim=-1)
+
+def resample_frames(values: Tensor, frames: int) -> Tensor:
+    '''Linearly interpolates the (B, T, ...) values to (B, frames, ...), a frame that falls exactly on an original one is copied (even if it has nan neighbours)'''
+    if values.shape[1] == 0:
+        return values
+    positions = torch.linspace(0, values.shape[1] - 1, frames, device=values.device)
+    lower = positions.floor().long()
+    upper = (lower + 1).clamp(max=values.shape[1] - 1)
+    weight = (positions - lower).view(1, -1, *[1] * (values.dim() - 2)).to(values.dtype)
+    lower_values = values[:, lower]
+    return torch.where(weight == 0, lower_values, torch.lerp(lower_values, values[:, upper], weight))
+
+def _uniform(low: float, high: float, size: int, generator: Optional[torch.Generator], like: Tensor) -> Tensor:
+    return (torch.rand(size, generator=generator) * (high - low) + low).to(device=like.device, dtype=like.dtype)
+
+
+class KeypointTransform(ABC):
+    '''Base of the batched keypoint transforms. They take (T, K, C) or (B, T, K, C) keypoints, with x and y as their first channels, and optionally the (T, 4) or (B, T, 4)
+    boxes (x1, y1, x2, y2) of the person, and work on every frame and clip at once. Combine them with KeypointPipeline'''
+
+    @abstractmethod
+    def transform(self, keypoints: Tensor, boxes: Optional[Tensor], generator: Optional[torch.Generator]) -> tuple[Tensor, Optional[Tensor]]:
+        '''Transforms (B, T, K, C) keypoints and (B, T, 4) boxes'''
+
+    def __call__(self, keypoints: Tensor, boxes: Optional[Tensor] = None, generator: Optional[torch.Generator] = None) -> Tensor:
+        return KeypointPipeline([self])(keypoints, boxes, generator)
+
+
+class AffineKeypointTransform(KeypointTransform):
+    '''Transform of the x and y of the keypoints given by an affine matrix per clip. Consecutive affine transforms in a KeypointPipeline are fused in a single matrix'''
+
+    @abstractmethod
+    def get_matrix(self, keypoints: Tensor, boxes: Optional[Tensor], previous: Tensor, generator: Optional[torch.Generator]) -> Tensor:
+        '''Returns the (B, 3, 3) matrix of the transform, applied after the previous matrix to the (B, T, K, C) keypoints and (B, T, 4) boxes'''
+
+    def transform(self, keypoints: Tensor, boxes: Optional[Tensor], generator: Optional[torch.Generator]) -> tuple[Tensor, Optional[Tensor]]:
+        identity = torch.eye(3, dtype=keypoints.dtype, device=keypoints.device).expand(len(keypoints), 3, 3)
+        matrix = self.get_matrix(keypoints, boxes, identity, generator)
+        return apply_affine(keypoints, matrix), None if boxes is None else _apply_to_boxes(matrix, boxes)
+
+
+class NormalizeKeypoints(AffineKeypointTransform):
+    '''Normalizes each clip: translates it so the center reference, averaged over the frames of the clip, is the origin, and scales it so the scale reference is 1.
+    References are the nose, the shoulders (their midpoint and distance) or the boxes (their center and height). Missing (nan) keypoints are ignored'''
+
+    def __init__(self,
+            center: Literal["nose", "shoulders", "box"] = "nose",
+            scale: Optional[Literal["shoulders", "box"]] = None,
+            nose_index: int = NOSE_INDEX,
+            shoulder_indices: tuple[int, int] = SHOULDER_INDICES
+        ) -> None:
+        self.center = center
+        self.scale = scale
+        self.nose_index = nose_index
+        self.shoulder_indices = shoulder_indices
+
+    def _shoulders(self, keypoints: Tensor, previous: Tensor) -> tuple[Tensor, Tensor]:
+        '''Returns the (B, T, 2) positions of each shoulder, transformed by the previous matrix'''
+        left, right = (
+            _apply_to_points(previous, keypoints[:, :, index, :2]) for index in self.shoulder_indices
+        )
+        return left, right
+
+    def _boxes(self, boxes: Optional[Tensor], previous: Tensor) -> Tensor:
+        if boxes is None:
+            raise ValueError("boxes are needed to normalize keypoints to the box")
+        return _apply_to_boxes(previous, boxes)
+
+    def get_matrix(self, keypoints: Tensor, boxes: Optional[Tensor], previous: Tensor, generator: Optional[torch.Generator]) -> Tensor:
+        if self.center == "nose":
+            center = _apply_to_points(previous, keypoints[:, :, self.nose_index, :2]).nanmean(dim=1)
+        elif self.center == "shoulders":
+            left, right = self._shoulders(keypoints, previous)
+            center = ((left + right) / 2).nanmean(dim=1)
+        else:
+            transformed_boxes = self._boxes(boxes, previous)
+            center = ((transformed_boxes[..., :2] + transformed_boxes[..., 2:]) / 2).nanmean(dim=1)
+        size = torch.ones(len(keypoints), dtype=keypoints.dtype, device=keypoints.device)
+        if self.scale == "shoulders":
+            left, right = self._shoulders(keypoints, previous)
+            size = (left - right).norm(dim=-1).nanmean(dim=1)
+        elif self.scale == "box":
+            transformed_boxes = self._boxes(boxes, previous)
+            size = (transformed_boxes[..., 3] - transformed_boxes[..., 1]).nanmean(dim=1)
+        # clips without the reference are not moved nor scaled
+        center = center.nan_to_num(0)
+        scale = torch.where(torch.isfinite(size) & (size > 0), 1 / size, torch.ones_like(size))
+        matrix = torch.zeros((len(keypoints), 3, 3), dtype=keypoints.dtype, device=keypoints.device)
+        matrix[:, 0, 0] = scale
+        matrix[:, 1, 1] = scale
+        matrix[:, :2, 2] = -scale[:, None] * center
+        matrix[:, 2, 2] = 1
+        return matrix
+
+
+class RandomAffine(AffineKeypointTransform):
+    '''Rotates each clip a random angle in [-degrees, degrees], scales it by a random factor in scale and translates it by a random amount in [-translate, translate] on each axis.
+    Rotation and scale are around the origin, so normalize keypoints before to do them around the person'''
+
+    def __init__(self, degrees: float = 0., scale: tuple[float, float] = (1., 1.), translate: tuple[float, float] = (0., 0.)) -> None:
+        self.degrees = degrees
+        self.scale = scale
+        self.translate = translate
+
+    def get_matrix(self, keypoints: Tensor, boxes: Optional[Tensor], previous: Tensor, generator: Optional[torch.Generator]) -> Tensor:
+        clips = len(keypoints)
+        angle = _uniform(-math.radians(self.degrees), math.radians(self.degrees), clips, generator, keypoints)
+        scale = _uniform(self.scale[0], self.scale[1], clips, generator, keypoints)
+        cos, sin = torch.cos(angle) * scale, torch.sin(angle) * scale
+        matrix = torch.zeros((clips, 3, 3), dtype=keypoints.dtype, device=keypoints.device)
+        matrix[:, 0, 0], matrix[:, 0, 1], matrix[:, 1, 0], matrix[:, 1, 1] = cos, -sin, sin, cos
+        matrix[:, 0, 2] = _uniform(-self.translate[0], self.translate[0], clips, generator, keypoints)
+        matrix[:, 1, 2] = _uniform(-self.translate[1], self.translate[1], clips, generator, keypoints)
+        matrix[:, 2, 2] = 1
+        return matrix
+
+
+class RandomRotation(RandomAffine):
+    '''Rotates each clip a random angle in [-degrees, degrees] around the origin'''
+
+    def __init__(self, degrees: float) -> None:
+        super().__init__(degrees=degrees)
+
+
+class RandomScale(RandomAffine):
+    '''Scales each clip by a random factor in scale around the origin'''
+
+    def __init__(self, scale: tuple[float, float]) -> None:
+        super().__init__(scale=scale)
+
+
+class TemporalResample(KeypointTransform):
+    '''Resamples clips (and boxes) to the given amount of frames, interpolating linearly between frames'''
+
+    def __init__(self, frames: int) -> None:
+        self.frames = frames
+
+    def transform(self, keypoints: Tensor, boxes: Optional[Tensor], generator: Optional[torch.Generator]) -> tuple[Tensor, Optional[Tensor]]:
+        return resample_frames(keypoints, self.frames), None if boxes is None else resample_frames(boxes, self.frames)
+
+
+class RandomSpeed(KeypointTransform):
+    '''Plays clips at a random speed in [min_speed, max_speed], resampling them to their amount of frames divided by the speed.
+    Clips of a batch share their length, so the speed is chosen once per call'''
+
+    def __init__(self, min_speed: float = .8, max_speed: float = 1.2) -> None:
+        self.min_speed = min_speed
+        self.max_speed = max_speed
+
+    def transform(self, keypoints: Tensor, boxes: Optional[Tensor], generator: Optional[torch.Generator]) -> tuple[Tensor, Optional[Tensor]]:
+        speed = float(torch.rand(1, generator=generator)) * (self.max_speed - self.min_speed) + self.min_speed
+        frames = max(1, round(keypoints.shape[1] / speed))
+        return resample_frames(keypoints, frames), None if boxes is None else resample_frames(boxes, frames)
+
+
+class KeypointDropout(KeypointTransform):
+    '''Replaces every channel of each keypoint with value with probability p, and of whole frames with probability frame_p'''
+
+    def __init__(self, p: float = .1, frame_p: float = 0., value: float = math.nan) -> None:
+        self.p = p
+        self.frame_p = frame_p
+        self.value = value
+
+    def transform(self, keypoints: Tensor, boxes: Optional[Tensor], generator: Optional[torch.Generator]) -> tuple[Tensor, Optional[Tensor]]:
+        drop = torch.rand(keypoints.shape[:3], generator=generator) < self.p
+        if self.frame_p > 0:
+            drop |= (torch.rand(keypoints.shape[:2], generator=generator) < self.frame_p)[..., None]
+        return keypoints.masked_fill(drop.to(keypoints.device)[..., None], self.value), boxes
+
+
+class KeypointPipeline:
+    '''Applies the transforms in order to (T, K, C) or (B, T, K, C) keypoints (and their boxes if given), returning them with the same amount of dimensions.
+    Consecutive affine transforms are fused: their matrices are multiplied and applied to the keypoints once'''
+
+    def __init__(self, transforms: Sequence[KeypointTransform], seed: Optional[int] = None) -> None:
+        self.transforms = list(transforms)
+        self.generator = None if seed is None else torch.Generator().manual_seed(seed)
+
+    def transform(self, keypoints: Tensor, boxes: Optional[Tensor] = None, generator: Optional[torch.Generator] = None) -> tuple[Tensor, Optional[Tensor]]:
+        '''Returns the transformed keypoints and boxes'''
+        generator = generator or self.generator
+        batched = keypoints.dim() == 4
+        if not batched:
+            keypoints = keypoints.unsqueeze(0)
+            boxes = None if boxes is None else boxes.unsqueeze(0)
+        boxes = None if boxes is None else boxes.to(keypoints.dtype)
+        matrix: Optional[Tensor] = None
+        for transform in self.transforms:
+            if isinstance(transform, AffineKeypointTransform):
+                previous = matrix if matrix is not None else torch.eye(3, dtype=keypoints.dtype, device=keypoints.device).expand(len(keypoints), 3, 3)
+                matrix = transform.get_matrix(keypoints, boxes, previous, generator) @ previous
+                continue
+            if matrix is not None:
+                keypoints, boxes = apply_affine(keypoints, matrix), None if boxes is None else _apply_to_boxes(matrix, boxes)
+                matrix = None
+            keypoints, boxes = transform.transform(keypoints, boxes, generator)
+        if matrix is not None:
+            keypoints, boxes = apply_affine(keypoints, matrix), None if boxes is None else _apply_to_boxes(matrix, boxes)
+        if not batched:
+            keypoints = keypoints.squeeze(0)
+            boxes = None if boxes is None else boxes.squeeze(0)
+        return keypoints, boxes
+
+    def __call__(self, keypoints: Tensor, boxes: Optional[Tensor] = None, generator: Optional[torch.Generator] = None) -> Tensor:
+        return self.transform(keypoints, boxes, generator)[0]
@@ -1,18 +1,21 @@
 from math import ceil
-from typing import Callable, TypeVar, Optional
+from typing import Callable, TypeVar, Literal, Iterable, Optional, Union, TYPE_CHECKING
 
 import torch
 from torch import Tensor, stack
-from torchvision.transforms.functional import crop, resize
-from torchtext.vocab import Vocab
+
+if TYPE_CHECKING:
+    from torchtext.vocab import Vocab
 
 from lsat.typing import Box, KeypointData
 
 T = TypeVar('T')
-def get_frames_reduction_transform(max_frames: int) -> Callable[[list[T]], list[T]]:
+def get_frames_reduction_transform(max_frames: int) -> Callable[[Iterable[T]], list[T]]:
     '''Given the desired frame amount, returns a frames reductor transform'''
-    def frames_reduction_transform(clip: list[T]) -> list[T]:
+    def frames_reduction_transform(clip: Iterable[T]) -> list[T]:
         '''Reduces amount of frames of sequence to max_frames'''
+        if not isinstance(clip, list):
+            clip = list(clip)
         frames: list[T] = []
         for frame in [c for (i,c) in enumerate(clip) if (i%(ceil(len(clip)/max_frames)) == 0)]:
             frames.append(frame)
@@ -22,74 +25,136 @@ def get_frames_reduction_transform(max_frames: int) -> Callable[[list[T]], list[
         return frames
     return frames_reduction_transform
 
-def _frame_roi_selector_transform(img: Tensor, roi: Box, height: int, width: int) -> Tensor:
-    '''Frame-level transform that crops a given roi from the frame and resizes it to to the desired values keeping the aspect ratio and padding with zeros if necessary'''
-    img = crop(img, int(roi['y1']),int(roi['x1']),int(roi['height']),int(roi['width']))
-    pad = torch.zeros(3, height, width, dtype=torch.uint8)
+def _letterbox_size(roi: Box, height: int, width: int) -> tuple[int, int]:
+    '''Returns the size that the roi is resized to in order to fit in height x width keeping its aspect ratio'''
     if (roi['height'] - height) > (roi['width'] - width):
-        new_width = int(roi['width']*height/roi['height'])
-        img = resize(img, [height, new_width])
-        pad[:, :, int((width - new_width)/2):-int((width - new_width)/2) - (1 if (width - new_width) % 2 == 1 else 0)] = img
+        return height, int(roi['width']*height/roi['height'])
+    return int(roi['height']*width/roi['width']), width
+
+def crop_and_resize_frames(frames: Tensor, rois: list[Box], height: int, width: int, out: Optional[Tensor] = None) -> Tensor:
+    '''Crops the given roi from each of the (T, 3, H, W) frames and resizes it to height x width keeping the aspect ratio and padding with zeros.
+    Frames that share the same roi are cropped and resized together in a single call. The result is written to out if given'''
+    from torchvision.transforms.functional import crop, resize
+    frames_amount = min(len(frames), len(rois))
+    if out is None:
+        out = torch.zeros(frames_amount, 3, height, width, dtype=frames.dtype)
     else:
-        new_height = int(roi['height']*width/roi['width'])
-        img = resize(img, [new_height, width])
-        pad[:, int((height - new_height)/2):-int((height - new_height)/2) - (1 if (height - new_height) % 2 == 1 else 0), :] = img
-    return pad
+        out = out[:frames_amount]
+        out.zero_()
+    groups: dict[tuple[float, float, float, float], tuple[Box, list[int]]] = {}
+    for i, roi in enumerate(rois[:frames_amount]):
+        groups.setdefault((roi['y1'], roi['x1'], roi['height'], roi['width']), (roi, []))[1].append(i)
+    for roi, indices in groups.values():
+        group = frames[:frames_amount] if len(indices) == frames_amount else frames[indices]
+        new_height, new_width = _letterbox_size(roi, height, width)
+        resized = resize(crop(group, int(roi['y1']), int(roi['x1']), int(roi['height']), int(roi['width'])), [new_height, new_width])
+        pad_top = (height - new_height) // 2
+        pad_left = (width - new_width) // 2
+        if len(indices) == frames_amount:
+            out[:, :, pad_top:pad_top + new_height, pad_left:pad_left + new_width] = resized
+        else:
+            out[indices, :, pad_top:pad_top + new_height, pad_left:pad_left + new_width] = resized
+    return out
 
-def get_roi_selector_transform(height: int, width: int, rois: list[Box]) -> Callable[[Tensor], Tensor]:
-    '''Given height and width, returns a frame-level roi selector transform'''
-    def roi_selector_transform(frames: Tensor) -> Tensor:
-        cropped_frames = [_frame_roi_selector_transform(frame, roi, height, width) for (roi, frame) in zip(rois, frames)]
-        return stack(cropped_frames)
+def get_roi_selector_transform(height: int, width: int, rois: list[Box], reuse_buffer: bool = False) -> Callable[[Union[Tensor, Iterable[Tensor]]], Tensor]:
+    '''Given height and width, returns a roi selector transform for the frames of a clip.
+    If reuse_buffer is set, the output buffer is allocated once and overwritten on each call, so the result must be consumed (or copied) before calling it again'''
+    buffer: list[Tensor] = []
+    def roi_selector_transform(frames: Union[Tensor, Iterable[Tensor]]) -> Tensor:
+        if not isinstance(frames, Tensor):
+            frames = stack(list(frames))
+        if not reuse_buffer:
+            return crop_and_resize_frames(frames, rois, height, width)
+        if len(buffer) == 0 or len(buffer[0]) < len(frames) or buffer[0].dtype != frames.dtype:
+            buffer[:] = [torch.zeros(len(frames), 3, height, width, dtype=frames.dtype)]
+        return crop_and_resize_frames(frames, rois, height, width, buffer[0])
     return roi_selector_transform
 
+def _select_keypoints(keypoints: Tensor, index: Tensor) -> Tensor:
+    '''Gathers from a (..., K, 3) tensor the keypoints in index (sorted and without repetitions), ignoring those out of range'''
+    if len(index) != 0 and index[-1] >= keypoints.shape[-2]:
+        index = index[index < keypoints.shape[-2]]
+    return keypoints.index_select(-2, index)
+
 def get_keypoint_format_transform(keypoints_to_use: list[int]) -> Callable[[KeypointData], Tensor]:
     '''Given list of indices of the keypoints to use, returns a KeypointData to tensor transform'''
+    index = torch.tensor(sorted(set(keypoints_to_use)), dtype=torch.long)
     def keypoint_format_transform(keypoint_data: KeypointData) -> Tensor:
         '''Using a list of K keypoint indices, transforms a KeypointData item to a tensor with shape (3, K). Each of the K columns has x, y and confidence'''
-        return Tensor([[
-            k for j,k in enumerate(keypoint_data['keypoints']) if (j%3) == i and int(j/3) in keypoints_to_use
-        ] for i in range(3)])
+        return _select_keypoints(torch.tensor(keypoint_data['keypoints']).view(-1, 3), index).T
     return keypoint_format_transform
 
+def get_clip_keypoint_format_transform(keypoints_to_use: list[int]) -> Callable[[Union[list[KeypointData], Tensor]], Tensor]:
+    '''Given list of indices of the keypoints to use, returns a transform of a whole clip of KeypointData (or a (T, K, 3) tensor) to a tensor'''
+    index = torch.tensor(sorted(set(keypoints_to_use)), dtype=torch.long)
+    def clip_keypoint_format_transform(keypoints: Union[list[KeypointData], Tensor]) -> Tensor:
+        '''Using a list of K keypoint indices, transforms the T frames of a clip to a tensor with shape (T, 3, K), same as stacking the output of keypoint_format_transform for each frame'''
+        if not isinstance(keypoints, Tensor):
+            if len(keypoints) == 0:
+                return torch.empty(0, 3, len(index))
+            keypoints = torch.tensor([frame['keypoints'] for frame in keypoints]).view(len(keypoints), -1, 3)
+        return _select_keypoints(keypoints, index).permute(0, 2, 1)
+    return clip_keypoint_format_transform
+
 def keypoints_norm_to_nose_transform(keypoints: Tensor) -> Tensor:
-    '''Normalizes keypoints (in format given by keypoint_format_transform) to nose keypoint (index 0 using halpe format)'''
-    return (keypoints - Tensor([
-        [keypoints[0][0].item()],
-        [keypoints[1][0].item()],
-        [0]
-    ]))
+    '''Normalizes keypoints (in format given by keypoint_format_transform, or (..., 3, K) as the one of get_clip_keypoint_format_transform) to nose keypoint
+    (index 0 using halpe format) of each frame'''
+    offset = torch.zeros_like(keypoints[..., :1])
+    offset[..., :2, :] = keypoints[..., :2, :1]
+    return keypoints - offset
 
-def _get_interpolated_point(i: int, points: list[tuple[float, float, float]], threshold: float, default: tuple[float, float] = (0,0)) -> tuple[float, float]:
-    '''Returns for a point, if confidence lower than threshold, the interpolation of the next and previous point with confidence over threshold'''
-    next_point = next(((point[0], point[1]) for point in points[(i+1):] if point[2] > threshold), None)
-    prev_point = next(((point[0], point[1]) for point in reversed(points[:i]) if point[2] > threshold), None)
-    return ((prev_point[0]+next_point[0])/2, (prev_point[1]+next_point[1])/2) if (prev_point is not None and next_point is not None) else (
-        next_point if next_point is not None else (
-            prev_point if prev_point is not None else default
-        )
-    )
+def interpolate_keypoints(
+        keypoints: Tensor,
+        threshold: float = .2,
+        max_missing_percent: float = .7,
+        default: tuple[float, float] = (0, 0),
+        mode: Literal["midpoint", "linear"] = "midpoint"
+    ) -> Tensor:
+    '''For a (T, K, 3) or (B, T, K, 3) tensor of x, y and confidence, replaces the points with confidence lower than threshold with the interpolation of the previous and next points with confidence over threshold (or the only one of them found).
+    Keypoints missing in more than max_missing_percent of the frames are replaced by default. Returns the x and y of each point, with shape (..., T, K, 2)'''
+    xy = keypoints[..., :2]
+    confidence = keypoints[..., 2]
+    frames = keypoints.shape[-3]
+    if frames == 0:
+        return xy.clone()
+    valid = confidence > threshold
+    index = torch.arange(frames, device=keypoints.device).view(-1, 1).expand_as(valid)
+    # for each point, index of the last valid point before it and of the first valid point after it
+    prev_index = torch.where(valid, index, -1).cummax(dim=-2).values
+    next_index = torch.where(valid, index, frames).flip(-2).cummin(dim=-2).values.flip(-2)
+    has_prev = (prev_index >= 0).unsqueeze(-1)
+    has_next = (next_index < frames).unsqueeze(-1)
+    prev_xy = xy.gather(-3, prev_index.clamp(min=0).unsqueeze(-1).expand_as(xy))
+    next_xy = xy.gather(-3, next_index.clamp(max=frames - 1).unsqueeze(-1).expand_as(xy))
+    if mode == "linear":
+        weight = ((index - prev_index) / (next_index - prev_index).clamp(min=1)).unsqueeze(-1).to(xy.dtype)
+        both_xy = prev_xy + (next_xy - prev_xy) * weight
+    else:
+        both_xy = (prev_xy + next_xy) / 2
+    default_xy = torch.tensor(default, dtype=xy.dtype, device=xy.device)
+    interpolated = torch.where(has_prev & has_next, both_xy, torch.where(has_prev, prev_xy, torch.where(has_next, next_xy, default_xy)))
+    interpolated = torch.where(valid.unsqueeze(-1), xy, interpolated)
+    too_missing = ((confidence < threshold).sum(dim=-2) / frames > max_missing_percent).unsqueeze(-2).unsqueeze(-1)
+    return torch.where(too_missing, default_xy, interpolated)
 
-def _interpolate_each(keypoints: list[tuple[float, float, float]], threshold: float, max_missing_percent: float, default: Optional[tuple[float, float]] = None) -> Optional[list[tuple[float, float]]]:
-    '''For a list of points, replaces those with confidence lower than threshold with the interpolation of the next and previous point with confidence over threshold'''
-    # keypoints contains [x,y,z] for each frame 
-    missing = sum(1 for point in keypoints if point[2] < threshold)
-    if missing / len(keypoints) <= max_missing_percent:
-        return [
-            (each[0], each[1]) if each[2] > threshold else _get_interpolated_point(i, keypoints, threshold) for i, each in enumerate(keypoints)
-        ]
-    return None if not default else [default for _ in keypoints]
+def get_interpolate_keypoints_transform(
+        threshold: float = .2,
+        max_missing_percent: float = .7,
+        default: tuple[float, float] = (0, 0),
+        mode: Literal["midpoint", "linear"] = "midpoint"
+    ) -> Callable[[Tensor], Tensor]:
+    '''Returns a transform that applies interpolate_keypoints with the given parameters to a (T, K, 3) or (B, T, K, 3) tensor'''
+    def interpolate_transform(keypoints: Tensor) -> Tensor:
+        return interpolate_keypoints(keypoints, threshold, max_missing_percent, default, mode)
+    return interpolate_transform
 
 def interpolate_keypoints_transform(keypoints: list[Tensor]) -> list[Tensor]:
-    '''For a list of keypoint frames (each in format given by keypoint_format_transform), applies __interpolate_each__ to each frame'''
-    # switch dims to keypoints, frames, (x,y,c)
-    keypoints_trans = stack(keypoints).permute(2, 0, 1)
-    interpolated_keypoints = Tensor([_interpolate_each(each.tolist(), 0.2, 0.7, (0, 0)) for each in keypoints_trans])
-    return [
-        frame for frame in interpolated_keypoints.permute(1, 2, 0)
-    ]
+    '''For a list of keypoint frames (each in format given by keypoint_format_transform), applies interpolate_keypoints to the whole sequence. Each of the returned frames has shape (2, K)'''
+    # switch dims to frames, keypoints, (x,y,c)
+    interpolated_keypoints = interpolate_keypoints(stack(keypoints).permute(0, 2, 1))
+    return list(interpolated_keypoints.permute(0, 2, 1))
 
-def get_label_to_tensor_transform(bos_idx: int, eos_idx: int, tokenizer: Callable[[str], list[str]], vocab: Vocab) -> Callable[[str], Tensor]:
+def get_label_to_tensor_transform(bos_idx: int, eos_idx: int, tokenizer: Callable[[str], list[str]], vocab: 'Vocab') -> Callable[[str], Tensor]:
     '''Returns a label to tensor transform using given tokenizer and vocab'''
     def label_to_tensor_transform(label: str) -> Tensor:
         '''Tokenizes label and transforms it to tensor of the token indices'''
@@ -0,0 +1,384 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from glob import glob
+from itertools import product
+from types import SimpleNamespace
+from typing import Any, Callable, Iterator, Optional
+
+import cv2
+import h5py
+import numpy as np
+import torch
+from numpy.typing import NDArray
+
+import extract_keypoints as extraction
+from bench_tracking import synthetic_detections
+from helpers import get_video_info
+
+
+# stages of the pipeline: the functions of extract_keypoints timed as each one, and if they return an iterator whose items are timed instead of the call
+STAGES: dict[str, list[tuple[str, bool]]] = {
+	'decode': [('load_video', False), ('iter_video', True), ('get_video_info', False)],
+	'track': [('track_people', False)],
+	'crop': [('crop_person', False), ('blackout_box', False), ('crop_blackout_box', False)],
+	'process_keys': [('process_keys', False)],
+}
+# dtype of the keypoints while they are extracted and storage options of each --dtypes value
+DTYPES = {
+	'float16': (np.float16, False),
+	'float32': (np.float32, False),
+	'int16': (np.float16, True),
+}
+# size of the frames synthetic detections are generated for
+DETECTIONS_SIZE = (1920, 1080)
+
+class StageTimer:
+	'''Accumulates the time spent in each stage and its calls. The time of a stage excludes the one of the stages nested in it (as the decoding of the frames
+	consumed by the tracking when streaming), so the stages add up to at most the total time'''
+
+	def __init__(self) -> None:
+		self.seconds: dict[str, float] = {}
+		self.calls: dict[str, int] = {}
+		self._children: list[float] = []
+
+	@contextmanager
+	def stage(self, name: str) -> Iterator[None]:
+		start = time.perf_counter()
+		self._children.append(0.)
+		try:
+			yield
+		finally:
+			elapsed = time.perf_counter() - start
+			self.seconds[name] = self.seconds.get(name, 0.) + elapsed - self._children.pop()
+			self.calls[name] = self.calls.get(name, 0) + 1
+			if self._children:
+				self._children[-1] += elapsed
+
+	def wrap(self, function: Callable, name: str) -> Callable:
+		def timed(*args, **kwargs):
+			with self.stage(name):
+				return function(*args, **kwargs)
+		return timed
+
+	def wrap_iterator(self, function: Callable, name: str) -> Callable:
+		def timed(*args, **kwargs):
+			iterator = iter(function(*args, **kwargs))
+			while True:
+				with self.stage(name):
+					try:
+						item = next(iterator)
+					except StopIteration:
+						return
+				yield item
+		return timed
+
+@contextmanager
+def patched(module: Any, **attributes: Any) -> Iterator[None]:
+	'Replaces attributes of the module while in the block'
+	previous = {name: getattr(module, name) for name in attributes}
+	for name, value in attributes.items():
+		setattr(module, name, value)
+	try:
+		yield
+	finally:
+		for name, value in previous.items():
+			setattr(module, name, value)
+
+
+class MockDetector:
+	'''Replaces YOLO replaying the detections of each clip, as a stream of results of the whole clip (track with the clip path) or one result per call (track with a frame).
+	load selects the clip whose detections are replayed'''
+
+	def __init__(self, detections: dict[str, list[NDArray]]) -> None:
+		self.detections = detections
+		self._frames: Iterator[NDArray] = iter([])
+
+	def load(self, clip_path: str) -> None:
+		self._frames = iter(self.detections[clip_path])
+
+	@staticmethod
+	def _result(boxes: NDArray) -> SimpleNamespace:
+		# YOLO boxes data has the box, the track id and the confidence of each detection
+		data = np.zeros((len(boxes), 6), dtype=np.float32)
+		data[:, :4] = boxes
+		data[:, 5] = 1
+		return SimpleNamespace(boxes=SimpleNamespace(data=torch.from_numpy(data)))
+
+	def track(self, source: Any, stream: bool = False, **kwargs: Any) -> Any:
+		if isinstance(source, str):
+			self.load(source)
+			return (self._result(boxes) for boxes in self._frames)
+		return [self._result(next(self._frames, np.empty((0, 4))))]
+
+
+class MockHolistic:
+	'Replaces MediaPipe Holistic returning the same landmarks for every frame, so only the cost of the rest of the pipeline is measured'
+
+	def __init__(self, seed: int = 0) -> None:
+		rng = np.random.default_rng(seed)
+		def landmarks(amount: int) -> SimpleNamespace:
+			return SimpleNamespace(landmark=[SimpleNamespace(x=x, y=y, z=z, visibility=v) for x, y, z, v in rng.random((amount, 4)).tolist()])
+		self.results = SimpleNamespace(**{part: landmarks(amount) for part, _, amount, _ in extraction.LANDMARK_PARTS})
+
+	def process(self, frame: NDArray[np.uint8]) -> SimpleNamespace:
+		return self.results
+
+	def reset(self) -> None:
+		pass
+
+
+class TimedHolistic:
+	'Holistic whose calls to process are timed as the holistic stage'
+
+	def __init__(self, holistic: Any, timer: StageTimer) -> None:
+		self.holistic = holistic
+		self.timer = timer
+
+	def process(self, frame: NDArray[np.uint8]) -> Any:
+		with self.timer.stage('holistic'):
+			return self.holistic.process(frame)
+
+	def reset(self) -> None:
+		self.holistic.reset()
+
+
+def write_synthetic_clip(path: str, detections: list[NDArray], size: tuple[int, int], fps: int = 30) -> None:
+	'Writes a video with a filled box for each detection over a gradient background'
+	width, height = size
+	background = np.empty((height, width, 3), dtype=np.uint8)
+	background[...] = np.linspace(0, 255, width, dtype=np.uint8)[None, :, None]
+	writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size) # type: ignore
+	for i_frame, boxes in enumerate(detections):
+		frame = background.copy()
+		for i_box, box in enumerate(boxes.astype(int)):
+			cv2.rectangle(frame, (box[0], box[1]), (box[2], box[3]), ((i_box*70) % 256, 120, (i_frame*3) % 256), -1)
+		writer.write(frame)
+	writer.release()
+
+def generate_synthetic_clips(path: str, clips: int, frames: int, people: int, spurious: float, size: tuple[int, int]) -> dict[str, list[NDArray]]:
+	'Writes the synthetic clips, returns the detections of each one. Each spurious detection is tracked as a new person, as in real clips'
+	scale = np.array(size * 2) / np.array(DETECTIONS_SIZE * 2)
+	detections = {}
+	for i_clip in range(clips):
+		clip_path = f"{path}/synthetic_{i_clip}.mp4"
+		clip_detections = [
+			np.clip(boxes * scale, 0, np.array(size * 2) - 1) for boxes in synthetic_detections(frames, people, spurious, seed=i_clip)
+		]
+		write_synthetic_clip(clip_path, clip_detections, size)
+		detections[clip_path] = clip_detections
+	return detections
+
+def load_cached_detections(clip_paths: list[str], cache_path: str) -> dict[str, list[NDArray]]:
+	'''Returns the detections of each clip stored in the cache, a npz with a (N, 5) array (frame, x1, y1, x2, y2) for each clip name. Clips missing from it are run
+	through YOLO once (as extract_keypoints does) and added to the cache, so later runs are offline'''
+	cache = dict(np.load(cache_path)) if os.path.exists(cache_path) else {}
+	missing = [clip_path for clip_path in clip_paths if os.path.basename(clip_path) not in cache]
+	if missing:
+		from ultralytics import YOLO
+		model = YOLO("yolov8n-pose.pt")
+		for clip_path in missing:
+			results = model.track(source=clip_path, persist=True, conf=0.75, verbose=False, stream=True)
+			cache[os.path.basename(clip_path)] = np.concatenate([np.empty((0, 5))] + [
+				np.concatenate([np.full((len(result.boxes.data), 1), i_frame), result.boxes.data[:, :4].cpu().numpy()], axis=1)
+				for i_frame, result in enumerate(results)
+			])
+		np.savez(cache_path, **cache)
+	detections = {}
+	for clip_path in clip_paths:
+		rows = cache[os.path.basename(clip_path)]
+		_, frame_count = get_video_info(clip_path)
+		detections[clip_path] = [rows[rows[:, 0] == i_frame, 1:] for i_frame in range(frame_count)]
+	return detections
+
+
+def new_holistic_factory(kind: str) -> Callable[[], Any]:
+	return MockHolistic if kind == 'mock' else extraction.new_holistic
+
+def process(clip_path: str, streaming: bool, detector: MockDetector, holistics: list) -> tuple[list, list, int]:
+	detector.load(clip_path)
+	if streaming:
+		return extraction.process_clip_streaming(clip_path, detector, holistics) # type: ignore
+	return extraction.process_clip(clip_path, detector, holistics[0]) # type: ignore
+
+def run_staged(clip_paths: list[str], detections: dict[str, list[NDArray]], streaming: bool, dtype: str, storage: dict, holistic: str, output: str) -> dict[str, Any]:
+	'''Processes the clips in this process timing each stage, the h5 write of their keypoints and the peak memory allocated (in a second run, as tracing slows allocations)'''
+	timer = StageTimer()
+	timed_functions = {
+		function: (timer.wrap_iterator if iterates else timer.wrap)(getattr(extraction, function), stage)
+		for stage, functions in STAGES.items() for function, iterates in functions
+	}
+	new_holistic = new_holistic_factory(holistic)
+	detector = MockDetector(detections)
+	frames = 0
+	with patched(extraction, JOINTS_SIZE=DTYPES[dtype][0], new_holistic=lambda: TimedHolistic(new_holistic(), timer), **timed_functions):
+		holistics = [extraction.new_holistic()]
+		start = time.perf_counter()
+		with h5py.File(output, 'w') as hdf5_file:
+			for clip_path in clip_paths:
+				people_keypoints, people_boxes, frame_count = process(clip_path, streaming, detector, holistics)
+				with timer.stage('h5_write'):
+					extraction.store_clip(hdf5_file, os.path.basename(clip_path), people_keypoints, people_boxes, storage)
+				frames += frame_count
+		seconds = time.perf_counter() - start
+	stages = {
+		stage: {'seconds': timer.seconds[stage], 'calls': timer.calls[stage], 'frames_per_second': frames / timer.seconds[stage] if timer.seconds[stage] > 0 else None}
+		for stage in [*STAGES, 'holistic', 'h5_write'] if stage in timer.seconds
+	}
+	stages['other'] = {'seconds': max(0., seconds - sum(timer.seconds.values())), 'calls': None, 'frames_per_second': None}
+
+	with patched(extraction, JOINTS_SIZE=DTYPES[dtype][0], new_holistic=new_holistic):
+		holistics = [extraction.new_holistic()]
+		tracemalloc.start()
+		with h5py.File(output, 'w') as hdf5_file:
+			for clip_path in clip_paths:
+				extraction.store_clip(hdf5_file, os.path.basename(clip_path), *process(clip_path, streaming, detector, holistics)[:2], storage)
+		_, peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+	return {
+		'frames': frames,
+		'seconds': seconds,
+		'frames_per_second': frames / seconds,
+		'peak_memory_mb': peak / 2**20,
+		'h5_write_s': timer.seconds.get('h5_write', 0.),
+		'h5_bytes': os.path.getsize(output),
+		'stages': stages,
+	}
+
+# state of each worker process of run_workers, created once by init_bench_worker
+worker: dict = {}
+
+def init_bench_worker(detections: dict[str, list[NDArray]], streaming: bool, dtype: str, storage: dict, holistic: str, shards_path: str) -> None:
+	torch.set_num_threads(1)
+	cv2.setNumThreads(1)
+	extraction.JOINTS_SIZE = DTYPES[dtype][0]
+	extraction.new_holistic = new_holistic_factory(holistic)
+	worker['detector'] = MockDetector(detections)
+	worker['holistics'] = [extraction.new_holistic()]
+	worker['streaming'] = streaming
+	worker['storage'] = storage
+	worker['shard'] = f"{shards_path}/keypoints_{os.getpid()}.h5"
+
+def process_in_bench_worker(clip_path: str) -> tuple[int, float, int]:
+	'Processes the clip storing it in the shard of the worker, returns its amount of frames, the time spent writing it and the peak memory of the worker in bytes'
+	people_keypoints, people_boxes, frame_count = process(clip_path, worker['streaming'], worker['detector'], worker['holistics'])
+	start = time.perf_counter()
+	with h5py.File(worker['shard'], 'a') as hdf5_file:
+		extraction.store_clip(hdf5_file, os.path.basename(clip_path), people_keypoints, people_boxes, worker['storage'])
+	# ru_maxrss is in KB on linux and bytes on mac
+	return frame_count, time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if platform.system() == 'Darwin' else 1024)
+
+def run_workers(clip_paths: list[str], detections: dict[str, list[NDArray]], streaming: bool, dtype: str, storage: dict, holistic: str, workers: int, shards_path: str) -> dict[str, Any]:
+	'Processes the clips with a pool of workers as extract_keypoints does, measuring the throughput of the whole pipeline'
+	start = time.perf_counter()
+	frames, h5_write_s, peak = 0, 0., 0
+	with multiprocessing.get_context('spawn').Pool(workers, init_bench_worker, (detections, streaming, dtype, storage, holistic, shards_path)) as pool:
+		for frame_count, write_s, memory in pool.imap_unordered(process_in_bench_worker, clip_paths):
+			frames += frame_count
+			h5_write_s += write_s
+			peak = max(peak, memory)
+	seconds = time.perf_counter() - start
+	return {
+		'frames': frames,
+		'seconds': seconds,
+		'frames_per_second': frames / seconds,
+		'peak_memory_mb': peak / 2**20,
+		'h5_write_s': h5_write_s,
+		'h5_bytes': sum(os.path.getsize(shard) for shard in glob(f"{shards_path}/*.h5")),
+		'stages': None,
+	}
+
+def get_environment() -> dict[str, Any]:
+	'Returns the versions the benchmark ran with, to tell apart results of different versions'
+	commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+	return {
+		'commit': commit.stdout.strip() if commit.returncode == 0 else None,
+		'python': platform.python_version(),
+		'numpy': np.__version__,
+		'opencv': cv2.__version__,
+		'h5py': h5py.__version__,
+		'platform': platform.platform(),
+		'cpus': os.cpu_count(),
+	}
+
+def config_key(result: dict[str, Any]) -> str:
+	return f"{result['mode']}/{result['dtype']}/{result['workers']}"
+
+def compare(results: list[dict[str, Any]], baseline_path: str, tolerance: float) -> bool:
+	'Prints the throughput of each configuration against the one in the baseline results, returns if any is slower than the tolerance allows'
+	with open(baseline_path) as baseline_file:
+		baseline = {config_key(result): result for result in json.load(baseline_file)['results']}
+	regressed = False
+	for result in results:
+		previous = baseline.get(config_key(result))
+		if previous is None:
+			continue
+		ratio = result['frames_per_second'] / previous['frames_per_second']
+		slower = ratio < 1 - tolerance
+		regressed |= slower
+		print(f"{config_key(result):<28} {previous['frames_per_second']:9.1f} -> {result['frames_per_second']:9.1f} frames/s ({ratio:.2f}x){'  REGRESSION' if slower else ''}")
+	return regressed
+
+def main():
+	parser = argparse.ArgumentParser(description='''Benchmarks the keypoint extraction offline: decodes synthetic or sample clips, replays cached detections instead of running YOLO and
+	(by default) a mocked holistic, and reports the frames per second of each stage, the peak memory and the h5 write time of each configuration as JSON.''')
+	parser.add_argument('--clips-path', help='directory of sample clips (.mp4) to use instead of synthetic ones', default=None)
+	parser.add_argument('--detections', '-d', help='npz with the cached detections of the sample clips, clips missing from it are run through YOLO once and added', default='detections_cache.npz')
+	parser.add_argument('--clips', '-n', help='synthetic clips generated', type=int, default=4)
+	parser.add_argument('--frames', '-f', help='frames of each synthetic clip', type=int, default=150)
+	parser.add_argument('--people', '-p', help='people in each synthetic clip', type=int, default=2)
+	parser.add_argument('--spurious', '-s', help='probability of a spurious detection in each frame of the synthetic clips', type=float, default=.3)
+	parser.add_argument('--size', help='width and height of the synthetic clips', type=int, nargs=2, default=[1280, 720])
+	parser.add_argument('--modes', help='pipelines benchmarked', nargs='+', choices=['streaming', 'materialized'], default=['streaming', 'materialized'])
+	parser.add_argument('--dtypes', help='dtype of the stored keypoints (int16 is float16 quantized when stored)', nargs='+', choices=list(DTYPES), default=['float16'])
+	parser.add_argument('--workers', '-w', help='worker counts, 0 processes clips in this process timing each stage', type=int, nargs='+', default=[0])
+	parser.add_argument('--holistic', help='holistic used, mediapipe needs it installed', choices=['mock', 'mediapipe'], default='mock')
+	parser.add_argument('--compression', '-c', help='compression of the keypoints datasets', choices=['gzip', 'lzf', 'none'], default='gzip')
+	parser.add_argument('--output', '-o', help='JSON file the results are written to', default='bench_extraction.json')
+	parser.add_argument('--baseline', '-b', help='JSON results of a previous run, fails if a configuration is slower than it', default=None)
+	parser.add_argument('--tolerance', '-t', help='fraction of the baseline throughput a configuration can lose before it is a regression', type=float, default=.1)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory(prefix="lsat_bench_extraction_") as temp_path:
+		if args.clips_path is None:
+			print(f"Generating {args.clips} synthetic clips of {args.frames} frames")
+			detections = generate_synthetic_clips(temp_path, args.clips, args.frames, args.people, args.spurious, tuple(args.size))
+		else:
+			detections = load_cached_detections(sorted(glob(f"{args.clips_path}/*.mp4")), args.detections)
+		clip_paths = list(detections)
+
+		results = []
+		for mode, dtype, workers in product(args.modes, args.dtypes, args.workers):
+			storage = {'subsets': list(extraction.ALL_SUBSETS), 'quantize': DTYPES[dtype][1], 'compression': None if args.compression == 'none' else args.compression}
+			streaming = mode == 'streaming'
+			config_path = f"{temp_path}/{mode}_{dtype}_{workers}"
+			os.makedirs(config_path)
+			if workers == 0:
+				result = run_staged(clip_paths, detections, streaming, dtype, storage, args.holistic, f"{config_path}/keypoints.h5")
+			else:
+				result = run_workers(clip_paths, detections, streaming, dtype, storage, args.holistic, workers, config_path)
+			result = {'mode': mode, 'dtype': dtype, 'workers': workers, 'clips': len(clip_paths), **result}
+			results.append(result)
+			print(f"{config_key(result):<28} {result['frames_per_second']:9.1f} frames/s | peak {result['peak_memory_mb']:8.1f} MB | h5 write {result['h5_write_s']:.3f} s, {result['h5_bytes'] / 2**20:.2f} MB")
+			for stage, data in (result['stages'] or {}).items():
+				fps = f"{data['frames_per_second']:11.1f} frames/s" if data['frames_per_second'] is not None else ""
+				print(f"  {stage:<14} {data['seconds']:8.3f} s {fps}")
+
+	with open(args.output, 'w') as output_file:
+		json.dump({'environment': get_environment(), 'args': vars(args), 'results': results}, output_file, indent=1)
+	print(f"Results written to {args.output}")
+	if args.baseline is not None and compare(results, args.baseline, args.tolerance):
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,85 @@
+import argparse
+import time
+
+import numpy as np
+from numpy.typing import NDArray
+
+from tracking import BoxTracker
+
+
+def get_shared_area(box1: NDArray, box2: NDArray) -> float:
+	'Previous implementation, returns the area shared by two boxes in a range from 0 to 1'
+	x1 = max(box1[0], box2[0])
+	y1 = max(box1[1], box2[1])
+	x2 = min(box1[2], box2[2])
+	y2 = min(box1[3], box2[3])
+	shared_area = max(0, x2 - x1) * max(0, y2 - y1)
+	return shared_area / ((box1[2] - box1[0]) * (box1[3] - box1[1]))
+
+def track_people_loop(detections: list[NDArray], frame_count: int) -> list[NDArray[np.float16]]:
+	'Previous implementation of the association of boxes to people, comparing each box with each last box in python'
+	people_frame_level_boxes: list[NDArray[np.float16]] = []
+	last_boxes: list[NDArray] = []
+	for i_frame, people_frame_boxes in enumerate(detections):
+		for i_person, frame_box in enumerate(people_frame_boxes):
+			shared_areas = [get_shared_area(frame_box, last_person_box) for last_person_box in last_boxes]
+			if any(map(lambda x: x>.5, shared_areas)):
+				max_shared_area = max(shared_areas)
+				people_frame_level_boxes[shared_areas.index(max_shared_area)][i_frame] = people_frame_boxes[i_person]
+				last_boxes[shared_areas.index(max_shared_area)] = people_frame_boxes[i_person]
+			else:
+				new_box = np.empty((frame_count, 4), dtype=np.float16)
+				new_box.fill(np.nan)
+				people_frame_level_boxes.append(new_box)
+				people_frame_level_boxes[-1][i_frame] = people_frame_boxes[i_person]
+				last_boxes.append(people_frame_boxes[i_person])
+	return people_frame_level_boxes
+
+def track_people_vectorized(detections: list[NDArray], frame_count: int) -> list[NDArray[np.float16]]:
+	tracker = BoxTracker(frame_count)
+	for i_frame, people_frame_boxes in enumerate(detections):
+		tracker.update(i_frame, people_frame_boxes)
+	return tracker.get_boxes()
+
+def synthetic_detections(frame_count: int, people: int, spurious: float, seed: int = 0) -> list[NDArray]:
+	'Returns for each frame the boxes of people moving slowly over a full HD frame, plus random spurious detections'
+	rng = np.random.default_rng(seed)
+	centers = rng.uniform([200, 200], [1720, 880], (people, 2))
+	sizes = rng.uniform([150, 300], [400, 700], (people, 2))
+	detections = []
+	for _ in range(frame_count):
+		centers += rng.normal(0, 3, centers.shape)
+		boxes = np.concatenate([centers - sizes/2, centers + sizes/2], axis=1)
+		# people are sometimes not detected
+		boxes = boxes[rng.random(people) > .05]
+		if rng.random() < spurious:
+			corner = rng.uniform([0, 0], [1800, 900])
+			boxes = np.concatenate([boxes, [[*corner, *(corner + rng.uniform(20, 120, 2))]]])
+		detections.append(boxes[rng.permutation(len(boxes))])
+	return detections
+
+def main():
+	parser = argparse.ArgumentParser(description='''Compares the previous and vectorized association of detected boxes to people on synthetic detections.''')
+	parser.add_argument('--frames', '-f', help='frames of the synthetic clip', type=int, default=900)
+	parser.add_argument('--people', '-p', help='people in the synthetic clip', type=int, default=6)
+	parser.add_argument('--spurious', '-s', help='probability of a spurious detection in each frame', type=float, default=.3)
+	parser.add_argument('--repeat', '-r', help='times each implementation is run, the best time is reported', type=int, default=5)
+	args = parser.parse_args()
+
+	detections = synthetic_detections(args.frames, args.people, args.spurious)
+	results = {}
+	for name, track in (('loop', track_people_loop), ('vectorized', track_people_vectorized)):
+		times = []
+		for _ in range(args.repeat):
+			start = time.perf_counter()
+			results[name] = track(detections, args.frames)
+			times.append(time.perf_counter() - start)
+		print(f"{name:<12} {min(times)*1000:9.2f} ms  {len(results[name])} people")
+	same = len(results['loop']) == len(results['vectorized']) and all(
+		np.array_equal(loop, vectorized, equal_nan=True) for loop, vectorized in zip(results['loop'], results['vectorized'])
+	)
+	print(f"same output: {same}")
+
+
+if __name__ == "__main__":
+	main()
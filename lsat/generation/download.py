@@ -1,36 +1,94 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from pytube import Playlist
-from pytube.cli import on_progress
+from typing import Optional, TYPE_CHECKING
 
 from lsat.helpers.slugify import slugify
+from lsat.helpers.downloads import DownloadError, download_all, download_file, get_download_data, load_manifest, store_manifest
+from lsat.typing import DownloadData
+
+if TYPE_CHECKING:
+    # loaded when listing videos, downloading from a mirror does not need it
+    from pytube import YouTube
+
+# Playlists de resumen semanal, ecologia, ultimo momento y #leyfederalLSA
+PLAYLISTS = {
+    'resumen_semanal': "https://www.youtube.com/playlist?list=PLhysX0rYXWV2xM3T4KAqaAEg-GEhDXwai",
+    'ecologia': "https://www.youtube.com/playlist?list=PLhysX0rYXWV2DioiHvMjzJs_4UWifmPo9",
+    'ultimo_momento': "https://www.youtube.com/playlist?list=PLhysX0rYXWV2wQnK2nxU4gvcmq5yrHli3",
+    'ley_federal_lsa': "https://www.youtube.com/playlist?list=PLhysX0rYXWV2WNLgIyBiyn3wizILOTuP6"
+}
+SUBTITLES_LANGUAGE = 'es-419'
+
+def list_videos(path: Path, executor: ThreadPoolExecutor) -> list[tuple[Path, 'YouTube']]:
+    '''Returns the subtitles path and video of each video with subtitles that is not downloaded yet. Playlists and the metadata of their videos are fetched concurrently'''
+    from pytube import Playlist
+    playlists = executor.map(lambda playlist: (playlist[0], list(Playlist(playlist[1]).videos)), PLAYLISTS.items())
+    def describe(playlist: str, video: 'YouTube') -> tuple[Path, 'YouTube', bool]:
+        # title and captions are fetched on first access
+        return path / playlist / f"{slugify(video.title)}.vtt", video, SUBTITLES_LANGUAGE in video.captions
+    described = [executor.submit(describe, playlist, video) for playlist, videos in playlists for video in videos]
+    return [(vid_path, video) for vid_path, video, has_subtitles in map(lambda future: future.result(), described) if has_subtitles and not vid_path.exists()]
+
+def download_video(path: Path, vid_path: Path, yt: 'YouTube', retries: int) -> list[DownloadData]:
+    '''Downloads the video (resuming a previous partial download) and then its subtitles, returns their manifest entries'''
+    st = yt.streams.filter(adaptive=True, file_extension='mp4').order_by('resolution').last()
+    if st is None:
+        return []
+    mp4_path = vid_path.with_suffix('.mp4')
+    download_file(st.url, mp4_path, size=st.filesize, retries=retries)
+    # subtitles are written last, their existence marks the video as downloaded
+    with vid_path.open(mode='w') as subs_file:
+        subs_file.write(yt.captions[SUBTITLES_LANGUAGE].generate_srt_captions())
+    return [get_download_data(path, mp4_path, yt.watch_url), get_download_data(path, vid_path, yt.watch_url)]
 
 def main():
-    'Downloads videos and subtitles into raw folder.'
-    # Playlists de resumen semanal, ecologia, ultimo momento y #leyfederalLSA
-    playlists = {
-        'resumen_semanal': "https://www.youtube.com/playlist?list=PLhysX0rYXWV2xM3T4KAqaAEg-GEhDXwai",
-        'ecologia': "https://www.youtube.com/playlist?list=PLhysX0rYXWV2DioiHvMjzJs_4UWifmPo9",
-        'ultimo_momento': "https://www.youtube.com/playlist?list=PLhysX0rYXWV2wQnK2nxU4gvcmq5yrHli3",
-        'ley_federal_lsa': "https://www.youtube.com/playlist?list=PLhysX0rYXWV2WNLgIyBiyn3wizILOTuP6"
-    }
+    parser = argparse.ArgumentParser(description='''Downloads videos and subtitles into raw folder, several at a time. Downloaded files are recorded with their checksum
+    in a manifest, so a copy of the folder served over HTTP can be downloaded (and verified) with --mirror.''')
+    parser.add_argument('--workers', '-w', help='concurrent downloads', type=int, default=4)
+    parser.add_argument('--retries', '-r', help='retries of each failed download', type=int, default=5)
+    parser.add_argument('--mirror', '-m', help='base url of a copy of the raw folder, the files of the manifest are downloaded from it instead of YouTube', default=None)
+    parser.add_argument('--manifest', help='manifest of the downloaded files', default="data/raw/manifest.json")
+    args = parser.parse_args()
+
     path = Path("data/raw")
-    path.mkdir(exist_ok=True,parents=True)
-
-    print("Fetching video list")
-    videos = [(vid_path, yt) for pl_videos in map(lambda pl: 
-                [((path / f"{pl[0]}/{slugify(video.title)}.vtt"), video) for video in Playlist(pl[1]).videos],
-                playlists.items())
-            for (vid_path, yt) in pl_videos if ('es-419' in yt.captions) and not vid_path.exists()]
-
-    for idx, (vid_path, yt) in enumerate(videos):
-        vid_path.parent.mkdir(exist_ok=True,parents=True)
-        yt.register_on_progress_callback(on_progress)
-        st = yt.streams.filter(adaptive=True, file_extension='mp4').order_by('resolution').last()
-        print(f"\nVideo {idx + 1}/{len(videos)}: {yt.title.replace('/', '-')}\n{st}")
-        if st is not None:
-            st.download(output_path=path.resolve(), filename=str(vid_path.absolute()).replace('vtt','mp4'))
-            with vid_path.open(mode='w') as subs_file:
-                subs_file.write(yt.captions['es-419'].generate_srt_captions())
+    path.mkdir(exist_ok=True, parents=True)
+    manifest_path = Path(args.manifest)
+    if args.mirror is not None and not manifest_path.exists():
+        # a fresh copy takes the manifest from the mirror too
+        download_file(f"{args.mirror.rstrip('/')}/{manifest_path.name}", manifest_path, retries=args.retries)
+    manifest = {entry['path']: entry for entry in load_manifest(manifest_path)}
+
+    if args.mirror is not None:
+        done = [0]
+        def on_done(entry: DownloadData, error: Optional[DownloadError]) -> None:
+            done[0] += 1
+            print(f"{done[0]}/{len(manifest)} {entry['path']}" + (f" failed: {error}" if error is not None else ""))
+        errors = download_all(manifest.values(), path, args.workers, args.mirror, on_done, retries=args.retries)
+        print(f"{len(manifest) - len(errors)}/{len(manifest)} files downloaded")
+        return
+
+    with ThreadPoolExecutor(args.workers) as executor:
+        print("Fetching video list")
+        videos = list_videos(path, executor)
+        for vid_path, _ in videos:
+            vid_path.parent.mkdir(exist_ok=True, parents=True)
+        futures = {executor.submit(download_video, path, vid_path, yt, args.retries): yt for vid_path, yt in videos}
+        failed = 0
+        for idx, future in enumerate(as_completed(futures)):
+            title = futures[future].title.replace('/', '-')
+            try:
+                entries = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Video {idx + 1}/{len(videos)}: {title} failed: {e}")
+                continue
+            print(f"Video {idx + 1}/{len(videos)}: {title}" + ("" if entries else " has no mp4 stream"))
+            manifest.update((entry['path'], entry) for entry in entries)
+            # stored after each video, so the manifest is kept if the run is interrupted
+            store_manifest(manifest_path, manifest.values())
+    if failed:
+        print(f"{failed} videos failed, run again to retry them")
 
 if __name__ == "__main__":
     main()
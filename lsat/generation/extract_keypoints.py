@@ -1,34 +1,66 @@
+import argparse
+import json
+import multiprocessing
 import os
-from typing import Optional
+import time
+from glob import glob
+from typing import Optional, TYPE_CHECKING
 
 import cv2
 import h5py
 import numpy as np
+import pandas as pd
 from numpy.typing import NDArray
-from ultralytics import YOLO
-from mediapipe import solutions
 import torch
 
-from helpers import load_video
+from helpers import load_video, iter_video, get_video_info
+from tracking import BoxTracker
+from infer_signer import infer_signers
 
 from hints.Frame import Frame
+from lsat.helpers.keypoint_subsets import KEYPOINT_SUBSETS, ALL_SUBSETS
+from lsat.helpers.keypoints_h5 import write_signer_keypoints
+
+if TYPE_CHECKING:
+	# loaded when models are created, so the functions of the pipeline can be used (as by bench_extraction) without them
+	from ultralytics import YOLO
+	from mediapipe import solutions
 
 
 JOINTS_SIZE = np.float16
+# estimated peak memory used by each worker process when streaming frames
+WORKER_MEMORY = 2 * 1024**3
 
-def process_keys(frame_keypoints, box: NDArray[JOINTS_SIZE]) -> NDArray[JOINTS_SIZE]:
-	pose = [coord for landmark in frame_keypoints.pose_landmarks.landmark for coord in [landmark.x*(box[2]-box[0])+box[0], landmark.y*(box[3]-box[1])+box[1], None, landmark.visibility]] if frame_keypoints.pose_landmarks is not None else [None]*33*4
-	face = [coord for landmark in frame_keypoints.face_landmarks.landmark for coord in [landmark.x*(box[2]-box[0])+box[0], landmark.y*(box[3]-box[1])+box[1], landmark.z, None]] if frame_keypoints.face_landmarks is not None else [None]*468*4
-	rhand = [coord for landmark in frame_keypoints.right_hand_landmarks.landmark for coord in [landmark.x*(box[2]-box[0])+box[0], landmark.y*(box[3]-box[1])+box[1], landmark.z, None]] if frame_keypoints.right_hand_landmarks is not None else [None]*21*4
-	lhand = [coord for landmark in frame_keypoints.left_hand_landmarks.landmark for coord in [landmark.x*(box[2]-box[0])+box[0], landmark.y*(box[3]-box[1])+box[1], landmark.z, None]] if frame_keypoints.left_hand_landmarks is not None else [None]*21*4
-	return np.array(pose + face + rhand + lhand, dtype=JOINTS_SIZE)
+KEYPOINTS_AMOUNT = 33+468+21+21
+# attribute of the holistic results of each part, index of its first keypoint, amount of keypoints, and if it has z (face and hands) or visibility (pose)
+LANDMARK_PARTS = [('pose_landmarks', 0, 33, False), ('face_landmarks', 33, 468, True), ('right_hand_landmarks', 501, 21, True), ('left_hand_landmarks', 522, 21, True)]
 
-def run_holistic(frames: NDArray[np.uint8], box: NDArray[JOINTS_SIZE]) -> NDArray[JOINTS_SIZE]:
-	keypoints = np.empty((len(frames), 33*4+468*4+21*4+21*4), dtype=JOINTS_SIZE)
+def process_keys(frame_keypoints, box: NDArray[JOINTS_SIZE], out: Optional[NDArray[JOINTS_SIZE]] = None) -> NDArray[JOINTS_SIZE]:
+	'Writes x, y, z and visibility of each keypoint (nan if missing) found by holistic in the crop of box into out, converted to frame coordinates'
+	if out is None:
+		out = np.empty(KEYPOINTS_AMOUNT*4, dtype=JOINTS_SIZE)
+	keypoints = out.reshape(KEYPOINTS_AMOUNT, 4)
 	keypoints.fill(np.nan)
-	with solutions.holistic.Holistic(min_detection_confidence=0.5, min_tracking_confidence=0.5) as holistic: # type: ignore
-		for i_frame, frame in enumerate(frames):
-			keypoints[i_frame] = process_keys(holistic.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)), box)
+	x1, y1, x2, y2 = box.astype(np.float32)
+	for part, start, amount, has_z in LANDMARK_PARTS:
+		landmarks = getattr(frame_keypoints, part)
+		if landmarks is not None:
+			coords = np.array([(landmark.x, landmark.y, landmark.z if has_z else landmark.visibility) for landmark in landmarks.landmark], dtype=np.float32)
+			keypoints[start:start+amount, 0] = coords[:, 0]*(x2-x1)+x1
+			keypoints[start:start+amount, 1] = coords[:, 1]*(y2-y1)+y1
+			keypoints[start:start+amount, 2 if has_z else 3] = coords[:, 2]
+	return out
+
+def new_holistic() -> 'solutions.holistic.Holistic':
+	from mediapipe import solutions
+	return solutions.holistic.Holistic(min_detection_confidence=0.5, min_tracking_confidence=0.5) # type: ignore
+
+def run_holistic(frames: NDArray[np.uint8], box: NDArray[JOINTS_SIZE], holistic: 'solutions.holistic.Holistic') -> NDArray[JOINTS_SIZE]:
+	keypoints = np.empty((len(frames), KEYPOINTS_AMOUNT*4), dtype=JOINTS_SIZE)
+	# the same instance is used for every person, its tracking state is cleared before each one
+	holistic.reset()
+	for i_frame, frame in enumerate(frames):
+		process_keys(holistic.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)), box, keypoints[i_frame])
 	return keypoints
 
 def crop_person(box: NDArray[JOINTS_SIZE], frame: Frame) -> Frame:
@@ -51,14 +83,16 @@ def blackout_box(box: NDArray[JOINTS_SIZE], frame: Frame) -> Frame:
 	fr[:, right:, :] = (0,0,0)
 	return fr
 
-def get_shared_area(box1: NDArray[JOINTS_SIZE], box2: NDArray[JOINTS_SIZE]) -> float:
-	'Returns the area shared by two boxes in a range from 0 to 1'
-	x1 = max(box1[0], box2[0])
-	y1 = max(box1[1], box2[1])
-	x2 = min(box1[2], box2[2])
-	y2 = min(box1[3], box2[3])
-	shared_area = max(0, x2 - x1) * max(0, y2 - y1)
-	return shared_area / ((box1[2] - box1[0]) * (box1[3] - box1[1]))
+def crop_blackout_box(person_box: NDArray[JOINTS_SIZE], box: NDArray[JOINTS_SIZE], frame: Frame, out: Frame) -> Frame:
+	'Same as crop_person(person_box, blackout_box(box, frame)), but only copies the pixels inside both boxes, writing them into out'
+	bottom = max(coord_to_pixel(box[1]), coord_to_pixel(person_box[1]))
+	top = min(coord_to_pixel(box[3]), coord_to_pixel(person_box[3]))
+	left = max(coord_to_pixel(box[0]), coord_to_pixel(person_box[0]))
+	right = min(coord_to_pixel(box[2]), coord_to_pixel(person_box[2]))
+	out.fill(0)
+	if top > bottom and right > left:
+		out[bottom-coord_to_pixel(person_box[1]):top-coord_to_pixel(person_box[1]), left-coord_to_pixel(person_box[0]):right-coord_to_pixel(person_box[0])] = frame[bottom:top, left:right]
+	return out
 
 def last_valid_box(boxes: NDArray[JOINTS_SIZE]) -> Optional[NDArray[JOINTS_SIZE]]:
 	'Returns the last row that does not contain a nan box'
@@ -69,85 +103,210 @@ def last_valid_box(boxes: NDArray[JOINTS_SIZE]) -> Optional[NDArray[JOINTS_SIZE]
 
 coord_to_pixel = lambda x : int(x) if not np.isnan(x) else 0
 
+def track_people(results, frame_count: int, clip_path: str) -> list[NDArray[JOINTS_SIZE]]:
+	'Given the YOLO tracking results of each frame, returns the box of each person in each frame (nan if not present)'
+	tracker = BoxTracker(frame_count, JOINTS_SIZE)
+	for i_frame, frame in enumerate(results):
+		if i_frame >= frame_count:
+			break
+		# boxes are in format x1, y1, x2, y2
+		people_frame_boxes = frame.boxes.data[:, :4].cpu().numpy().astype(np.float64)
+		# check if any value of the boxes is larger than 3000, if so print the box
+		if (people_frame_boxes > 3000).any():
+			print(f"Box larger than 3000 in frame {i_frame+1} of clip {clip_path}")
+			print(people_frame_boxes)
+		tracker.update(i_frame, people_frame_boxes)
+	return tracker.get_boxes()
+
+def get_clip_level_boxes(people_frame_level_boxes: list[NDArray[JOINTS_SIZE]]) -> list[NDArray[JOINTS_SIZE]]:
+	'Returns for each person the box that contains all of its frame level boxes'
+	return [
+		np.stack([np.nanmin(person_box[:, 0]), np.nanmin(person_box[:, 1]), np.nanmax(person_box[:, 2]), np.nanmax(person_box[:, 3])])
+		for person_box in people_frame_level_boxes
+	]
+
+def process_clip(clip_path: str, model: 'YOLO', holistic: 'solutions.holistic.Holistic') -> tuple[list[NDArray[JOINTS_SIZE]], list[NDArray[JOINTS_SIZE]], int]:
+	'Returns the keypoints and frame level boxes of each person tracked in the clip, and its amount of frames. Loads the whole video in memory'
+	video, _, frame_count = load_video(clip_path)
+
+	# track people in video
+	results = model.track(source=clip_path, persist=True, conf=0.75, verbose=False, stream=True)
+	people_frame_level_boxes = track_people(results, frame_count, clip_path)
+	clip_level_boxes = get_clip_level_boxes(people_frame_level_boxes)
+
+	# people_keypoints contains for each person, a matrix of frames x keypoints
+	people_keypoints: list[NDArray[JOINTS_SIZE]] = []
+	for i_person, person_box in enumerate(clip_level_boxes):
+		signer_video = np.empty((len(video), coord_to_pixel(person_box[3])-coord_to_pixel(person_box[1]), coord_to_pixel(person_box[2])-coord_to_pixel(person_box[0]), 3), dtype=np.uint8)
+		signer_video.fill(0)
+		for i_frame, (frame, roi) in enumerate(zip(video, people_frame_level_boxes[i_person])):
+			signer_video[i_frame] = crop_person(person_box, blackout_box(roi, frame))
+		signer_keypoints = run_holistic(signer_video, person_box, holistic)
+		people_keypoints.append(signer_keypoints)
+	return people_keypoints, people_frame_level_boxes, frame_count
+
+def process_clip_streaming(clip_path: str, model: 'YOLO', holistics: list['solutions.holistic.Holistic']) -> tuple[list[NDArray[JOINTS_SIZE]], list[NDArray[JOINTS_SIZE]], int]:
+	'''Same as process_clip, but decoding one frame at a time so memory does not grow with the length of the clip.
+	The video is decoded twice: first to track people, as the box of each person in the whole clip is needed to crop it, and then to run holistic over every person of each frame. holistics grows to one instance per person'''
+	_, frame_count = get_video_info(clip_path)
+
+	# track people in video, feeding the decoded frames to the tracker
+	results = (model.track(source=frame, persist=True, conf=0.75, verbose=False)[0] for frame in iter_video(clip_path))
+	people_frame_level_boxes = track_people(results, frame_count, clip_path)
+	clip_level_boxes = get_clip_level_boxes(people_frame_level_boxes)
+
+	while len(holistics) < len(clip_level_boxes):
+		holistics.append(new_holistic())
+	for holistic in holistics[:len(clip_level_boxes)]:
+		holistic.reset()
+	signer_frames = [
+		np.zeros((coord_to_pixel(person_box[3])-coord_to_pixel(person_box[1]), coord_to_pixel(person_box[2])-coord_to_pixel(person_box[0]), 3), dtype=np.uint8)
+		for person_box in clip_level_boxes
+	]
+	people_keypoints = [np.full((frame_count, KEYPOINTS_AMOUNT*4), np.nan, dtype=JOINTS_SIZE) for _ in clip_level_boxes]
+	for i_frame, frame in enumerate(iter_video(clip_path)):
+		if i_frame >= frame_count:
+			break
+		for i_person, person_box in enumerate(clip_level_boxes):
+			signer_frame = crop_blackout_box(person_box, people_frame_level_boxes[i_person][i_frame], frame, signer_frames[i_person])
+			process_keys(holistics[i_person].process(cv2.cvtColor(signer_frame, cv2.COLOR_BGR2RGB)), person_box, people_keypoints[i_person][i_frame])
+	return people_keypoints, people_frame_level_boxes, frame_count
+
+def store_clip(hdf5_file: h5py.File, clip: str, people_keypoints: list[NDArray[JOINTS_SIZE]], people_boxes: list[NDArray[JOINTS_SIZE]], storage: dict):
+	'Stores the keypoints of each person with the storage options: keypoint subsets, quantize and compression (see write_signer_keypoints)'
+	clip_group = hdf5_file.create_group(clip)
+	for i_person, (person_keypoints, person_box) in enumerate(zip(people_keypoints, people_boxes)):
+		signer_group = clip_group.create_group(f"signer_{i_person}")
+		signer_group.create_dataset('boxes', data=person_box, compression=storage['compression'])
+		write_signer_keypoints(signer_group, person_keypoints, storage['subsets'], storage['quantize'], storage['compression'])
+
+def merge_shards(shards_path: str, keypoints_path: str):
+	'Moves the clips stored by each worker in its shard to the keypoints file and deletes the shards'
+	shards = sorted(glob(f"{shards_path}/*.h5"))
+	if len(shards) == 0:
+		return
+	with h5py.File(keypoints_path, 'a') as hdf5_file:
+		for shard in shards:
+			try:
+				with h5py.File(shard, 'r') as shard_file:
+					for clip in shard_file.keys():
+						if clip not in hdf5_file:
+							shard_file.copy(shard_file[clip], hdf5_file, name=clip)
+			except OSError as e:
+				# a shard left unreadable by a killed worker, its clips are processed again
+				print(f"Failed to merge shard {shard}: {e}")
+			os.remove(shard)
+
+def default_workers() -> int:
+	'Amount of workers that fits in the machine, each one using two cores and up to WORKER_MEMORY bytes'
+	cpus = os.cpu_count() or 1
+	memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') if hasattr(os, 'sysconf') else WORKER_MEMORY
+	return max(1, min(cpus // 2, memory // WORKER_MEMORY))
+
+# state of each worker process, created once by init_worker
+worker: dict = {}
+
+def init_worker(input_path: str, shards_path: str, threads: int, streaming: bool, storage: dict):
+	np.random.seed(0)
+	torch.manual_seed(0)
+	torch.set_num_threads(threads)
+	cv2.setNumThreads(threads)
+	worker['input_path'] = input_path
+	worker['shard'] = f"{shards_path}/keypoints_{os.getpid()}.h5"
+	from ultralytics import YOLO
+	worker['model'] = YOLO("yolov8n-pose.pt")
+	worker['streaming'] = streaming
+	worker['storage'] = storage
+	worker['holistics'] = [new_holistic()]
+
+def process_in_worker(clip: str) -> tuple[str, int, Optional[str]]:
+	'Processes a clip storing its keypoints in the shard of the worker, returns the clip, its amount of frames and the error if it failed'
+	try:
+		if worker['streaming']:
+			people_keypoints, people_boxes, frame_count = process_clip_streaming(f"{worker['input_path']}/{clip}", worker['model'], worker['holistics'])
+		else:
+			people_keypoints, people_boxes, frame_count = process_clip(f"{worker['input_path']}/{clip}", worker['model'], worker['holistics'][0])
+		with h5py.File(worker['shard'], 'a') as hdf5_file:
+			store_clip(hdf5_file, clip, people_keypoints, people_boxes, worker['storage'])
+		return clip, frame_count, None
+	except Exception as e:
+		return clip, 0, f"{type(e).__name__}: {e}"
+
+def is_clip(name: str) -> bool:
+	'Whether an entry of the cuts folder is a finished clip'
+	return name.endswith('.mp4') and not name.endswith('.tmp.mp4')
+
+def extract_clips(clips: list[str], failed: dict[str, str], input_path: str, shards_path: str, keypoints_path: str, workers: Optional[int], stream: bool, storage: dict) -> None:
+	'''Extracts the keypoints of the clips in parallel into keypoints_path, updating failed with the errors of the clips'''
+	if len(clips) == 0:
+		print("No clips to process")
+		return
+	workers = max(1, min(workers or default_workers(), len(clips)))
+	threads = max(1, (os.cpu_count() or 1) // workers)
+	print(f"Processing {len(clips)} clips with {workers} workers")
+
+	start = time.time()
+	total_frames = 0
+	with multiprocessing.get_context('spawn').Pool(workers, init_worker, (input_path, shards_path, threads, stream, storage)) as pool:
+		for i_clip, (clip, frame_count, error) in enumerate(pool.imap_unordered(process_in_worker, clips), 1):
+			elapsed = time.time() - start
+			total_frames += frame_count
+			if error is None:
+				failed.pop(clip, None)
+			else:
+				failed[clip] = error
+				print(f"Failed to process clip {clip}: {error}")
+			print(f"{i_clip}/{len(clips)} clips ({len(failed)} failed) | {i_clip/elapsed:.2f} clips/s | {total_frames/elapsed:.1f} frames/s | ETA {(len(clips)-i_clip)*elapsed/i_clip/60:.1f} min")
+
+	merge_shards(shards_path, keypoints_path)
+
 def main():
+	parser = argparse.ArgumentParser(description='''Extracts the keypoints of each person in each clip, using multiple processes.''')
+	parser.add_argument('--workers', '-w', help='amount of worker processes, by default as many as the cpus and memory allow', type=int, default=None)
+	parser.add_argument('--retry', '-r', help='only processes the clips that failed in previous runs', action='store_true')
+	parser.add_argument('--infer-signer', '-i', help='infers the signer of each clip once keypoints are extracted, storing labels with signer data', action='store_true')
+	parser.add_argument('--materialize', '-m', help='loads each whole video in memory instead of streaming its frames', action='store_true')
+	parser.add_argument('--subsets', '-s', help='keypoint subsets stored', nargs='+', choices=list(KEYPOINT_SUBSETS), default=list(ALL_SUBSETS))
+	parser.add_argument('--quantize', '-q', help='stores keypoints as int16 with a scale per clip instead of float16', action='store_true')
+	parser.add_argument('--compression', '-c', help='compression of the keypoints datasets', choices=['gzip', 'lzf', 'none'], default='gzip')
+	args = parser.parse_args()
+	storage = {'subsets': args.subsets, 'quantize': args.quantize, 'compression': None if args.compression == 'none' else args.compression}
+
 	input_path = "lsat/data/cuts"
 	keypoints_path = "lsat/data/keypoints.h5"
-	clips = sorted(os.listdir(input_path))
+	shards_path = "lsat/data/keypoints_shards"
+	failed_path = "lsat/data/keypoints_failed.json"
+	labels_path = "lsat/data/labels.csv"
+	labels_with_signer_path = "lsat/data/labels_with_signer_data.csv"
+	os.makedirs(shards_path, exist_ok=True)
+
+	# clips of an interrupted run are recovered from the shards of its workers
+	merge_shards(shards_path, keypoints_path)
+
+	failed: dict[str, str] = {}
+	if os.path.exists(failed_path):
+		with open(failed_path) as failed_file:
+			failed = json.load(failed_file)
+	# only finished clips, other entries of older runs (manifests, unfinished cuts) are dropped from the failed ones too
+	failed = {clip: error for clip, error in failed.items() if is_clip(clip)}
+	clips = sorted(failed.keys()) if args.retry else sorted(filter(is_clip, os.listdir(input_path)))
 
 	# remove clips that have already been processed if keypoints file exists
 	if os.path.exists(keypoints_path):
 		with h5py.File(keypoints_path, 'r') as hdf5_file:
-			clips = [clip for clip in clips if clip not in list(hdf5_file.keys())]
+			processed = set(hdf5_file.keys())
+		clips = [clip for clip in clips if clip not in processed]
 
-	model = YOLO("yolov8n-pose.pt")
-
-	np.random.seed(0)
-	torch.manual_seed(0)
+	extract_clips(clips, failed, input_path, shards_path, keypoints_path, args.workers, not args.materialize, storage)
+	with open(failed_path, 'w') as failed_file:
+		json.dump(failed, failed_file, indent=1)
+	if len(failed) != 0:
+		print(f"{len(failed)} clips failed, stored in {failed_path}. Run with --retry to process them again")
 
-	for i_person, clip in list(enumerate(clips)):
-		print(f"Processing clip {i_person+1}/{len(clips)}: {clip}")
-		try:
-			video, _, frame_count = load_video(f"{input_path}/{clip}")
-			
-			print(f"Loaded {len(video)} frames")
-
-			# track people in video
-			print("Tracking people in video")
-			results = model.track(source=f"{input_path}/{clip}", persist=True, conf=0.75, verbose=False, stream=True)
-			
-			# get bounding box for each person
-			print("Getting bounding boxes for each person")
-			people_frame_level_boxes: list[NDArray[JOINTS_SIZE]] = []
-			last_boxes: list[NDArray[JOINTS_SIZE]] = []
-			for i_frame, frame in enumerate(results):
-				# boxes are in format x1, y1, x2, y2
-
-				people_frame_boxes = [np.array(box)[:4] for box in frame.boxes.data.tolist()]
-				# check if any value of the boxes is larger than 3000, if so print the box
-				if any([any([coord > 3000 for coord in box]) for box in people_frame_boxes]):
-					print(f"Box larger than 3000 in frame {i_frame+1} of clip {clip}")
-					print(people_frame_boxes)
-
-				# append box to boxes in the index where the last box shares the most area with the current box, if no box shares more than 50% of area, append to the end
-				for i_person, frame_box in enumerate(people_frame_boxes):
-					shared_areas = [get_shared_area(frame_box, last_person_box) for last_person_box in last_boxes]
-					if any(map(lambda x: x>.5, shared_areas)):
-						max_shared_area = max(shared_areas)
-						people_frame_level_boxes[shared_areas.index(max_shared_area)][i_frame] = people_frame_boxes[i_person]
-						last_boxes[shared_areas.index(max_shared_area)] = people_frame_boxes[i_person]
-					else:
-						new_box = np.empty((frame_count, 4), dtype=JOINTS_SIZE)
-						new_box.fill(np.nan)
-						people_frame_level_boxes.append(new_box)
-						people_frame_level_boxes[-1][i_frame] = people_frame_boxes[i_person]
-						last_boxes.append(people_frame_boxes[i_person])
-
-			# get clip wise bounding boxes for each person
-			clip_level_boxes: list[NDArray[JOINTS_SIZE]] = []
-			for i_person, person_box in enumerate(people_frame_level_boxes):
-				clip_level_boxes.append(np.stack([np.nanmin(person_box[:, 0]), np.nanmin(person_box[:, 1]), np.nanmax(person_box[:, 2]), np.nanmax(person_box[:, 3])]))
-			
-			# people_keypoints contains for each person, a matrix of frames x keypoints
-			people_keypoints: list[NDArray[JOINTS_SIZE]] = []
-			for i_person, person_box in enumerate(clip_level_boxes):
-				print(f"Processing signer {i_person+1}/{len(clip_level_boxes)}")
-				signer_video = np.empty((len(video), coord_to_pixel(person_box[3])-coord_to_pixel(person_box[1]), coord_to_pixel(person_box[2])-coord_to_pixel(person_box[0]), 3), dtype=np.uint8)
-				signer_video.fill(0)
-				for i_frame, (frame, roi) in enumerate(zip(video, people_frame_level_boxes[i_person])):
-					signer_video[i_frame] = crop_person(person_box, blackout_box(roi, frame))
-				signer_keypoints = run_holistic(signer_video, person_box)
-				people_keypoints.append(signer_keypoints)
-		
-			with h5py.File(keypoints_path, 'a') as hdf5_file:
-				clip_group = hdf5_file.create_group(clip)
-				for i_person, (person_keypoints, person_box) in enumerate(zip(people_keypoints, people_frame_level_boxes)):
-					signer_group = clip_group.create_group(f"signer_{i_person}")
-					signer_group.create_dataset('keypoints', data=person_keypoints)
-					signer_group.create_dataset('boxes', data=person_box)
-		
-		except Exception as e:
-			print(f"Failed to process clip {clip}: {e}")
+	if args.infer_signer:
+		print("Infering signers")
+		infer_signers(keypoints_path, pd.read_csv(labels_path), args.workers).to_csv(labels_with_signer_path, index=False)
 
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main()
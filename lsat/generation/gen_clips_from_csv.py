@@ -1,26 +1,108 @@
+import argparse
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Optional
+
 import pandas as pd
-import numpy as np
 from moviepy.video.io.VideoFileClip import VideoFileClip
 
 
+MAX_DELTA = .5
+
+def get_deltas(row: dict) -> tuple[float, float]:
+	'Returns the time added before and after the subtitle of the clip, at most MAX_DELTA'
+	prev_delta = row['prev_delta'] if (pd.notna(row['prev_delta']) and row['prev_delta'] <= MAX_DELTA) else MAX_DELTA
+	post_delta = row['post_delta'] if (pd.notna(row['post_delta']) and row['post_delta'] <= MAX_DELTA) else MAX_DELTA
+	return prev_delta, post_delta
+
+def cut_video(video_path: str, rows: list[dict], out_path: Path, tmp_path: Path, stream_copy: bool, manifest_path: Optional[Path] = None) -> list[tuple[str, Optional[str]]]:
+	'''Cuts the clips of the given rows from the video, opening it once. Returns the id of each clip and the error if it failed.
+	Clips are written to tmp_path and moved to out_path once complete, and then their id is appended to the manifest if given.
+	With stream_copy clips are not re-encoded, so they start at the keyframe before their start instead of the exact frame'''
+	results: list[tuple[str, Optional[str]]] = []
+	video_file = None
+	try:
+		if stream_copy:
+			from imageio_ffmpeg import get_ffmpeg_exe
+		else:
+			video_file = VideoFileClip(video_path)
+	except Exception as e:
+		# a missing or corrupt video fails all of its clips
+		return [(str(row['id']), f"{type(e).__name__}: {e}") for row in rows]
+	try:
+		for row in rows:
+			prev_delta, post_delta = get_deltas(row)
+			start = max(0, row['start'] - prev_delta)
+			end = row['end'] + post_delta
+			# clips are written to a temporary file, so an interrupted cut is never taken as done
+			tmp_clip_path = tmp_path / f"{row['id']}.mp4"
+			try:
+				if stream_copy:
+					subprocess.run([
+						get_ffmpeg_exe(), '-y', '-loglevel', 'error', '-ss', str(start), '-i', video_path, '-t', str(end - start),
+						'-an', '-c', 'copy', '-avoid_negative_ts', 'make_zero', str(tmp_clip_path)
+					], check=True, capture_output=True)
+				else:
+					video_file.subclip(start, end).write_videofile(str(tmp_clip_path), audio=False, codec="libx264", fps=video_file.fps, logger=None)
+				tmp_clip_path.replace(out_path / f"{row['id']}.mp4")
+				if manifest_path is not None:
+					# each clip is recorded as soon as it's cut, so an interrupted run resumes from the next one.
+					# Each line is written in a single append, so the ones of different processes do not interleave
+					with manifest_path.open('a') as manifest_file:
+						manifest_file.write(f"{row['id']}\n")
+				results.append((str(row['id']), None))
+			except Exception as e:
+				results.append((str(row['id']), f"{type(e).__name__}: {e}"))
+	finally:
+		if video_file is not None:
+			video_file.close()
+	return results
+
 def main():
+	parser = argparse.ArgumentParser(description='''Cuts the clips of labels.csv from the raw videos, processing videos in parallel.''')
+	parser.add_argument('--workers', '-w', help='amount of videos processed at the same time', type=int, default=os.cpu_count())
+	parser.add_argument('--stream-copy', '-s', help='copies the streams instead of re-encoding them, much faster but clips start at the previous keyframe', action='store_true')
+	args = parser.parse_args()
+
 	labels = pd.read_csv('lsat/data/labels.csv')
 	out_path = Path('lsat/data/cuts')
 	out_path.mkdir(exist_ok=True,parents=True)
+	# everything in cuts is taken as a clip by extract_keypoints, so the manifest and unfinished clips are kept out of it
+	tmp_path = Path('lsat/data/cuts_tmp')
+	tmp_path.mkdir(exist_ok=True)
+	manifest_path = Path('lsat/data/cuts_manifest.txt')
+	if (out_path / "manifest.txt").exists() and not manifest_path.exists():
+		(out_path / "manifest.txt").replace(manifest_path)
+
+	# clips are done if they are in the manifest and their file exists
+	done: set[str] = set()
+	if manifest_path.exists():
+		done = {clip for clip in manifest_path.read_text().split() if (out_path / f"{clip}.mp4").exists()}
+	pending = labels[~labels['id'].astype(str).isin(done)]
+	videos = list(pending.groupby(['playlist', 'video'], sort=False))
+	print(f"Cutting {len(pending)} clips ({len(done)} already done) from {len(videos)} videos")
 
-	video = labels.at[0, 'video']
-	video_file = VideoFileClip(f"lsat/data/raw/{labels.at[0, 'playlist']}/{video}.mp4")
-	for idx, row in labels.iterrows():
-		if video != row['video']:
-			video = row['video']
-			video_file = VideoFileClip(f"lsat/data/raw/{row['playlist']}/{video}.mp4")
-		print(f"Clip {idx}/{len(labels) - 1}")
-		if not (out_path / f"{idx}.mp4").exists():
-			prev_delta = row['prev_delta'] if (row['prev_delta'] != np.nan and row['prev_delta'] <= .5) else .5
-			post_delta = row['post_delta'] if (row['post_delta'] != np.nan and row['post_delta'] <= .5) else .5
-			newvid = video_file.subclip(row['start'] - prev_delta, row['end'] + post_delta)
-			newvid.write_videofile(str(out_path / f"{row['id']}.mp4"), audio=False, codec="libx264", fps=video_file.fps)
+	failed = 0
+	with ProcessPoolExecutor(args.workers) as executor:
+		futures = {
+			executor.submit(cut_video, f"lsat/data/raw/{playlist}/{video}.mp4", rows.to_dict('records'), out_path, tmp_path, args.stream_copy, manifest_path): rows['id']
+			for (playlist, video), rows in videos
+		}
+		for i_video, future in enumerate(as_completed(futures), 1):
+			try:
+				results = future.result()
+			except Exception as e:
+				# e.g. a worker killed, the clips of its video that were not cut yet are retried in the next run
+				results = [(str(clip), f"{type(e).__name__}: {e}") for clip in futures[future] if not (out_path / f"{clip}.mp4").exists()]
+			for clip, error in results:
+				if error is not None:
+					failed += 1
+					print(f"Failed to cut clip {clip}: {error}")
+			print(f"Video {i_video}/{len(videos)}")
+	if failed != 0:
+		print(f"{failed} clips failed, run again to retry them")
 
 if __name__ == "__main__":
     main()
@@ -1,4 +1,5 @@
 import os
+from typing import Iterator
 
 import cv2
 import numpy as np
@@ -16,6 +17,26 @@ def load_video(path: str) -> tuple[NDArray[np.uint8], int, int]:
 	cap.release()
 	return video, frame_rate, frame_count
 
+def get_video_info(path: str) -> tuple[int, int]:
+	'Returns frame rate and frame count of the video'
+	cap = cv2.VideoCapture(path)
+	frame_rate = int(cap.get(cv2.CAP_PROP_FPS))
+	frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+	cap.release()
+	return frame_rate, frame_count
+
+def iter_video(path: str) -> Iterator[NDArray[np.uint8]]:
+	'Yields the frames of the video one at a time'
+	cap = cv2.VideoCapture(path)
+	try:
+		while True:
+			read, frame = cap.read()
+			if not read:
+				return
+			yield frame
+	finally:
+		cap.release()
+
 def store_video(video: NDArray[np.uint8], frame_rate: int, name: str, dir: str = '.temp'):
 	if not os.path.exists(dir):
 		os.makedirs(dir)
@@ -1,57 +1,91 @@
-from math import sqrt
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
 
 import h5py
 import pandas as pd
 import numpy as np
 from numpy.typing import NDArray
 
-from hints.Box import Box, format_box
+from lsat.helpers.keypoints_h5 import read_signer_keypoints
 
 
-def relative_pos(box: Box, x: float, y: float) -> tuple[float, float]:
-    'Returns relative position of a keypoint respect to a point'
-    center_x = (box['x1'] + box['x2'])/2
-    center_y = (box['y1'] + box['y2'])/2
-    return (center_x - x, center_y - y)
-
-KEYPOINTS_PATH = "../data/keypoints.h5"
 KEYPOINTS_SIZE = np.float16
 STEP = 5
+# only body and hands keypoints are considered to measure movement
+MOVEMENT_KEYPOINTS = np.r_[0:33, 33+468:33+468+21+21]
+
+def get_movement(keypoints: NDArray[KEYPOINTS_SIZE], boxes: NDArray[KEYPOINTS_SIZE], step: int = STEP) -> float:
+	'''Returns the movement of a person: the distance between the position of its body and hands keypoints (relative to the center of its box) in frames step apart, averaged by the amount of steps in the clip.
+	keypoints are the (T, len(MOVEMENT_KEYPOINTS), 2) x and y of the body and hands keypoints and boxes (T, 4)'''
+	if len(keypoints) == 0:
+		return 0.
+	keypoints = keypoints.astype(np.float64)
+	boxes = np.round(boxes.astype(np.float64), 2)
+	frames = np.arange(0, min(len(keypoints), len(boxes)) - step, step)
+	centers = (boxes[:, :2] + boxes[:, 2:4]) / 2
+	# position of the keypoints relative to the center of the box, for each frame and the one step frames after it
+	relative = centers[frames, None, :] - keypoints[frames]
+	relative_next = centers[frames + step, None, :] - keypoints[frames + step]
+	movement = np.nansum(np.sqrt(((relative - relative_next)**2).sum(axis=-1)))
+	return float(movement / (len(keypoints) / step))
+
+def infer_clip_signer(clip_group: h5py.Group, step: int = STEP) -> dict:
+	'Returns the amount of people in the clip, the one infered to be the signer (the one that moves the most), the confidence of the inference and the movement of each person'
+	signers = list(clip_group.keys())
+	if len(signers) == 1:
+		return {'signers_amount': 1, 'infered_signer': signers[0], 'infered_signer_confidence': 1., 'movement_per_signer': "[]"}
+	if len(signers) == 0:
+		return {'signers_amount': 0, 'infered_signer': '', 'infered_signer_confidence': 0., 'movement_per_signer': "[]"}
+	movement_per_signer = np.array([get_movement(read_signer_keypoints(clip_group[signer], MOVEMENT_KEYPOINTS, ('x', 'y')), clip_group[signer]['boxes'][:], step) for signer in signers])
+	return {
+		'signers_amount': len(signers),
+		'infered_signer': signers[int(movement_per_signer.argmax())],
+		'infered_signer_confidence': float(movement_per_signer.max() / movement_per_signer.sum()) if movement_per_signer.sum() != 0 else 0.,
+		'movement_per_signer': str(movement_per_signer.tolist())
+	}
+
+# keypoints file opened once by each worker process
+worker: dict = {}
+
+def init_worker(keypoints_path: str):
+	worker['file'] = h5py.File(keypoints_path, 'r')
+
+def infer_clips_signers(clips: list[str]) -> list[dict]:
+	'Infers the signer of each clip in the keypoints file of the worker, skipping clips without keypoints'
+	hdf5_file: h5py.File = worker['file']
+	rows = []
+	for clip in clips:
+		key = clip if clip in hdf5_file else f"{clip}.mp4"
+		if key in hdf5_file:
+			rows.append({'id': clip, **infer_clip_signer(hdf5_file[key])})
+	return rows
+
+def infer_signers(keypoints_path: str, labels: pd.DataFrame, workers: Optional[int] = None, chunk_size: int = 64) -> pd.DataFrame:
+	'Returns labels with the columns signers_amount, infered_signer, infered_signer_confidence and movement_per_signer, computed in parallel from the keypoints file'
+	clips = labels['id'].astype(str).tolist()
+	chunks = [clips[i:i+chunk_size] for i in range(0, len(clips), chunk_size)]
+	rows: list[dict] = []
+	with ProcessPoolExecutor(workers or os.cpu_count(), initializer=init_worker, initargs=(keypoints_path,)) as executor:
+		for i_chunk, chunk_rows in enumerate(executor.map(infer_clips_signers, chunks), 1):
+			rows += chunk_rows
+			print(f"{min(i_chunk*chunk_size, len(clips))}/{len(clips)} clips")
+	signers = pd.DataFrame(rows, columns=['id', 'signers_amount', 'infered_signer', 'infered_signer_confidence', 'movement_per_signer'])
+	labels = labels.drop(columns=signers.columns[1:], errors='ignore')
+	labels = labels.assign(id=labels['id'].astype(str)).merge(signers, on='id', how='left')
+	return labels.fillna({'signers_amount': 0, 'infered_signer': '', 'infered_signer_confidence': .0, 'movement_per_signer': "[]"}).astype({'signers_amount': int})
+
+def main():
+	parser = argparse.ArgumentParser(description='''Infers the signer of each clip as the person that moves the most.''')
+	parser.add_argument('--keypoints', '-k', help='keypoints file', default="lsat/data/keypoints.h5")
+	parser.add_argument('--labels', '-l', help='labels file', default="lsat/data/labels.csv")
+	parser.add_argument('--output', '-o', help='labels file with signer data', default="lsat/data/labels_with_signer_data.csv")
+	parser.add_argument('--workers', '-w', help='amount of worker processes', type=int, default=None)
+	args = parser.parse_args()
+
+	infer_signers(args.keypoints, pd.read_csv(args.labels), args.workers).to_csv(args.output, index=False)
+
 
-labels = pd.read_csv("../data/labels.csv")
-# create empty columns signers_amount, infered_signer and infered_signer_confidence
-labels['signers_amount'] = 0
-labels['infered_signer'] = ''
-labels['infered_signer_confidence'] = .0
-labels['movement_per_signer'] = "[]"
-
-with h5py.File(KEYPOINTS_PATH, 'r') as hdf5_file:
-	for i, clip in enumerate(labels['id']):
-		print(f"{i+1}/{len(labels)}: {clip}")
-		clip = f"{clip}.mp4"
-		if len(hdf5_file[clip]) == 1:
-			labels.loc[labels['id'] == clip, 'signers_amount'] = 1
-			labels.loc[labels['id'] == clip, 'infered_signer'] = 0
-			labels.loc[labels['id'] == clip, 'infered_signer_confidence'] = 1
-		else:
-			movement_per_signer = {}
-			for signer in hdf5_file[clip]:
-				keypoints: NDArray[KEYPOINTS_SIZE] = hdf5_file[clip][signer]['keypoints'][:]
-				boxes: NDArray[KEYPOINTS_SIZE] = hdf5_file[clip][signer]['boxes'][:]
-				movement = 0
-				for i_frame in range(0, len(keypoints), STEP):
-					if i_frame + STEP < len(keypoints) and i_frame + STEP < len(boxes):
-						# only consider body and hands keypoints
-						for i_keypoint in list(range(0, 33)) + list(range(33+468, int(len(keypoints[i_frame])/4))):
-							rel_x1, rel_y1 = relative_pos(format_box(boxes[i_frame]), keypoints[i_frame][i_keypoint], keypoints[i_frame][i_keypoint+1])
-							rel_x2, rel_y2 = relative_pos(format_box(boxes[i_frame+STEP]), keypoints[i_frame+STEP][i_keypoint], keypoints[i_frame+STEP][i_keypoint+1])
-							if not np.isnan(rel_x1) and not np.isnan(rel_x2) and not np.isnan(rel_y1) and not np.isnan(rel_y2):
-								movement += sqrt((rel_x1 - rel_x2)**2 + (rel_y1 - rel_y2)**2)
-				movement_per_signer[signer] = (movement / ((len(keypoints)) / STEP))
-			clip = clip[:-4]
-			if len(movement_per_signer) != 0:
-				labels.loc[labels['id'] == clip, 'signers_amount'] = len(movement_per_signer)
-				labels.loc[labels['id'] == clip, 'infered_signer'] = list(movement_per_signer.items())[list(movement_per_signer.values()).index(max(movement_per_signer.values()))][0]
-				labels.loc[labels['id'] == clip, 'infered_signer_confidence'] = (max(movement_per_signer.values()) / sum(movement_per_signer.values())) if sum(movement_per_signer.values()) != 0 else 0
-				labels.loc[labels['id'] == clip, 'movement_per_signer'] = str(list(movement_per_signer.values()))
-	labels.to_csv("../data/labels_with_signer_data.csv", index=False)
\ No newline at end of file
+if __name__ == "__main__":
+	main()
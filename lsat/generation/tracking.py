@@ -0,0 +1,51 @@
+import numpy as np
+from numpy.typing import NDArray
+
+
+# minimum share of the area of a box that has to overlap with the last box of a person to be considered the same person
+MIN_SHARED_AREA = .5
+
+def get_shared_areas(boxes: NDArray, other_boxes: NDArray) -> NDArray[np.float64]:
+	'Returns a matrix with the area of each of the N boxes shared with each of the M other boxes, in a range from 0 to 1 respect to the area of the first ones'
+	boxes = boxes.astype(np.float64)[:, None, :]
+	other_boxes = other_boxes.astype(np.float64)[None, :, :]
+	width = np.clip(np.minimum(boxes[..., 2], other_boxes[..., 2]) - np.maximum(boxes[..., 0], other_boxes[..., 0]), 0, None)
+	height = np.clip(np.minimum(boxes[..., 3], other_boxes[..., 3]) - np.maximum(boxes[..., 1], other_boxes[..., 1]), 0, None)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return (width * height) / ((boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1]))
+
+
+class BoxTracker:
+	'''Assigns the boxes detected in each frame to people, matching each box with the person whose last box shares the most area with it (if it's more than MIN_SHARED_AREA).
+	Boxes of each person are stored in a preallocated (people, frames, 4) array, nan where the person was not detected'''
+
+	def __init__(self, frame_count: int, dtype: type = np.float16, capacity: int = 4) -> None:
+		self.frame_count = frame_count
+		self.amount = 0
+		self.boxes = np.full((capacity, frame_count, 4), np.nan, dtype=dtype)
+		self.last_boxes = np.empty((capacity, 4), dtype=np.float64)
+
+	def _add_person(self) -> int:
+		if self.amount == len(self.boxes):
+			self.boxes = np.concatenate([self.boxes, np.full_like(self.boxes, np.nan)])
+			self.last_boxes = np.concatenate([self.last_boxes, np.empty_like(self.last_boxes)])
+		self.amount += 1
+		return self.amount - 1
+
+	def update(self, i_frame: int, frame_boxes: NDArray) -> None:
+		'Assigns the (N, 4) boxes (x1, y1, x2, y2) detected in the frame, in order'
+		shared_areas = get_shared_areas(frame_boxes, self.last_boxes[:self.amount])
+		for i_box, box in enumerate(frame_boxes):
+			if shared_areas.shape[1] != 0 and np.nanmax(shared_areas[i_box], initial=-np.inf) > MIN_SHARED_AREA:
+				i_person = int(np.nanargmax(shared_areas[i_box]))
+			else:
+				i_person = self._add_person()
+				shared_areas = np.concatenate([shared_areas, np.empty((len(frame_boxes), 1))], axis=1)
+			self.boxes[i_person, i_frame] = box
+			self.last_boxes[i_person] = box
+			# the remaining boxes of the frame are compared against the updated last box
+			shared_areas[i_box+1:, i_person] = get_shared_areas(frame_boxes[i_box+1:], box[None])[:, 0]
+
+	def get_boxes(self) -> list[NDArray]:
+		'Returns the (frames, 4) boxes of each person'
+		return list(self.boxes[:self.amount])
@@ -0,0 +1,20 @@
+import sys
+
+
+class ProgressBar:
+    '''Prints the progress of a download, to be used as its reporthook (same signature as the one of urlretrieve)'''
+
+    def __init__(self, width: int = 40) -> None:
+        self.width = width
+
+    def __call__(self, blocks: int, block_size: int, total_size: int) -> None:
+        downloaded = blocks * block_size
+        if total_size > 0:
+            downloaded = min(downloaded, total_size)
+            done = self.width * downloaded // total_size
+            sys.stdout.write(f"\r[{'#' * done}{'.' * (self.width - done)}] {downloaded / 2**20:.1f}/{total_size / 2**20:.1f} MiB")
+            if downloaded == total_size:
+                sys.stdout.write("\n")
+        else:
+            sys.stdout.write(f"\r{downloaded / 2**20:.1f} MiB")
+        sys.stdout.flush()
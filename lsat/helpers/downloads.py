@@ -0,0 +1,150 @@
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from hashlib import sha256 as new_sha256
+from http.client import HTTPException
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Union
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from lsat.typing import DownloadData
+
+
+CHUNK_SIZE = 1024**2
+# statuses of failed requests that are worth retrying, other client errors are final
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+# reporthook of urlretrieve: amount of blocks transferred, size of each block and total size (-1 if unknown)
+ReportHook = Callable[[int, int, int], object]
+
+class DownloadError(Exception):
+    '''Raised when a file could not be downloaded, or did not match its size or checksum, after every retry'''
+
+def get_sha256(path: Path, chunk_size: int = CHUNK_SIZE) -> str:
+    '''Returns the sha256 hex digest of the file'''
+    digest = new_sha256()
+    with path.open('rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _is_complete(path: Path, size: Optional[int], sha256: Optional[str]) -> bool:
+    if not path.exists() or (size is not None and path.stat().st_size != size):
+        return False
+    return sha256 is None or get_sha256(path) == sha256
+
+def _download_part(url: str, part: Path, size: Optional[int], timeout: float, chunk_size: int, reporthook: Optional[ReportHook]) -> None:
+    '''Appends to part the bytes of url after the ones it already has, with a range request. It's restarted if the server ignores the range'''
+    offset = part.stat().st_size if part.exists() else 0
+    if size is not None and offset > size:
+        part.unlink()
+        offset = 0
+    if size is not None and offset == size:
+        return
+    try:
+        response = urlopen(Request(url, headers={'Range': f"bytes={offset}-"} if offset else {}), timeout=timeout)
+    except HTTPError as e:
+        # range not satisfiable, the part already has every byte
+        if e.code == 416 and offset:
+            return
+        raise
+    with response:
+        if offset and response.status != 206:
+            offset = 0
+        length = response.headers.get('Content-Length')
+        total = offset + int(length) if length is not None else size
+        blocks = offset // chunk_size
+        with part.open('ab' if offset else 'wb') as part_file:
+            while chunk := response.read(chunk_size):
+                part_file.write(chunk)
+                blocks += 1
+                if reporthook is not None:
+                    reporthook(blocks, chunk_size, total if total is not None else -1)
+    if total is not None and part.stat().st_size < total:
+        raise DownloadError(f"connection closed after {part.stat().st_size} of {total} bytes")
+
+def download_file(
+        url: str,
+        path: Union[str, Path],
+        size: Optional[int] = None,
+        sha256: Optional[str] = None,
+        retries: int = 5,
+        backoff: float = 1.,
+        timeout: float = 60.,
+        chunk_size: int = CHUNK_SIZE,
+        reporthook: Optional[ReportHook] = None
+    ) -> Path:
+    '''Downloads url to path, unless path already exists with the given size and checksum. Data is written to path.part, which later attempts (or calls) resume
+    with range requests, and moved to path once it's complete and verified. Connection errors, server errors and mismatches are retried up to retries times,
+    waiting backoff * 2**attempt seconds (with jitter) before each one. reporthook is called as the one of urlretrieve'''
+    path = Path(path)
+    if _is_complete(path, size, sha256):
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    part = path.with_name(path.name + ".part")
+    for attempt in range(retries + 1):
+        try:
+            _download_part(url, part, size, timeout, chunk_size, reporthook)
+            if size is not None and part.stat().st_size != size:
+                raise DownloadError(f"got {part.stat().st_size} bytes instead of {size}")
+            if sha256 is not None and get_sha256(part) != sha256:
+                # corrupted data can not be resumed
+                part.unlink()
+                raise DownloadError("checksum mismatch")
+            part.replace(path)
+            return path
+        except HTTPError as e:
+            if e.code not in RETRY_STATUSES or attempt == retries:
+                raise DownloadError(f"{url}: HTTP {e.code} {e.reason}") from e
+        except (DownloadError, HTTPException, OSError) as e:
+            if attempt == retries:
+                raise DownloadError(f"{url}: {e}") from e
+        time.sleep(backoff * 2**attempt * random.uniform(.5, 1))
+    raise DownloadError(url)
+
+def download_all(
+        entries: Iterable[DownloadData],
+        root: Path,
+        workers: int = 4,
+        base_url: Optional[str] = None,
+        on_done: Optional[Callable[[DownloadData, Optional[DownloadError]], object]] = None,
+        **kwargs
+    ) -> dict[str, DownloadError]:
+    '''Downloads the files of a manifest into root, workers at a time (see download_file for kwargs). If base_url is given files are downloaded from
+    base_url/path instead of their url, as from a mirror. on_done is called with each entry as it finishes. Returns the error of each path that failed'''
+    errors: dict[str, DownloadError] = {}
+    with ThreadPoolExecutor(workers) as executor:
+        futures = {
+            executor.submit(download_file, entry['url'] if base_url is None else f"{base_url.rstrip('/')}/{entry['path']}",
+                root / entry['path'], entry.get('size'), entry.get('sha256'), **kwargs): entry
+            for entry in entries
+        }
+        for future in as_completed(futures):
+            entry = futures[future]
+            error = future.exception()
+            if error is not None and not isinstance(error, DownloadError):
+                raise error
+            if error is not None:
+                errors[entry['path']] = error
+            if on_done is not None:
+                on_done(entry, error)
+    return errors
+
+def get_download_data(root: Path, path: Path, url: str) -> DownloadData:
+    '''Returns the manifest entry of a downloaded file'''
+    return {'path': path.relative_to(root).as_posix(), 'url': url, 'size': path.stat().st_size, 'sha256': get_sha256(path)}
+
+def load_manifest(path: Path) -> list[DownloadData]:
+    '''Loads the manifest stored in path, empty if it does not exist'''
+    if not path.exists():
+        return []
+    with path.open() as manifest_file:
+        return json.load(manifest_file)
+
+def store_manifest(path: Path, entries: Iterable[DownloadData]) -> None:
+    '''Stores the manifest in path, entries sorted by path'''
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open('w') as manifest_file:
+        json.dump(sorted(entries, key=lambda entry: entry['path']), manifest_file, indent=1, ensure_ascii=False)
+    tmp_path.replace(path)
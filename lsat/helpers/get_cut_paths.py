@@ -0,0 +1,10 @@
+from pathlib import Path
+
+
+def get_cut_paths(data_path: Path) -> dict[str, Path]:
+    '''Given the data file of a cut (clip.json), returns the paths of its data, video (clip.mp4) and signer (clip_signer.json) files'''
+    return {
+        'data': data_path,
+        'mp4': data_path.with_suffix('.mp4'),
+        'signer': data_path.with_name(f"{data_path.stem}_signer.json")
+    }
@@ -0,0 +1,6 @@
+from pathlib import Path
+
+
+def get_sample_key(root: Path, sample: Path) -> str:
+    '''Returns the key of a sample: its path relative to the root of the database, without extension'''
+    return sample.resolve().relative_to(root.resolve()).with_suffix('').as_posix()
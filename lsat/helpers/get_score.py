@@ -0,0 +1,9 @@
+def get_score(scores: list[float]) -> float:
+    '''Returns how much the highest score (the infered signer) stands out from the second highest one, between 0 and 1.
+    A single person is the signer with full confidence, and there is no confidence without people'''
+    if len(scores) == 0:
+        return 0.
+    if len(scores) == 1:
+        return 1.
+    first, second = sorted(scores, reverse=True)[:2]
+    return (first - second) / first if first > 0 else 0.
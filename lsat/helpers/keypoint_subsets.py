@@ -0,0 +1,50 @@
+from typing import Iterable, Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+
+# keypoints of a frame in keypoints.h5 (pose, face, right hand and left hand of MediaPipe Holistic), each one with the channels x, y, z and visibility
+KEYPOINTS_AMOUNT = 33+468+21+21
+CHANNELS = ('x', 'y', 'z', 'visibility')
+# index of the first keypoint, amount of keypoints and channels of each part, the rest are always empty (pose has no z, face and hands no visibility)
+KEYPOINT_PARTS: dict[str, tuple[int, int, tuple[str, ...]]] = {
+    'pose': (0, 33, ('x', 'y', 'visibility')),
+    'face': (33, 468, ('x', 'y', 'z')),
+    'right_hand': (501, 21, ('x', 'y', 'z')),
+    'left_hand': (522, 21, ('x', 'y', 'z'))
+}
+# face keypoints of the contours of MediaPipe face mesh (FACEMESH_CONTOURS: lips, eyes, eyebrows and face oval), relative to the first face keypoint
+FACE_CONTOUR = np.array([
+    0, 7, 10, 13, 14, 17, 21, 33, 37, 39, 40, 46, 52, 53, 54, 55, 58, 61, 63, 65, 66, 67, 70, 78, 80, 81, 82, 84, 87, 88, 91, 93,
+    95, 103, 105, 107, 109, 127, 132, 133, 136, 144, 145, 146, 148, 149, 150, 152, 153, 154, 155, 157, 158, 159, 160, 161, 162, 163, 172, 173, 176, 178,
+    181, 185, 191, 234, 246, 249, 251, 263, 267, 269, 270, 276, 282, 283, 284, 285, 288, 291, 293, 295, 296, 297, 300, 308, 310, 311, 312, 314, 317, 318,
+    321, 323, 324, 332, 334, 336, 338, 356, 361, 362, 365, 373, 374, 375, 377, 378, 379, 380, 381, 382, 384, 385, 386, 387, 388, 389, 390, 397, 398, 400,
+    402, 405, 409, 415, 454, 466
+])
+# keypoints of each named subset, as the keypoints of each part it uses (None for all of them)
+KEYPOINT_SUBSETS: dict[str, dict[str, Optional[NDArray]]] = {
+    'pose': {'pose': None},
+    'hands': {'right_hand': None, 'left_hand': None},
+    'right_hand': {'right_hand': None},
+    'left_hand': {'left_hand': None},
+    'face': {'face': None},
+    'face_contour': {'face': FACE_CONTOUR}
+}
+ALL_SUBSETS = ('pose', 'face', 'hands')
+
+def get_subset_parts(subsets: Iterable[str]) -> dict[str, NDArray]:
+    '''Returns the keypoints of each part (relative to its first one) used by the union of the subsets, parts in the order of keypoints.h5'''
+    parts: dict[str, Optional[NDArray]] = {}
+    for subset in subsets:
+        if subset not in KEYPOINT_SUBSETS:
+            raise ValueError(f"Unknown keypoint subset {subset}, available: {', '.join(KEYPOINT_SUBSETS)}")
+        for part, keypoints in KEYPOINT_SUBSETS[subset].items():
+            all_keypoints = np.arange(KEYPOINT_PARTS[part][1])
+            parts[part] = np.union1d(parts.get(part, np.empty(0, dtype=int)), all_keypoints if keypoints is None else keypoints)
+    return {part: parts[part].astype(int) for part in KEYPOINT_PARTS if part in parts}
+
+def get_subset_indices(subsets: Iterable[str]) -> NDArray:
+    '''Returns the sorted indices of the keypoints of the union of the subsets in the 543 keypoints of a frame'''
+    parts = get_subset_parts(subsets)
+    return np.concatenate([KEYPOINT_PARTS[part][0] + keypoints for part, keypoints in parts.items()]) if parts else np.empty(0, dtype=int)
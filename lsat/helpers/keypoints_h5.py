@@ -0,0 +1,105 @@
+from typing import Iterable, Optional, Sequence, TYPE_CHECKING
+
+import numpy as np
+from numpy.typing import NDArray
+
+from lsat.helpers.keypoint_subsets import KEYPOINTS_AMOUNT, CHANNELS, KEYPOINT_PARTS, ALL_SUBSETS, get_subset_parts
+
+if TYPE_CHECKING:
+    import h5py
+
+
+# frames of each chunk, clips are read whole so most of them fit in one chunk
+CHUNK_FRAMES = 1024
+# value of missing keypoints in quantized datasets
+QUANTIZED_NAN = np.iinfo(np.int16).min
+
+def read_dataset(dataset: 'h5py.Dataset', dtype: type) -> NDArray:
+    '''Reads a whole dataset into a new array of the given dtype, one chunk at a time if it's chunked'''
+    out = np.empty(dataset.shape, dtype=dtype)
+    if out.size == 0:
+        return out
+    if dataset.chunks is None:
+        dataset.read_direct(out)
+    else:
+        for chunk in dataset.iter_chunks():
+            dataset.read_direct(out, chunk, chunk)
+    return out
+
+def quantize_keypoints(keypoints: NDArray) -> tuple[NDArray[np.int16], NDArray[np.float32]]:
+    '''Returns the (..., C) keypoints as int16 fixed point values and the scale of each channel, chosen so the largest absolute value of the clip uses the whole range.
+    Missing values are stored as QUANTIZED_NAN'''
+    keypoints = keypoints.astype(np.float32)
+    # fmax ignores nan, channels without values get a max of 0
+    max_abs = np.fmax.reduce(np.abs(keypoints.reshape(-1, keypoints.shape[-1])), axis=0, initial=0)
+    scale = np.where(max_abs > 0, max_abs / np.iinfo(np.int16).max, 1).astype(np.float32)
+    quantized = np.where(np.isnan(keypoints), QUANTIZED_NAN, np.round(np.nan_to_num(keypoints) / scale))
+    return quantized.astype(np.int16), scale
+
+def dequantize_keypoints(quantized: NDArray[np.int16], scale: NDArray[np.float32], dtype: type = np.float32) -> NDArray:
+    '''Inverse of quantize_keypoints, missing values are nan'''
+    keypoints = quantized.astype(dtype) * scale.astype(dtype)
+    keypoints[quantized == QUANTIZED_NAN] = np.nan
+    return keypoints
+
+def write_signer_keypoints(
+        signer_group: 'h5py.Group',
+        keypoints: NDArray,
+        subsets: Iterable[str] = ALL_SUBSETS,
+        quantize: bool = False,
+        compression: Optional[str] = "gzip"
+    ) -> None:
+    '''Writes the (T, 543*4) or (T, 543, 4) keypoints of a signer in the compact layout: a dataset for each part in the group parts, with only the keypoints of the
+    subsets and the channels the part has. Each dataset is (T, K, C), chunked by clip and compressed, and has the attributes indices (of its keypoints in the 543 of a frame)
+    and channels. If quantize values are stored as int16 with a scale per channel in the attribute scale'''
+    keypoints = keypoints.reshape(len(keypoints), KEYPOINTS_AMOUNT, len(CHANNELS))
+    parts_group = signer_group.create_group('parts')
+    for part, part_keypoints in get_subset_parts(subsets).items():
+        start, _, channels = KEYPOINT_PARTS[part]
+        indices = start + part_keypoints
+        data = keypoints[:, indices][:, :, [CHANNELS.index(channel) for channel in channels]]
+        scale = None
+        if quantize:
+            data, scale = quantize_keypoints(data)
+        # a signer without frames can not be chunked, as chunks can not be larger than the data
+        chunked = len(data) != 0
+        dataset = parts_group.create_dataset(part, data=data,
+            chunks=(min(len(data), CHUNK_FRAMES), *data.shape[1:]) if chunked else None,
+            compression=compression if chunked else None, shuffle=chunked and compression is not None)
+        dataset.attrs['indices'] = indices.astype(np.int16)
+        dataset.attrs['channels'] = ",".join(channels)
+        if scale is not None:
+            dataset.attrs['scale'] = scale
+
+def read_signer_keypoints(
+        signer_group: 'h5py.Group',
+        indices: Optional[NDArray] = None,
+        channels: Sequence[str] = CHANNELS,
+        dtype: type = np.float32
+    ) -> NDArray:
+    '''Returns the (T, K, C) keypoints of a signer stored in either layout (a (T, 543*4) keypoints dataset or the compact one), for the given indices of the 543 keypoints
+    of a frame (all of them by default) and channels. Keypoints or channels that are not stored are nan. Only the parts that contain requested keypoints are read'''
+    indices = np.arange(KEYPOINTS_AMOUNT) if indices is None else np.asarray(indices)
+    channels_index = [CHANNELS.index(channel) for channel in channels]
+    if 'keypoints' in signer_group:
+        keypoints = read_dataset(signer_group['keypoints'], dtype)
+        return keypoints.reshape(len(keypoints), KEYPOINTS_AMOUNT, len(CHANNELS))[:, indices][:, :, channels_index]
+    frames = signer_group['boxes'].shape[0]
+    out = np.full((frames, len(indices), len(channels)), np.nan, dtype=dtype)
+    # position of each of the 543 keypoints in the output, -1 if it's not requested
+    position = np.full(KEYPOINTS_AMOUNT, -1)
+    position[indices] = np.arange(len(indices))
+    for dataset in signer_group['parts'].values():
+        part_indices = np.asarray(dataset.attrs['indices'], dtype=int)
+        part_channels = str(dataset.attrs['channels']).split(",")
+        requested = position[part_indices] >= 0
+        out_channels = [i for i, channel in enumerate(channels) if channel in part_channels]
+        if not requested.any() or len(out_channels) == 0:
+            continue
+        if 'scale' in dataset.attrs:
+            data = dequantize_keypoints(read_dataset(dataset, np.int16), np.asarray(dataset.attrs['scale']), dtype)
+        else:
+            data = read_dataset(dataset, dtype)
+        stored_channels = [part_channels.index(channels[i]) for i in out_channels]
+        out[:, position[part_indices[requested]][:, None], np.array(out_channels)[None, :]] = data[:, requested][:, :, stored_channels]
+    return out
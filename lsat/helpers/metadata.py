@@ -0,0 +1,146 @@
+import os
+import json
+from hashlib import sha1
+from pathlib import Path
+from stat import S_ISDIR
+from time import time_ns
+from typing import Iterable, Optional
+
+import pandas as pd
+
+from lsat.typing import CutSignerData
+from lsat.helpers.get_cut_paths import get_cut_paths
+from lsat.helpers.get_sample_key import get_sample_key
+from lsat.helpers.get_score import get_score
+
+
+# stored with the key of the index, indexes of other versions are rebuilt
+METADATA_VERSION = 2
+METADATA_COLUMNS = ['label', 'start', 'end', 'duration', 'video', 'playlist', 'signer', 'signers_amount', 'confidence', 'roi_x1', 'roi_y1', 'roi_width', 'roi_height']
+# files modified less than this (in nanoseconds) before the tree is listed may be modified again without changing their modification time
+RECENT_NS = 2 * 10**9
+
+def read_signer_header(signer_path: Path) -> dict:
+    '''Reads the scores and roi of a signer file without reading nor parsing its keypoints, which are stored after them'''
+    text = ""
+    with signer_path.open() as signer_file:
+        while '"keypoints"' not in text:
+            chunk = signer_file.read(4096)
+            if chunk == "":
+                return json.loads(text)
+            text += chunk
+    return json.loads(text[:text.index('"keypoints"')].rstrip().rstrip(',') + '}')
+
+def get_confidence(scores: list[float]) -> float:
+    '''Returns the confidence on the infered signer given the scores of each person in the clip, 0 if there are no people'''
+    return get_score(scores) if len(scores) != 0 else 0.
+
+def _get_stat_value(path: str) -> Optional[str]:
+    '''Returns the modification time of a directory, or the size and modification time of a file, None if it does not exist'''
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return str(stat.st_mtime_ns) if S_ISDIR(stat.st_mode) else f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def get_tree_state(root: Path, suffixes: Optional[tuple[str, ...]] = None) -> dict[str, str]:
+    '''Returns the modification time of every directory under root, and the size and modification time of every file ending with one of the suffixes if given,
+    by path relative to root. Only the directories are listed, files are stated only if suffixes are given'''
+    state = {}
+    directories = [str(root)]
+    while directories:
+        directory = directories.pop()
+        state[os.path.relpath(directory, root)] = str(os.stat(directory).st_mtime_ns)
+        with os.scandir(directory) as scan:
+            for entry in scan:
+                if entry.is_dir():
+                    directories.append(entry.path)
+                elif suffixes is not None and entry.name.endswith(suffixes):
+                    stat = entry.stat()
+                    state[os.path.relpath(entry.path, root)] = f"{stat.st_size}:{stat.st_mtime_ns}"
+    return state
+
+def get_tree_key(root: Path, state_path: Path, suffixes: Optional[tuple[str, ...]] = None) -> str:
+    '''Returns a key that changes if a file under root is added, removed or renamed, which changes the modification time of its directory.
+    Files modified in place only change it if they end with one of the suffixes, which makes every one of them be stated.
+    The state of the tree is kept in state_path, so if nothing changed only the directories (and files) in it are stated, without listing them'''
+    if state_path.exists():
+        stored = json.loads(state_path.read_text())
+        if stored['suffixes'] == (list(suffixes) if suffixes is not None else None) and all(
+                _get_stat_value(os.path.join(root, path)) == value for path, value in stored['state'].items()):
+            return stored['key']
+    start = time_ns()
+    state = get_tree_state(root, suffixes)
+    key = sha1(json.dumps(state, sort_keys=True).encode()).hexdigest()
+    # a change in the same tick as a recent modification would keep its modification time, so the tree is listed again until it's older
+    if any(int(value.split(':')[-1]) > start - RECENT_NS for value in state.values()):
+        return key
+    tmp_path = state_path.with_name(state_path.name + ".tmp")
+    tmp_path.write_text(json.dumps({'suffixes': list(suffixes) if suffixes is not None else None, 'key': key, 'state': state}))
+    tmp_path.replace(state_path)
+    return key
+
+def build_metadata_index(root: Path, samples: Iterable[Path]) -> pd.DataFrame:
+    '''Builds a table indexed by sample key with the metadata of each sample, read from its data and signer files.
+    Signer data is taken from the data file if it contains it, as in the visualization version of the database.
+    The signer column identifies who signs the clip if the data file has it, and missing otherwise'''
+    rows = []
+    for sample in samples:
+        with sample.open() as data_file:
+            data: CutSignerData = json.load(data_file)
+        signer_path = get_cut_paths(sample)['signer']
+        signer = read_signer_header(signer_path) if signer_path.exists() else data
+        scores = list(map(float, signer.get('scores', [])))
+        roi = signer.get('roi', {})
+        rows.append({
+            'key': get_sample_key(root, sample),
+            'label': data['label'],
+            'start': data['start'],
+            'end': data['end'],
+            'duration': data['end'] - data['start'],
+            'video': data['video'],
+            'playlist': data.get('playlist', ''),
+            # identity of the signer, only known if the data file has it
+            'signer': data.get('signer'),
+            'signers_amount': len(scores),
+            'confidence': get_confidence(scores),
+            'roi_x1': roi.get('x1'),
+            'roi_y1': roi.get('y1'),
+            'roi_width': roi.get('width'),
+            'roi_height': roi.get('height')
+        })
+    return pd.DataFrame(rows, columns=['key'] + METADATA_COLUMNS).set_index('key')
+
+def load_metadata_index(root: Path, path: Path, key: str, samples: Optional[Iterable[Path]] = None) -> pd.DataFrame:
+    '''Loads the metadata index stored in path, building it from the samples (every clip in root by default) if it does not exist
+    or was built from files with another key (see get_tree_key)'''
+    key_path = path.with_name(path.name + ".key")
+    key = f"{METADATA_VERSION}:{key}"
+    if not path.exists() or not key_path.exists() or key_path.read_text() != key or list(pd.read_parquet(path).columns) != METADATA_COLUMNS:
+        print("Building metadata index")
+        if samples is None:
+            samples = map(lambda p: Path(str(p.resolve())[:-3] + "json"), root.glob('**/*.mp4'))
+        tmp_path = path.with_name(path.name + ".tmp")
+        build_metadata_index(root, samples).to_parquet(tmp_path)
+        tmp_path.replace(path)
+        key_path.write_text(key)
+    return pd.read_parquet(path)
+
+def filter_metadata(
+        metadata: pd.DataFrame,
+        min_confidence: Optional[float] = None,
+        max_duration: Optional[float] = None,
+        playlists: Optional[Iterable[str]] = None,
+        videos: Optional[Iterable[str]] = None
+    ) -> pd.DataFrame:
+    '''Returns the rows of the metadata index that satisfy all the given conditions'''
+    mask = pd.Series(True, index=metadata.index)
+    if min_confidence is not None:
+        mask &= metadata['confidence'] >= min_confidence
+    if max_duration is not None:
+        mask &= metadata['duration'] <= max_duration
+    if playlists is not None:
+        mask &= metadata['playlist'].isin(list(playlists))
+    if videos is not None:
+        mask &= metadata['video'].isin(list(videos))
+    return metadata[mask]
@@ -0,0 +1,9 @@
+import re
+import unicodedata
+
+
+def slugify(value: str) -> str:
+    '''Converts value to a lowercase ascii string usable as file name, with words separated by hyphens'''
+    value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore').decode('ascii')
+    value = re.sub(r'[^\w\s-]', '', value.lower())
+    return re.sub(r'[-\s]+', '-', value).strip('-_')
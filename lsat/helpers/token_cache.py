@@ -0,0 +1,29 @@
+import json
+from hashlib import sha1
+from pathlib import Path
+from typing import Iterable, Optional
+
+from lsat.typing import TokenCacheData
+
+
+def get_token_cache_key(tokenizer: str, words_min_freq: int, files: Iterable[Path]) -> str:
+    '''Returns a key that changes if the tokenizer, min frequency or the content of any of the files (splits and metadata index) change'''
+    key = sha1(f"{tokenizer}:{words_min_freq}".encode())
+    for file in files:
+        key.update(file.read_bytes())
+    return key.hexdigest()
+
+def load_token_cache(path: Path, key: str) -> Optional[TokenCacheData]:
+    '''Loads the token cache stored in path, None if it does not exist or was generated from different inputs'''
+    if not path.exists():
+        return None
+    with path.open() as cache_file:
+        cache: TokenCacheData = json.load(cache_file)
+    return cache if cache['key'] == key else None
+
+def store_token_cache(path: Path, cache: TokenCacheData) -> None:
+    '''Stores the token cache in path'''
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open('w') as cache_file:
+        json.dump(cache, cache_file, ensure_ascii=False)
+    tmp_path.replace(path)
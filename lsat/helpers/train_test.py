@@ -1,33 +1,72 @@
-import csv
+import json
 from pathlib import Path
-from math import ceil, floor
-from typing import Callable
-
-
-def split_train_test(path: Path, filter_sample: Callable[[Path], bool] = lambda x: True) -> tuple[list[Path], list[Path]]:
-    '''From root of the database builds train and test sets'''
-    video_paths = [video for playlist in path.glob('**/*') for video in playlist.glob('**/*')]
-    train_samples: list[Path] = []
-    test_samples: list[Path] = []
-    for video in video_paths:
-        clips = list(
-            filter(filter_sample,
-            map(lambda vid_path: Path(str(vid_path.resolve())[:-3] + "json"), video.glob('**/*.mp4'))))
-        train_samples += clips[:ceil(len(clips) * 0.8)]
-        test_samples += clips[-floor(len(clips) * 0.2):]
-    return (train_samples, test_samples)
-
-def load_train_test(train_path: Path, test_path: Path) -> tuple[list[Path], list[Path]]:
-    '''Loads train and test sets from csv file'''
-    train_samples = None
-    test_samples = None
-    with train_path.open() as train_f:
-        train_samples = list(map(Path, list(csv.reader(train_f))[0]))
-    with test_path.open() as test_f:
-        test_samples = list(map(Path, list(csv.reader(test_f))[0]))
-    return (train_samples, test_samples)
-
-def store_samples_to_csv(path: Path, samples: list[Path]):
-    '''Stores list of samples to csv file'''
-    with path.open('w') as train_file:
-        csv.writer(train_file, quoting=csv.QUOTE_ALL).writerow(map(lambda s: s.absolute(), samples))
+from math import ceil
+from typing import Container, Literal, Optional, TYPE_CHECKING
+
+import numpy as np
+
+from lsat.typing import SplitData
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+SplitStrategy = Literal["video", "playlist", "signer", "random"]
+
+def split_train_test(metadata: 'pd.DataFrame', strategy: SplitStrategy = "video", train_ratio: float = .8, seed: int = 0) -> tuple[list[str], list[str]]:
+    '''Splits the sample keys of the metadata index in train and test sets. Strategies:
+    video: first train_ratio of the clips of each video (in time order) for training and the rest for testing
+    playlist, signer: whole playlists or signers (shuffled with seed) for training until reaching train_ratio of the clips, the rest for testing.
+    At least 2 of them are needed. Signers are only known if the data files of the cuts have them (not in the released database), clips without one
+    are grouped by their video
+    random: clips shuffled with seed
+    The result only depends on the index content and the parameters, not on the order in which clips were found'''
+    metadata = metadata.sort_index()
+    total = len(metadata)
+    if strategy == "random":
+        keys = metadata.index.to_numpy()[np.random.default_rng(seed).permutation(total)]
+        return keys[:ceil(total * train_ratio)].tolist(), keys[ceil(total * train_ratio):].tolist()
+    if strategy == "video":
+        clips = metadata.sort_values('start', kind='stable').groupby(['playlist', 'video'], sort=False)
+        is_train = clips.cumcount() < np.ceil(clips['start'].transform('size') * train_ratio)
+    elif strategy in ("playlist", "signer"):
+        if strategy not in metadata.columns:
+            raise ValueError(f"The metadata index has no {strategy} column, needed to split by {strategy}")
+        groups = metadata[strategy]
+        if strategy == "signer":
+            if groups.isna().all():
+                raise ValueError("The cuts have no signer ids (signer field of their data files), split them by video or playlist instead")
+            # clips without a known signer are grouped by their video, as each video is interpreted by the same signer
+            groups = groups.fillna(metadata['playlist'] + '/' + metadata['video'])
+        sizes = groups.groupby(groups).size()
+        if len(sizes) < 2:
+            raise ValueError(f"Splitting by {strategy} needs at least 2 different values of {strategy}, found {len(sizes)}")
+        sizes = sizes.iloc[np.random.default_rng(seed).permutation(len(sizes))]
+        # groups are added to train while it has less than train_ratio of the clips, leaving at least one for test
+        train_groups = int((sizes.cumsum() - sizes < total * train_ratio).sum())
+        is_train = groups.isin(sizes.index[:min(train_groups, len(sizes) - 1)])
+    else:
+        raise ValueError(f"Unknown split strategy {strategy}")
+    is_train = is_train.reindex(metadata.index)
+    return metadata.index[is_train].tolist(), metadata.index[~is_train].tolist()
+
+def get_split_name(strategy: SplitStrategy, train_ratio: float = .8, seed: int = 0) -> str:
+    '''Returns the name of the file of a split, which identifies the parameters used to generate it'''
+    return f"{strategy}_train_{str(train_ratio).replace('.','')}" + ("" if strategy == "video" else f"_seed_{seed}")
+
+def load_split(path: Path, keys: Optional[Container[str]] = None) -> SplitData:
+    '''Loads train and test sample keys from a split file. If keys are given, the samples not in them (removed since the split was generated) are left out,
+    while the rest keep their set'''
+    with path.open() as split_file:
+        split: SplitData = json.load(split_file)
+    if keys is not None:
+        split['train'] = [key for key in split['train'] if key in keys]
+        split['test'] = [key for key in split['test'] if key in keys]
+    return split
+
+def store_split(path: Path, split: SplitData) -> None:
+    '''Stores train and test sample keys to a split file'''
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open('w') as split_file:
+        json.dump(split, split_file, ensure_ascii=False)
+    tmp_path.replace(path)
@@ -1,3 +1,3 @@
 from lsat.typing.Box import Box
-from lsat.typing.data_formats import KeypointData, CutData, SignerData
-from lsat.typing.dataset import Sample, CLIP_HINT, KEYPOINTS_HINT, LABEL_HINT
+from lsat.typing.data_formats import KeypointData, CutData, CutSignerData, SignerData, TokenCacheData, SplitData, DownloadData
+from lsat.typing.dataset import Sample, PaddedBatch, CLIP_HINT, KEYPOINTS_HINT, LABEL_HINT
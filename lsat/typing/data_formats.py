@@ -1,4 +1,4 @@
-from typing import TypedDict
+from typing import Optional, TypedDict
 
 from lsat.typing.Box import Box
 
@@ -25,3 +25,29 @@ class CutData(TypedDict):
     end: float
     video: str
     playlist: str
+
+class CutSignerData(CutData, total=False):
+    '''Data format of the cuts json data file with video level signer data, signer identifies who interprets the video'''
+    signer: str
+
+class TokenCacheData(TypedDict):
+    '''Data format of the cached tokenization of the labels of a split'''
+    key: str
+    tokens: dict[str, list[str]]
+    max_label_len: int
+    vocab: list[str]
+
+class SplitData(TypedDict):
+    '''Data format of the train and test split files, samples are identified by their key'''
+    strategy: str
+    train_ratio: float
+    seed: int
+    train: list[str]
+    test: list[str]
+
+class DownloadData(TypedDict):
+    '''Data format of each file of a download manifest, path is relative to the download root. size and sha256 are checked if given'''
+    path: str
+    url: str
+    size: Optional[int]
+    sha256: Optional[str]
@@ -1,4 +1,4 @@
-from typing import Iterable, Optional, TypeVar, Union
+from typing import Iterable, Optional, TypedDict, TypeVar, Union
 
 from torch import Tensor
 
@@ -11,6 +11,15 @@ LABEL_HINT = TypeVar('LABEL_HINT')
 
 Sample = tuple[
     Optional[Union[Iterable[Tensor], CLIP_HINT]],
-    Optional[Union[Iterable[KeypointData], KEYPOINTS_HINT]],
+    Optional[Union[Iterable[KeypointData], Tensor, KEYPOINTS_HINT]],
     Union[str, LABEL_HINT]
 ]
+
+class PaddedBatch(TypedDict):
+    '''Batch returned by the padded collate, masks are True where there is data and None for fields that are not padded'''
+    clips: Optional[Union[Tensor, list]]
+    clips_mask: Optional[Tensor]
+    keypoints: Optional[Union[Tensor, list]]
+    keypoints_mask: Optional[Tensor]
+    labels: Union[Tensor, list]
+    labels_mask: Optional[Tensor]
@@ -1,21 +1,23 @@
 import argparse, json
 import fiftyone as fo
+import pandas as pd
 from pathlib import Path
 from fiftyone import Sample
 
 from lsat.helpers.get_score import get_score
+from lsat.helpers.get_sample_key import get_sample_key
+from lsat.helpers.metadata import get_tree_key, load_metadata_index
 
 
-def store_sample(clip_file: Path, dataset):
+def store_sample(clip_file: Path, dataset, metadata: pd.Series):
+    '''Stores the clip with its metadata, taken from its row of the metadata index instead of its json file'''
     sample = Sample(clip_file)
-    with Path(str(clip_file.resolve())[:-3] + "json").open() as sample_data_file:
-        sample_data = json.load(sample_data_file)
-        sample["video"] = sample_data["video"]
-        sample["start"] = sample_data["start"]
-        sample["end"] = sample_data["end"]
-        sample["roi"] = sample_data["roi"]
-        sample["ground_truth"] = fo.Classification(label = sample_data["label"])
-        sample["confidence"] = 0 if len(sample_data["scores"]) == 0 else 1 if len(sample_data["scores"]) == 1 else get_score(list(map(float,sample_data["scores"])))
+    sample["video"] = metadata["video"]
+    sample["start"] = float(metadata["start"])
+    sample["end"] = float(metadata["end"])
+    sample["roi"] = {"x1": metadata["roi_x1"], "y1": metadata["roi_y1"], "width": metadata["roi_width"], "height": metadata["roi_height"]}
+    sample["ground_truth"] = fo.Classification(label = metadata["label"])
+    sample["confidence"] = float(metadata["confidence"])
     dataset.add_sample(sample)
 
 def store_full_sample(clip_file: Path, dataset):
@@ -64,12 +66,18 @@ def gen_fiftyone_visualization():
     except:
         dataset = fo.Dataset(db_name, persistent=True)
         clips = list(path.rglob("*.mp4"))
+        if not full_db:
+            metadata_path = path.parent / f"{path.name}_metadata.parquet"
+            if reload_db:
+                metadata_path.unlink(missing_ok=True)
+            key = get_tree_key(path, path.parent / f"{path.name}_tree.json")
+            metadata = load_metadata_index(path, metadata_path, key, (c.with_suffix('.json') for c in clips))
         for i,c in enumerate(clips,1):
             print(f"{i}/{len(clips)}")
             if full_db:
                 store_full_sample(c, dataset)
             else:
-                store_sample(c, dataset)
+                store_sample(c, dataset, metadata.loc[get_sample_key(path, c)])
 
     # View summary info about the dataset
     print(dataset)
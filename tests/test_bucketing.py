@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+import torch
+
+from lsat.dataset.BucketBatchSampler import BucketBatchSampler
+from lsat.dataset.collate import get_padded_collate, pad_sequences
+
+
+FRAMES = np.random.default_rng(0).integers(10, 300, 500).tolist()
+
+def test_batch_size_covers_every_sample_once():
+    sampler = BucketBatchSampler(FRAMES, batch_size=16, bucket_size=4)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    assert sorted(index for batch in batches for index in batch) == list(range(len(FRAMES)))
+    assert all(len(batch) <= 16 for batch in batches)
+
+def test_buckets_reduce_padding():
+    def padding(batches):
+        return sum(max(FRAMES[i] for i in batch) * len(batch) - sum(FRAMES[i] for i in batch) for batch in batches)
+    bucketed = list(BucketBatchSampler(FRAMES, batch_size=16, bucket_size=8))
+    random = [batch.tolist() for batch in np.array_split(np.random.default_rng(0).permutation(len(FRAMES)), len(bucketed))]
+    assert padding(bucketed) < padding(random) / 3
+
+def test_frame_budget():
+    frames = FRAMES + [2000]
+    batches = list(BucketBatchSampler(frames, max_frames=1000))
+    assert sorted(index for batch in batches for index in batch) == list(range(len(frames)))
+    for batch in batches:
+        # a sample longer than the budget goes alone
+        assert max(frames[i] for i in batch) * len(batch) <= 1000 or len(batch) == 1
+    assert [len(batch) for batch in batches if len(frames) - 1 in batch] == [1]
+
+def test_epochs_and_seeds():
+    sampler = BucketBatchSampler(FRAMES, batch_size=8)
+    first = list(sampler)
+    assert first == list(BucketBatchSampler(FRAMES, batch_size=8))
+    sampler.set_epoch(1)
+    assert list(sampler) != first
+
+def test_drop_last_and_token_lengths():
+    frames = [5] * 10
+    tokens = list(range(10, 0, -1))
+    batches = list(BucketBatchSampler(frames, tokens, batch_size=4, shuffle=False, drop_last=True))
+    # sorted by tokens when frames are equal, the last incomplete batch dropped
+    assert batches == [[9, 8, 7, 6], [5, 4, 3, 2]]
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        BucketBatchSampler(FRAMES)
+    with pytest.raises(ValueError):
+        BucketBatchSampler(FRAMES, [1], batch_size=2)
+
+def test_pad_sequences():
+    padded, mask = pad_sequences([torch.ones(2, 3), torch.ones(4, 3) * 2], pad_value=-1)
+    assert padded.shape == (2, 4, 3)
+    assert (padded[0, 2:] == -1).all() and (padded[1] == 2).all()
+    assert mask.tolist() == [[True, True, False, False], [True] * 4]
+
+def test_padded_collate():
+    samples = [
+        ([torch.zeros(3, 2, 2, dtype=torch.uint8)] * 2, torch.ones(2, 5, 3), torch.tensor([2, 7, 3])),
+        (torch.ones(3, 3, 2, 2, dtype=torch.uint8), torch.ones(3, 5, 3), torch.tensor([2, 3])),
+    ]
+    batch = get_padded_collate(pad_idx=1, keypoints_pad_value=float('nan'))(samples)
+    assert batch['clips'].shape == (2, 3, 3, 2, 2) and batch['clips_mask'].sum().item() == 5
+    assert batch['keypoints'][0, 2].isnan().all() and batch['keypoints_mask'].tolist() == [[True, True, False], [True] * 3]
+    assert batch['labels'].tolist() == [[2, 7, 3], [2, 3, 1]]
+
+def test_padded_collate_keeps_fields_that_are_not_tensors():
+    batch = get_padded_collate(pad_idx=1)([(None, [{'keypoints': []}], "hola"), (None, [], "chau")])
+    assert batch['clips'] is None and batch['clips_mask'] is None
+    assert batch['labels'] == ["hola", "chau"] and batch['labels_mask'] is None
+    assert batch['keypoints_mask'] is None
@@ -0,0 +1,59 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+
+import lsat.dataset.PyTorchDataset
+from lsat.dataset.ClipCache import ClipCache, build_clip_cache
+
+
+def fake_load_clip(paths, roi, max_frames, frame_stride, size):
+    '''Stands for the clip loader, the mp4 file holds the amount of frames of the clip, and each frame holds the x1 of the roi'''
+    content = paths['mp4'].read_text()
+    if content == "broken":
+        raise RuntimeError("could not decode")
+    return [torch.full((3, *size), roi['x1'] if roi is not None else i, dtype=torch.uint8) for i in range(int(content))]
+
+@pytest.fixture
+def samples(tmp_path, monkeypatch) -> list[Path]:
+    monkeypatch.setattr(lsat.dataset.PyTorchDataset, '_load_clip_as_tensors', fake_load_clip)
+    root = tmp_path / "cuts"
+    root.mkdir()
+    samples = []
+    for name, content in [("a", "3"), ("b", "0"), ("broken", "broken"), ("c", "2")]:
+        (root / f"{name}.mp4").write_text(content)
+        with (root / f"{name}_signer.json").open('w') as signer_file:
+            json.dump({'roi': {'x1': 7, 'y1': 0, 'width': 2, 'height': 2}}, signer_file)
+        samples.append(root / f"{name}.json")
+    (root / "c_signer.json").unlink()
+    return samples
+
+def test_broken_clips_are_recorded(samples, tmp_path):
+    path = tmp_path / "cache"
+    build_clip_cache(samples[0].parent, samples, path, "key", False, (2, 2), workers=2)
+    cache = ClipCache(path)
+    assert cache.key == "key" and sorted(cache.index) == ["a", "b", "c"]
+    assert list(cache.errors) == ["broken"] and "could not decode" in cache.errors["broken"]
+    assert np.array_equal(cache.get_clip("a")[:, 0, 0, 0], [0, 1, 2]) and cache.get_clip("b").shape == (0, 3, 2, 2)
+    # failed clips are not retried when resuming
+    build_clip_cache(samples[0].parent, samples, path, "key", False, (2, 2), workers=1)
+    assert sum(len(index_path.read_text().splitlines()) for index_path in path.glob("shard_*.jsonl")) == 4
+
+def test_clips_without_signer(samples, tmp_path):
+    path = tmp_path / "cache"
+    build_clip_cache(samples[0].parent, samples, path, "key", True, (2, 2), workers=1)
+    cache = ClipCache(path)
+    assert sorted(cache.index) == ["a", "b"] and sorted(cache.errors) == ["broken", "c"]
+    assert (cache.get_clip("a") == 7).all()
+
+def test_cache_is_rebuilt_when_files_change(samples, tmp_path):
+    path = tmp_path / "cache"
+    build_clip_cache(samples[0].parent, samples, path, "key", False, (2, 2), workers=1)
+    samples[0].with_suffix('.mp4').write_text("1")
+    build_clip_cache(samples[0].parent, samples, path, "key", False, (2, 2), workers=1)
+    assert ClipCache(path).get_clip("a").shape[0] == 3
+    build_clip_cache(samples[0].parent, samples, path, "new", False, (2, 2), workers=1)
+    cache = ClipCache(path)
+    assert cache.key == "new" and cache.get_clip("a").shape[0] == 1 and len(cache) == 3
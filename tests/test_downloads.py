@@ -0,0 +1,140 @@
+import os
+import threading
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+import pytest
+
+from lsat.helpers.downloads import DownloadError, download_all, download_file, get_download_data, load_manifest, store_manifest
+
+
+DATA = os.urandom(300_000)
+DATA_SHA256 = sha256(DATA).hexdigest()
+
+class Server:
+    '''Serves DATA at every path, with Range support. Behaviour is set per test:
+    drops: amount of requests whose connection is closed after a third of the body
+    ranges: whether Range headers are honoured
+    errors: statuses returned, in order, before serving the data'''
+
+    def __init__(self) -> None:
+        self.drops = 0
+        self.ranges = True
+        self.errors: list[int] = []
+        self.requested_ranges: list[int] = []
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                server.requests += 1
+                if self.path.startswith('/missing'):
+                    self.send_error(404)
+                    return
+                if server.errors:
+                    self.send_error(server.errors.pop(0))
+                    return
+                start = 0
+                if 'Range' in self.headers and server.ranges:
+                    start = int(self.headers['Range'].split('=')[1].split('-')[0])
+                    server.requested_ranges.append(start)
+                    if start >= len(DATA):
+                        self.send_error(416)
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f"bytes {start}-{len(DATA) - 1}/{len(DATA)}")
+                else:
+                    self.send_response(200)
+                body = DATA[start:]
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if server.drops > 0:
+                    server.drops -= 1
+                    self.wfile.write(body[:len(body) // 3])
+                    self.wfile.flush()
+                    self.connection.shutdown(2)
+                    return
+                self.wfile.write(body)
+
+        self.http = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.http.server_port}"
+
+@pytest.fixture
+def server() -> Iterator[Server]:
+    server = Server()
+    thread = threading.Thread(target=server.http.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.http.shutdown()
+    server.http.server_close()
+
+def test_download(server, tmp_path):
+    path = download_file(f"{server.url}/a", tmp_path / 'a.bin', size=len(DATA), sha256=DATA_SHA256)
+    assert path.read_bytes() == DATA
+    assert not (tmp_path / 'a.bin.part').exists()
+    # a complete file is not downloaded again
+    requests = server.requests
+    download_file(f"{server.url}/a", path, size=len(DATA), sha256=DATA_SHA256)
+    assert server.requests == requests
+
+def test_dropped_connections_are_resumed(server, tmp_path):
+    server.drops = 2
+    path = download_file(f"{server.url}/a", tmp_path / 'a.bin', sha256=DATA_SHA256, backoff=.01)
+    assert path.read_bytes() == DATA
+    # each attempt continues from the bytes already downloaded
+    assert len(server.requested_ranges) == 2 and 0 < server.requested_ranges[0] < server.requested_ranges[1]
+
+def test_server_ignoring_range_restarts(server, tmp_path):
+    server.ranges = False
+    (tmp_path / 'a.bin.part').write_bytes(DATA[:1000])
+    path = download_file(f"{server.url}/a", tmp_path / 'a.bin', size=len(DATA), sha256=DATA_SHA256, backoff=.01)
+    assert path.read_bytes() == DATA
+
+def test_complete_part_is_not_downloaded_again(server, tmp_path):
+    (tmp_path / 'a.bin.part').write_bytes(DATA)
+    # without a size the part is requested from its end, answered with 416
+    path = download_file(f"{server.url}/a", tmp_path / 'a.bin', sha256=DATA_SHA256)
+    assert path.read_bytes() == DATA
+    assert server.requested_ranges == [len(DATA)]
+
+def test_checksum_mismatch(server, tmp_path):
+    with pytest.raises(DownloadError, match="checksum"):
+        download_file(f"{server.url}/a", tmp_path / 'a.bin', sha256='0' * 64, retries=1, backoff=.01)
+    assert list(tmp_path.iterdir()) == []
+
+def test_server_errors_are_retried(server, tmp_path):
+    server.errors = [503, 500]
+    assert download_file(f"{server.url}/a", tmp_path / 'a.bin', backoff=.01).read_bytes() == DATA
+    assert server.requests == 3
+
+def test_server_errors_after_retries(server, tmp_path):
+    server.errors = [503] * 3
+    with pytest.raises(DownloadError, match="503"):
+        download_file(f"{server.url}/a", tmp_path / 'a.bin', retries=2, backoff=.01)
+
+def test_client_errors_are_not_retried(server, tmp_path):
+    with pytest.raises(DownloadError, match="404"):
+        download_file(f"{server.url}/missing", tmp_path / 'a.bin', backoff=.01)
+    assert server.requests == 1
+
+def test_download_all_from_mirror(server, tmp_path):
+    entries = [{'path': f"dir/{i}.bin", 'url': "unused", 'size': len(DATA), 'sha256': DATA_SHA256} for i in range(4)]
+    entries.append({'path': "missing.bin", 'url': "unused", 'size': None, 'sha256': None})
+    done = []
+    errors = download_all(entries, tmp_path, workers=2, base_url=f"{server.url}/", on_done=lambda entry, _: done.append(entry['path']), retries=0)
+    assert list(errors) == ["missing.bin"]
+    assert sorted(done) == sorted(entry['path'] for entry in entries)
+    assert all((tmp_path / entry['path']).read_bytes() == DATA for entry in entries[:4])
+
+def test_manifest_round_trip(tmp_path):
+    (tmp_path / 'b.bin').write_bytes(DATA)
+    (tmp_path / 'a.bin').write_bytes(b"")
+    entries = [get_download_data(tmp_path, tmp_path / name, f"http://host/{name}") for name in ('b.bin', 'a.bin')]
+    store_manifest(tmp_path / 'manifest.json', entries)
+    assert load_manifest(tmp_path / 'manifest.json') == sorted(entries, key=lambda entry: entry['path'])
+    assert entries[0] == {'path': 'b.bin', 'url': "http://host/b.bin", 'size': len(DATA), 'sha256': DATA_SHA256}
+    assert load_manifest(tmp_path / 'missing.json') == []
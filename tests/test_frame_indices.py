@@ -0,0 +1,36 @@
+import pytest
+import torch
+
+from lsat.dataset.PyTorchDataset import _get_frame_indices, _load_clip_as_tensors
+
+
+class FakeReader:
+    '''VideoReader over frames whose pixels hold their index, with the given metadata'''
+
+    def __init__(self, frames_amount: int, metadata: dict) -> None:
+        self.frames_amount = frames_amount
+        self.metadata = metadata
+
+    def get_metadata(self) -> dict:
+        return {'video': self.metadata}
+
+    def __iter__(self):
+        return ({'data': torch.full((3, 2, 2), i, dtype=torch.uint8), 'pts': i / 30} for i in range(self.frames_amount))
+
+def test_max_frames_pads_with_the_last_frame():
+    assert _get_frame_indices(10, 4, None) == [0, 3, 6, 9]
+    assert _get_frame_indices(3, 5, None) == [0, 1, 2, 2, 2]
+
+def test_frame_stride():
+    assert _get_frame_indices(7, None, 3) == [0, 3, 6]
+
+@pytest.mark.parametrize("max_frames, frame_stride", [(4, None), (None, 2)])
+def test_empty_clip(max_frames, frame_stride):
+    assert _get_frame_indices(0, max_frames, frame_stride) == []
+
+@pytest.mark.parametrize("metadata", [{}, {'fps': [], 'duration': []}, {'fps': [30.], 'duration': [float('nan')]}])
+@pytest.mark.parametrize("max_frames, frame_stride, expected", [(4, None, [0, 3, 6, 9]), (None, 3, [0, 3, 6, 9])])
+def test_missing_metadata_decodes_sequentially(monkeypatch, metadata, max_frames, frame_stride, expected):
+    monkeypatch.setattr('torchvision.io.VideoReader', lambda path, stream: FakeReader(10, metadata))
+    frames = list(_load_clip_as_tensors({'mp4': 'clip.mp4'}, max_frames=max_frames, frame_stride=frame_stride))
+    assert [int(frame[0, 0, 0]) for frame in frames] == expected
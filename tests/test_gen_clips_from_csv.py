@@ -0,0 +1,34 @@
+import subprocess
+
+import numpy as np
+import pytest
+
+pytest.importorskip('moviepy')
+from lsat.generation.gen_clips_from_csv import MAX_DELTA, cut_video, get_deltas
+
+
+def test_get_deltas_limits_to_max_delta():
+    assert get_deltas({'prev_delta': .2, 'post_delta': 3.}) == (.2, MAX_DELTA)
+
+def test_get_deltas_missing():
+    assert get_deltas({'prev_delta': np.nan, 'post_delta': None}) == (MAX_DELTA, MAX_DELTA)
+
+def test_cut_video_missing_video_fails_its_rows(tmp_path):
+    rows = [{'id': i, 'start': 1., 'end': 2., 'prev_delta': .1, 'post_delta': .1} for i in range(3)]
+    results = cut_video(str(tmp_path / 'missing.mp4'), rows, tmp_path / 'cuts', tmp_path / 'tmp', stream_copy=False)
+    assert [clip for clip, _ in results] == ['0', '1', '2']
+    assert all(error is not None for _, error in results)
+
+def test_cut_video_records_each_clip_in_the_manifest(tmp_path):
+    imageio_ffmpeg = pytest.importorskip('imageio_ffmpeg')
+    video_path = tmp_path / 'video.mp4'
+    subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), '-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc=duration=3:size=64x48:rate=10', str(video_path)], check=True)
+    for path in ('cuts', 'tmp'):
+        (tmp_path / path).mkdir()
+    # the temporary file of clip 1 can not be written
+    (tmp_path / 'tmp' / '1.mp4').mkdir()
+    rows = [{'id': i, 'start': float(i), 'end': i + .5, 'prev_delta': 0., 'post_delta': 0.} for i in range(3)]
+    results = cut_video(str(video_path), rows, tmp_path / 'cuts', tmp_path / 'tmp', True, tmp_path / 'manifest.txt')
+    assert [clip for clip, error in results if error is not None] == ['1']
+    assert (tmp_path / 'manifest.txt').read_text().split() == ['0', '2']
+    assert sorted(path.name for path in (tmp_path / 'cuts').iterdir()) == ['0.mp4', '2.mp4']
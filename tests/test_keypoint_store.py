@@ -0,0 +1,40 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from lsat.dataset.KeypointStore import KeypointStore, build_keypoint_store
+
+
+def write_signer(root: Path, name: str, frames: int) -> Path:
+    '''Writes a sample whose keypoints, boxes and scores hold its amount of frames and frame index'''
+    root.mkdir(parents=True, exist_ok=True)
+    keypoints = [
+        {'keypoints': [float(frames), float(i), .5] * 2, 'box': [i, i, 10., 10.], 'score': i / 10, 'image_id': "", 'category_id': 1, 'idx': []}
+        for i in range(frames)
+    ]
+    with (root / f"{name}_signer.json").open('w') as signer_file:
+        json.dump({'scores': [1.], 'roi': {'x1': 1., 'y1': 2., 'width': 3., 'height': float(frames)}, 'keypoints': keypoints}, signer_file)
+    return root / f"{name}.json"
+
+def test_round_trip(tmp_path):
+    root = tmp_path / "cuts"
+    samples = [write_signer(root, "a", 3), write_signer(root, "empty", 0), write_signer(root, "b", 2)]
+    build_keypoint_store(root, samples, tmp_path / "store", key="key")
+    store = KeypointStore(tmp_path / "store")
+    assert len(store) == 3 and store.key == "key"
+    assert [store.get_frames_amount(key) for key in ("a", "empty", "b")] == [3, 0, 2]
+    keypoints = store.get_keypoints("a")
+    assert keypoints.shape == (3, 2, 3)
+    np.testing.assert_array_equal(keypoints[:, 0], [[3, 0, .5], [3, 1, .5], [3, 2, .5]])
+    np.testing.assert_array_equal(store.get_boxes("b")[1], [1, 1, 10, 10])
+    np.testing.assert_allclose(store.get_scores("b"), [0, .1])
+    assert store.get_keypoints("empty").shape == (0, 2, 3)
+    assert store.get_roi("b") == {'x1': 1., 'y1': 2., 'width': 3., 'height': 2.}
+
+def test_rebuild_replaces_store(tmp_path):
+    root = tmp_path / "cuts"
+    build_keypoint_store(root, [write_signer(root, "a", 3)], tmp_path / "store", key="old")
+    build_keypoint_store(root, [write_signer(root, "a", 5)], tmp_path / "store", key="new")
+    store = KeypointStore(tmp_path / "store")
+    assert store.key == "new" and store.get_frames_amount("a") == 5
@@ -0,0 +1,88 @@
+import math
+
+import pytest
+import torch
+
+from lsat.dataset.keypoint_transforms import (
+    AffineKeypointTransform,
+    KeypointDropout,
+    KeypointPipeline,
+    KeypointTransform,
+    NormalizeKeypoints,
+    RandomAffine,
+    RandomRotation,
+    RandomSpeed,
+    TemporalResample,
+    resample_frames
+)
+
+
+def random_clips(clips: int = 3, frames: int = 6, keypoints: int = 15) -> tuple[torch.Tensor, torch.Tensor]:
+    generator = torch.Generator().manual_seed(0)
+    xy = torch.rand((clips, frames, keypoints, 2), generator=generator, dtype=torch.float64) * 100
+    keypoints_tensor = torch.cat([xy, torch.rand((clips, frames, keypoints, 1), generator=generator, dtype=torch.float64)], dim=-1)
+    boxes = torch.cat([xy.amin(dim=2), xy.amax(dim=2)], dim=-1)
+    return keypoints_tensor, boxes
+
+def test_base_classes_are_abstract():
+    with pytest.raises(TypeError):
+        KeypointTransform()
+    with pytest.raises(TypeError):
+        AffineKeypointTransform()
+
+def test_fused_pipeline_matches_sequential_application():
+    keypoints, boxes = random_clips()
+    transforms = [
+        NormalizeKeypoints("shoulders", "shoulders"),
+        RandomAffine(degrees=30, scale=(.8, 1.2), translate=(.1, .1)),
+        NormalizeKeypoints("box", "box"),
+        TemporalResample(9),
+        RandomRotation(10),
+        NormalizeKeypoints("nose")
+    ]
+    fused, fused_boxes = KeypointPipeline(transforms).transform(keypoints, boxes, torch.Generator().manual_seed(1))
+    generator = torch.Generator().manual_seed(1)
+    sequential, sequential_boxes = keypoints, boxes
+    for transform in transforms:
+        sequential, sequential_boxes = transform.transform(sequential, sequential_boxes, generator)
+    torch.testing.assert_close(fused, sequential)
+    torch.testing.assert_close(fused_boxes, sequential_boxes)
+    assert fused.shape == (3, 9, 15, 3)
+
+def test_normalize_to_nose():
+    keypoints, _ = random_clips()
+    normalized = NormalizeKeypoints("nose")(keypoints)
+    torch.testing.assert_close(normalized[:, :, 0, :2].mean(dim=1), torch.zeros(3, 2, dtype=torch.float64))
+    # other channels are kept
+    torch.testing.assert_close(normalized[..., 2], keypoints[..., 2])
+
+def test_normalize_scale_ignores_missing_keypoints():
+    keypoints, _ = random_clips(clips=1)
+    keypoints[0, 0, 11] = math.nan
+    normalized = NormalizeKeypoints("shoulders", "shoulders")(keypoints)
+    distance = (normalized[0, 1:, 11, :2] - normalized[0, 1:, 12, :2]).norm(dim=-1)
+    torch.testing.assert_close(distance.mean(), torch.tensor(1., dtype=torch.float64))
+
+def test_unbatched_clip_keeps_its_dimensions():
+    keypoints, boxes = random_clips(clips=1)
+    pipeline = KeypointPipeline([NormalizeKeypoints("box", "box"), RandomRotation(20)], seed=0)
+    assert pipeline(keypoints[0], boxes[0]).shape == keypoints[0].shape
+
+def test_seeded_pipeline_is_reproducible():
+    keypoints, _ = random_clips()
+    first = KeypointPipeline([RandomAffine(45, (.5, 2.)), RandomSpeed(), KeypointDropout(.3)], seed=3)(keypoints)
+    second = KeypointPipeline([RandomAffine(45, (.5, 2.)), RandomSpeed(), KeypointDropout(.3)], seed=3)(keypoints)
+    torch.testing.assert_close(first, second, equal_nan=True)
+
+def test_resample_frames():
+    values = torch.tensor([[0., 2., math.nan, 6.]])
+    torch.testing.assert_close(resample_frames(values, 7), torch.tensor([[0., 1., 2., math.nan, math.nan, math.nan, 6.]]), equal_nan=True)
+    assert resample_frames(torch.empty((1, 0, 3)), 5).shape == (1, 0, 3)
+
+def test_dropout():
+    keypoints, _ = random_clips(clips=2, frames=50)
+    dropped = KeypointDropout(p=0., frame_p=.5)(keypoints, generator=torch.Generator().manual_seed(0))
+    missing = dropped.isnan().all(dim=-1)
+    # whole frames are dropped, and only them
+    assert (missing.all(dim=-1) == missing.any(dim=-1)).all()
+    assert 0 < missing.all(dim=-1).float().mean() < 1
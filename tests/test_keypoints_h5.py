@@ -0,0 +1,68 @@
+import h5py
+import numpy as np
+import pytest
+
+from lsat.helpers.keypoint_subsets import CHANNELS, KEYPOINT_PARTS, KEYPOINTS_AMOUNT, get_subset_indices
+from lsat.helpers.keypoints_h5 import QUANTIZED_NAN, dequantize_keypoints, quantize_keypoints, read_signer_keypoints, write_signer_keypoints
+
+
+def random_keypoints(frames: int) -> np.ndarray:
+    '''(T, 543, 4) keypoints, with nan in the channels each part does not have and in a missing hand'''
+    keypoints = np.random.default_rng(0).uniform(-1, 2, (frames, KEYPOINTS_AMOUNT, len(CHANNELS))).astype(np.float32)
+    for start, amount, channels in KEYPOINT_PARTS.values():
+        for i, channel in enumerate(CHANNELS):
+            if channel not in channels:
+                keypoints[:, start:start + amount, i] = np.nan
+    start, amount, _ = KEYPOINT_PARTS['left_hand']
+    keypoints[:frames // 2, start:start + amount] = np.nan
+    return keypoints
+
+@pytest.fixture
+def signer_group(tmp_path):
+    with h5py.File(tmp_path / "keypoints.h5", 'w') as h5_file:
+        yield h5_file.create_group("clip/signer_0")
+
+def write(group: h5py.Group, keypoints: np.ndarray, **kwargs) -> None:
+    group.create_dataset('boxes', data=np.zeros((len(keypoints), 4), dtype=np.float32))
+    write_signer_keypoints(group, keypoints.reshape(len(keypoints), KEYPOINTS_AMOUNT * len(CHANNELS)), **kwargs)
+
+def test_compact_round_trip(signer_group):
+    keypoints = random_keypoints(10)
+    write(signer_group, keypoints)
+    np.testing.assert_array_equal(read_signer_keypoints(signer_group), keypoints)
+
+def test_quantized_round_trip(signer_group):
+    keypoints = random_keypoints(10)
+    write(signer_group, keypoints, quantize=True)
+    assert signer_group['parts/face'].dtype == np.int16
+    read = read_signer_keypoints(signer_group)
+    np.testing.assert_array_equal(np.isnan(read), np.isnan(keypoints))
+    # error of at most half a step of the largest value of the clip
+    np.testing.assert_allclose(read, keypoints, atol=2 / np.iinfo(np.int16).max, equal_nan=True)
+
+def test_quantize_channel_without_values():
+    keypoints = np.full((3, 2, 2), np.nan, dtype=np.float32)
+    keypoints[..., 0] = 1.
+    quantized, scale = quantize_keypoints(keypoints)
+    assert (quantized[..., 1] == QUANTIZED_NAN).all()
+    np.testing.assert_array_equal(dequantize_keypoints(quantized, scale), keypoints)
+
+def test_subsets_and_channels(signer_group):
+    keypoints = random_keypoints(4)
+    write(signer_group, keypoints, subsets=['hands', 'face_contour'])
+    assert 'pose' not in signer_group['parts']
+    stored = get_subset_indices(['hands', 'face_contour'])
+    np.testing.assert_array_equal(read_signer_keypoints(signer_group, stored, ('y', 'x')), keypoints[:, stored][:, :, [1, 0]])
+    # keypoints that are not stored are nan
+    assert np.isnan(read_signer_keypoints(signer_group, get_subset_indices(['pose']))).all()
+
+@pytest.mark.parametrize("quantize", [False, True])
+def test_signer_without_frames(signer_group, quantize):
+    write(signer_group, np.zeros((0, KEYPOINTS_AMOUNT, len(CHANNELS))), quantize=quantize)
+    assert read_signer_keypoints(signer_group).shape == (0, KEYPOINTS_AMOUNT, len(CHANNELS))
+
+def test_legacy_layout(signer_group):
+    keypoints = random_keypoints(3)
+    signer_group.create_dataset('keypoints', data=keypoints.reshape(3, -1))
+    indices = get_subset_indices(['right_hand'])
+    np.testing.assert_array_equal(read_signer_keypoints(signer_group, indices, ('x', 'y')), keypoints[:, indices][:, :, :2])
@@ -0,0 +1,71 @@
+import json
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from lsat.helpers.metadata import METADATA_COLUMNS, filter_metadata, get_tree_key, load_metadata_index
+
+
+def write_cut(root: Path, video: str, i: int, label: str, duration: float, **data) -> None:
+    (root / video).mkdir(parents=True, exist_ok=True)
+    (root / video / f"{i}.mp4").write_bytes(b"")
+    with (root / video / f"{i}.json").open('w') as data_file:
+        json.dump({'label': label, 'start': float(i), 'end': i + duration, 'video': video, 'playlist': "playlist", **data}, data_file)
+    with (root / video / f"{i}_signer.json").open('w') as signer_file:
+        json.dump({'scores': [.9], 'roi': {'x1': 1, 'y1': 2, 'width': 3, 'height': 4}, 'keypoints': []}, signer_file)
+
+@pytest.fixture
+def root(tmp_path) -> Path:
+    root = tmp_path / "cuts"
+    write_cut(root, "a", 0, "hola", 1.)
+    write_cut(root, "a", 1, "chau", 3.)
+    write_cut(root, "b", 0, "buenas", 2., signer="ana")
+    # old enough for the state of the tree to be stored
+    modified = time.time_ns() - 10**10
+    for path in [root, *root.glob('**/*')]:
+        os.utime(path, ns=(modified, modified))
+    return root
+
+def test_index(root, tmp_path):
+    metadata = load_metadata_index(root, tmp_path / "metadata.parquet", "key")
+    assert list(metadata.columns) == METADATA_COLUMNS
+    assert sorted(metadata.index) == ["a/0", "a/1", "b/0"]
+    assert metadata.at["a/1", 'label'] == "chau" and metadata.at["a/1", 'duration'] == 3.
+    assert metadata.at["a/0", 'roi_height'] == 4 and metadata.at["a/0", 'confidence'] == 1.
+    assert pd.isna(metadata.at["a/0", 'signer']) and metadata.at["b/0", 'signer'] == "ana"
+    assert list(filter_metadata(metadata, max_duration=2.).index.sort_values()) == ["a/0", "b/0"]
+
+def test_tree_key_changes_with_files(root, tmp_path, monkeypatch):
+    state_path = tmp_path / "tree.json"
+    key = get_tree_key(root, state_path)
+    # an unchanged tree is not listed again
+    monkeypatch.setattr(os, 'scandir', None)
+    assert get_tree_key(root, state_path) == key
+    monkeypatch.undo()
+    write_cut(root, "b", 1, "nuevo", 1.)
+    assert get_tree_key(root, state_path) != key
+    key = get_tree_key(root, state_path)
+    (root / "b" / "1_signer.json").unlink()
+    assert get_tree_key(root, state_path) != key
+
+def test_tree_key_of_modified_files(root, tmp_path):
+    state_path = tmp_path / "tree.json"
+    key = get_tree_key(root, state_path)
+    # modifying a file in place does not change its directory, so it's only seen if files are stated
+    os.utime(root / "a" / "0.json", ns=(1, 1))
+    assert get_tree_key(root, state_path) == key
+    key = get_tree_key(root, state_path, ('.mp4', '.json'))
+    os.utime(root / "a" / "0.json", ns=(2, 2))
+    assert get_tree_key(root, state_path, ('.mp4', '.json')) != key
+
+def test_index_is_rebuilt_when_cuts_change(root, tmp_path):
+    path = tmp_path / "metadata.parquet"
+    load_metadata_index(root, path, get_tree_key(root, tmp_path / "tree.json"))
+    modified = path.stat().st_mtime_ns
+    load_metadata_index(root, path, get_tree_key(root, tmp_path / "tree.json"))
+    assert path.stat().st_mtime_ns == modified
+    write_cut(root, "b", 1, "nuevo", 1.)
+    assert "b/1" in load_metadata_index(root, path, get_tree_key(root, tmp_path / "tree.json")).index
@@ -0,0 +1,58 @@
+import pickle
+import time
+
+from lsat.dataset.Profiler import SAMPLE_STAGE, Profiler
+
+
+def test_summary(tmp_path):
+    profiler = Profiler(tmp_path)
+    for _ in range(3):
+        with profiler.stage(SAMPLE_STAGE):
+            with profiler.stage("read", 10) as stage:
+                stage['bytes'] = 20
+    summary = profiler.summary()
+    assert summary['samples'] == 3
+    assert summary['stages']['read']['calls'] == 3 and summary['stages']['read']['bytes'] == 60
+    profiler.clear()
+    assert profiler.summary()['samples'] == 0
+
+def test_iterate_is_lazy_and_records_when_consumed(tmp_path):
+    profiler = Profiler(tmp_path)
+    consumed = []
+    def frames():
+        for i in range(3):
+            time.sleep(.01)
+            consumed.append(i)
+            yield i
+    clip = profiler.iterate(frames(), "decode")
+    assert consumed == [] and 'decode' not in profiler.summary()['stages']
+    assert list(clip) == [0, 1, 2]
+    stage = profiler.summary()['stages']['decode']
+    assert stage['calls'] == 1 and stage['total_s'] >= .03
+
+def test_iterate_records_when_closed_early(tmp_path):
+    profiler = Profiler(tmp_path)
+    clip = profiler.iterate(iter(range(10)), "decode")
+    next(clip)
+    clip.close()
+    assert profiler.summary()['stages']['decode']['calls'] == 1
+
+def test_temporary_directory_is_removed_by_its_creator():
+    profiler = Profiler()
+    path = profiler.path
+    with profiler.stage("read"):
+        pass
+    # copies sent to workers do not remove it
+    copy = pickle.loads(pickle.dumps(profiler))
+    copy.close()
+    del copy
+    assert path.exists()
+    profiler.close()
+    assert not path.exists()
+
+def test_given_directory_is_kept(tmp_path):
+    profiler = Profiler(tmp_path)
+    with profiler.stage("read"):
+        pass
+    profiler.close()
+    assert len(list(tmp_path.glob("*.tsv"))) == 1
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+import torch
+
+from lsat.dataset.SampleCache import SampleCache, get_fingerprint, get_size
+
+
+def sample(value: int, size: int = 100) -> tuple:
+    return (None, torch.full((size,), value, dtype=torch.uint8), "label")
+
+def test_memory_lru_eviction():
+    size = get_size(sample(0))
+    cache = SampleCache(size * 2)
+    cache.put('a', sample(0))
+    cache.put('b', sample(1))
+    assert cache.get('a') is not None
+    # b is the least recently used
+    cache.put('c', sample(2))
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['samples_in_memory'] == 2
+    assert stats['memory_bytes'] == size * 2
+
+def test_stats_counts_hits_and_misses():
+    cache = SampleCache(10**6)
+    assert cache.get('a') is None
+    cache.put('a', sample(0))
+    assert torch.equal(cache.get('a')[1], sample(0)[1])
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, .5)
+
+def test_path_is_shared_between_caches(tmp_path):
+    SampleCache(10**6, tmp_path).put('a', sample(3))
+    cache = SampleCache(10**6, tmp_path)
+    assert torch.equal(cache.get('a')[1], sample(3)[1])
+    assert cache.stats()['path_hits'] == 1
+
+def test_path_namespaces_do_not_mix(tmp_path):
+    SampleCache(10**6, tmp_path, namespace='clips').put('a', sample(3))
+    assert SampleCache(10**6, tmp_path, namespace='no_clips').get('a') is None
+
+def test_path_is_kept_under_its_budget(tmp_path):
+    cache = SampleCache(0, tmp_path, path_bytes=10**6)
+    cache.put('a', sample(0, 1000))
+    file_size = os.path.getsize(next(tmp_path.glob("*/*.pt")))
+    cache = SampleCache(0, tmp_path, path_bytes=file_size * 3)
+    for key in 'bcd':
+        cache.put(key, sample(0, 1000))
+    # a is the least recently used file
+    assert cache.get('a') is None and cache.get('d') is not None
+    stats = cache.stats()
+    assert stats['path_evictions'] >= 1
+    assert stats['path_bytes'] <= file_size * 3
+    assert sum(path.stat().st_size for path in tmp_path.glob("*/*.pt")) == stats['path_bytes']
+
+def test_path_needs_a_budget(tmp_path):
+    with pytest.raises(ValueError):
+        SampleCache(0, tmp_path)
+
+def test_fingerprint_changes_with_transform_parameters():
+    def scale(factor):
+        return lambda x: x * factor
+    assert get_fingerprint(True, scale(2)) == get_fingerprint(True, scale(2))
+    assert get_fingerprint(True, scale(2)) != get_fingerprint(True, scale(3))
+    assert get_fingerprint(True, None) != get_fingerprint(False, None)
+    assert get_fingerprint(torch.nn.Dropout(.1)) != get_fingerprint(torch.nn.Dropout(.2))
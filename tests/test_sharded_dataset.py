@@ -0,0 +1,108 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+import torch
+from torch.utils.data import DataLoader
+
+from lsat.dataset.ShardedDataset import ShardedDataset, _prefetch, write_shards
+
+
+class FakeDataset:
+    '''Stands for an untransformed PyTorchDataset, sample i has i + 1 frames filled with i'''
+
+    def __init__(self, root: Path, samples: int) -> None:
+        self.root = root
+        self.mode = "train"
+        self.train_samples = [root / "video" / f"{i}.json" for i in range(samples)]
+        self.load_clips = True
+        self.clip_size = (4, 4)
+        self.clip_transform = self.keypoints_transform = self.label_transform = None
+
+    def __len__(self) -> int:
+        return len(self.train_samples)
+
+    def __getitem__(self, index: int) -> tuple:
+        return (
+            [torch.full((3, 4, 4), index, dtype=torch.uint8)] * (index + 1),
+            torch.full((index + 1, 5, 3), float(index)),
+            f"label {index}"
+        )
+
+@pytest.fixture
+def shards_path(tmp_path) -> Path:
+    # small shards, so samples are split in several of them
+    write_shards(FakeDataset(tmp_path, 20), tmp_path / "shards", shard_max_bytes=2000)
+    return tmp_path / "shards"
+
+def test_round_trip(shards_path):
+    dataset = ShardedDataset(str(shards_path), shuffle=False)
+    assert len(dataset.shards) > 1 and len(dataset) == 20
+    samples = list(dataset)
+    assert [label for _, _, label in samples] == [f"label {i}" for i in range(20)]
+    for i, (clip, keypoints, _) in enumerate(samples):
+        assert clip.shape == (i + 1, 3, 4, 4) and clip.dtype == torch.uint8 and bool((clip == i).all())
+        assert torch.equal(keypoints, torch.full((i + 1, 5, 3), float(i)))
+
+def test_shuffle_changes_with_epoch(shards_path):
+    dataset = ShardedDataset(str(shards_path), load_clips=False, shuffle_buffer=5)
+    first = [label for _, _, label in dataset]
+    assert first == [label for _, _, label in dataset]
+    dataset.set_epoch(1)
+    second = [label for _, _, label in dataset]
+    assert first != second and sorted(first) == sorted(second) == sorted(f"label {i}" for i in range(20))
+
+def test_workers_read_every_sample_once(shards_path):
+    dataset = ShardedDataset(str(shards_path), load_clips=False)
+    labels = [label for _, _, label in DataLoader(dataset, batch_size=None, num_workers=2)]
+    assert sorted(labels) == sorted(f"label {i}" for i in range(20))
+
+def test_ranks_split_shards(shards_path, monkeypatch):
+    dataset = ShardedDataset(str(shards_path), load_clips=False)
+    lengths = []
+    labels = []
+    for rank in range(2):
+        monkeypatch.setattr(ShardedDataset, '_get_rank', lambda self, rank=rank: (rank, 2))
+        lengths.append(len(dataset))
+        labels.append([label for _, _, label in dataset])
+        assert len(labels[-1]) == lengths[-1]
+    assert sum(lengths) == 20 and set(labels[0]).isdisjoint(labels[1])
+
+def test_too_few_shards(shards_path, monkeypatch):
+    dataset = ShardedDataset(str(shards_path), load_clips=False)
+    monkeypatch.setattr(ShardedDataset, '_get_rank', lambda self: (0, len(dataset.shards) + 1))
+    with pytest.raises(ValueError):
+        len(dataset)
+    with pytest.warns(UserWarning, match="some workers will not read"):
+        dataset._check_shards(1, len(dataset.shards) + 1)
+
+def test_prefetch_stops_when_closed():
+    closed = threading.Event()
+    def items():
+        try:
+            yield from range(1000)
+        finally:
+            closed.set()
+    prefetched = _prefetch(items(), 2)
+    assert next(prefetched) == 0
+    prefetched.close()
+    # the reading thread was blocked on the full queue, it stops and closes the iterator
+    assert closed.wait(5)
+
+def test_prefetch_raises_errors_of_the_iterator():
+    def items():
+        yield 1
+        raise OSError("broken shard")
+    with pytest.raises(OSError, match="broken shard"):
+        list(_prefetch(items(), 2))
+
+def test_early_break_closes_the_shard(shards_path):
+    dataset = ShardedDataset(str(shards_path), load_clips=False, shuffle=False)
+    threads = threading.active_count()
+    for _ in dataset:
+        break
+    deadline = time.time() + 5
+    while threading.active_count() > threads and time.time() < deadline:
+        time.sleep(.05)
+    assert threading.active_count() == threads
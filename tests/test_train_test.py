@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+from lsat.helpers.train_test import get_split_name, load_split, split_train_test, store_split
+
+
+@pytest.fixture
+def metadata() -> pd.DataFrame:
+    rows = []
+    for playlist in range(3):
+        for video in range(4):
+            for clip in range(5):
+                rows.append({
+                    'key': f"p{playlist}/v{video}/{clip}",
+                    'playlist': f"p{playlist}",
+                    'video': f"v{video}",
+                    'signer': f"s{(playlist * 4 + video) % 3}",
+                    # clips of each video are stored out of time order
+                    'start': float(4 - clip)
+                })
+    # shuffled, the result must not depend on the order of the rows
+    return pd.DataFrame(rows).set_index('key').sample(frac=1, random_state=0)
+
+def test_video_split_takes_first_clips_of_each_video(metadata):
+    train, test = split_train_test(metadata, "video", .8)
+    assert len(train) == 48 and len(test) == 12
+    # the clip with the latest start of each video is the one left for test
+    assert all(key.endswith('/0') for key in test)
+
+@pytest.mark.parametrize("strategy", ["playlist", "signer"])
+def test_group_splits_do_not_share_groups(metadata, strategy):
+    train, test = split_train_test(metadata, strategy, .6, seed=1)
+    assert sorted(train + test) == sorted(metadata.index)
+    assert set(metadata.loc[train, strategy]).isdisjoint(metadata.loc[test, strategy])
+    assert len(test) != 0
+
+def test_random_split_is_seeded(metadata):
+    train, test = split_train_test(metadata, "random", .8, seed=3)
+    assert len(train) == 48 and sorted(train + test) == sorted(metadata.index)
+    assert (train, test) == split_train_test(metadata.sample(frac=1, random_state=1), "random", .8, seed=3)
+    assert train != split_train_test(metadata, "random", .8, seed=4)[0]
+
+def test_split_needs_the_group_column(metadata):
+    with pytest.raises(ValueError):
+        split_train_test(metadata.drop(columns='signer'), "signer")
+    with pytest.raises(ValueError, match="no signer ids"):
+        split_train_test(metadata.assign(signer=None), "signer")
+    with pytest.raises(ValueError, match="at least 2"):
+        split_train_test(metadata.assign(playlist="p0"), "playlist")
+
+def test_clips_without_signer_are_grouped_by_video(metadata):
+    metadata = metadata.assign(signer=metadata['signer'].where(metadata['playlist'] != "p0"))
+    train, test = split_train_test(metadata, "signer", .6, seed=1)
+    assert sorted(train + test) == sorted(metadata.index)
+    unknown = metadata[metadata['signer'].isna()]
+    # each video of the unknown signers goes whole to train or test
+    assert all(set(clips.index) <= set(train) or set(clips.index) <= set(test) for _, clips in unknown.groupby('video'))
+
+def test_split_round_trip(tmp_path, metadata):
+    train, test = split_train_test(metadata, "random", .8)
+    split = {'strategy': "random", 'train_ratio': .8, 'seed': 0, 'train': train, 'test': test}
+    path = tmp_path / f"{get_split_name('random', .8, 0)}.json"
+    store_split(path, split)
+    assert load_split(path) == split
+    # samples removed from the index are left out, the rest keep their set
+    removed = {train[0], test[0]}
+    loaded = load_split(path, metadata.drop(index=list(removed)).index)
+    assert loaded['train'] == train[1:] and loaded['test'] == test[1:]
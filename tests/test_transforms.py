@@ -0,0 +1,62 @@
+import random
+
+import pytest
+import torch
+
+pytest.importorskip('torchvision')
+from torchvision.transforms.functional import crop, resize
+
+from lsat.dataset.transforms import crop_and_resize_frames, get_roi_selector_transform
+
+
+def frame_roi_selector_transform(img, roi, height, width):
+    '''The previous per-frame transform, kept as reference'''
+    img = crop(img, int(roi['y1']), int(roi['x1']), int(roi['height']), int(roi['width']))
+    pad = torch.zeros(3, height, width, dtype=torch.uint8)
+    if (roi['height'] - height) > (roi['width'] - width):
+        new_width = int(roi['width']*height/roi['height'])
+        img = resize(img, [height, new_width])
+        pad[:, :, int((width - new_width)/2):-int((width - new_width)/2) - (1 if (width - new_width) % 2 == 1 else 0)] = img
+    else:
+        new_height = int(roi['height']*width/roi['width'])
+        img = resize(img, [new_height, width])
+        pad[:, int((height - new_height)/2):-int((height - new_height)/2) - (1 if (height - new_height) % 2 == 1 else 0), :] = img
+    return pad
+
+def random_roi(rng, integer):
+    value = (lambda low, high: rng.randint(low, high)) if integer else rng.uniform
+    return {'x1': value(0, 20), 'y1': value(0, 20), 'width': value(2, 40), 'height': value(2, 40)}
+
+def fits_reference(roi, height, width):
+    # the reference fails when the roi fills the whole target with no padding, or is resized to nothing
+    if (roi['height'] - height) > (roi['width'] - width):
+        return 0 < int(roi['width']*height/roi['height']) < width
+    return 0 < int(roi['height']*width/roi['width']) < height
+
+@pytest.mark.parametrize('integer', [True, False])
+def test_matches_per_frame_transform(integer):
+    rng = random.Random(0)
+    frames = torch.randint(0, 256, (6, 3, 64, 64), dtype=torch.uint8)
+    cases = 0
+    while cases < 100:
+        height, width = rng.randint(8, 40), rng.randint(8, 40)
+        # some frames share a roi, so they are resized together
+        rois = [random_roi(rng, integer) for _ in range(3)] * 2
+        if not all(fits_reference(roi, height, width) for roi in rois):
+            continue
+        cases += 1
+        expected = torch.stack([frame_roi_selector_transform(frame, roi, height, width) for frame, roi in zip(frames, rois)])
+        assert torch.equal(crop_and_resize_frames(frames, rois, height, width), expected)
+
+def test_float_roi_keeps_its_letterbox_size():
+    roi = {'x1': 1.5, 'y1': 2.5, 'height': 34.28, 'width': 5.99}
+    frames = torch.randint(0, 256, (2, 3, 64, 64), dtype=torch.uint8)
+    expected = torch.stack([frame_roi_selector_transform(frame, roi, 31, 17) for frame in frames])
+    assert torch.equal(crop_and_resize_frames(frames, [roi] * 2, 31, 17), expected)
+
+def test_reused_buffer():
+    rng = random.Random(1)
+    transform = get_roi_selector_transform(16, 16, [random_roi(rng, False) for _ in range(4)], reuse_buffer=True)
+    frames = torch.randint(0, 256, (4, 3, 64, 64), dtype=torch.uint8)
+    first = transform(frames).clone()
+    assert torch.equal(transform(list(frames)[:3]), first[:3])